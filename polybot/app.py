@@ -1,18 +1,71 @@
+import time
+started = time.perf_counter()
+
 import flask
 from flask import request
 import os
-from bot import ImageProcessingBot  # Assuming this is your handler class
+from loguru import logger
+from prometheus_flask_exporter import PrometheusMetrics
+from prometheus_flask_exporter.multiprocess import GunicornInternalPrometheusMetrics
+from polybot import metrics, tracing
+from polybot.bot import ImageProcessingBot
+from polybot.outbound import OutboundScheduler
+from polybot.predictions import PredictionAggregator
+from polybot.sqs_producer import BatchingSqsProducer
+from polybot.workers import BackgroundTasks, FilterPool, MessageDispatcher
 
 app = flask.Flask(__name__)
 app.url_map.strict_slashes = False  # Accept /TOKEN and /TOKEN/ the same
 
+# /metrics with request counts and latencies per route plus everything in polybot.metrics; grouped by
+# endpoint name so the bot token in the webhook path never becomes a label. Under gunicorn with
+# $PROMETHEUS_MULTIPROC_DIR set, every worker writes there and /metrics aggregates all of them.
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    prometheus_metrics = GunicornInternalPrometheusMetrics(app, group_by='endpoint')
+else:
+    prometheus_metrics = PrometheusMetrics(app, group_by='endpoint')
+
 # Load config from env
 TELEGRAM_BOT_TOKEN = os.environ['TELEGRAM_BOT_TOKEN']
 BOT_APP_URL = os.environ['BOT_APP_URL']
 
+# OTLP trace export when $OTEL_EXPORTER_OTLP_ENDPOINT is set
+tracing.configure_tracing()
+
 # INIT BOT HERE — before any route
 bot = ImageProcessingBot(TELEGRAM_BOT_TOKEN, BOT_APP_URL)
 
+# CPU-bound filters run in a process pool, whole message jobs on a bounded thread pool
+bot.filter_pool = FilterPool()
+bot.filter_pool.warm_up()
+bot.background_tasks = BackgroundTasks()
+bot.sqs_producer = BatchingSqsProducer(bot.sqs_client, bot.sqs_queue_url)
+# replies and notices are paced under Telegram's global and per-chat limits
+bot.outbound = OutboundScheduler()
+# detection results for the same chat that arrive close together are answered in one message; pending
+# results are kept in the bot's state backend, so the workers sharing it batch them together
+bot.prediction_results = PredictionAggregator(
+    bot.deliver_predictions, bot.state.namespace('pending_predictions', max_size=10000, ttl=600))
+dispatcher = MessageDispatcher(bot.handle_message)
+# debounced albums are processed as jobs on the same bounded queue
+bot.dispatcher = dispatcher
+
+time_to_ready = time.perf_counter() - started
+metrics.TIME_TO_READY.set(time_to_ready)
+logger.info(f"Ready to serve after {time_to_ready:.2f}s")
+
+
+def shutdown():
+    """Drain in-flight jobs, queued messages and side effects; called by gunicorn's worker_exit hook"""
+    logger.info("Shutting down: draining jobs, side effects and SQS buffer")
+    dispatcher.shutdown()
+    bot.background_tasks.shutdown()
+    bot.prediction_results.close()
+    bot.outbound.shutdown()
+    bot.sqs_producer.close()
+    bot.filter_pool.shutdown()
+
+
 @app.route('/', methods=['GET'])
 def index():
     return 'Ok'
@@ -26,7 +79,9 @@ def health():
 @app.route(f'/{TELEGRAM_BOT_TOKEN}/', methods=['POST'])
 def webhook():
     req = request.get_json()
-    bot.handle_message(req['message'])
+    msg = req['message']
+    if not dispatcher.submit(msg):
+        bot.send_text(msg['chat']['id'], "I'm busy with other images right now, please try again in a minute.")
     return 'Ok'
 
 @app.route('/predictions/<prediction_id>', methods=['POST'])
@@ -38,21 +93,13 @@ def receive_prediction(prediction_id):
     if not chat_id:
         return "Missing chat_id", 400
 
-    # Try to get image number from bot's map
-    image_number = None
-    if hasattr(bot, "prediction_number_map") and prediction_id in bot.prediction_number_map:
-        chat_id, image_number = bot.prediction_number_map[prediction_id]
-
-    if image_number is not None:
-        header = f"Detection result for Image {image_number}:"
-    else:
-        header = f"Detection result:"
-
-    detected_objects = ", ".join(labels) if labels else "Nothing detected"
-    bot.send_text(chat_id, f"{header} {detected_objects}")
+    # continue the detect request's trace: from the callback body if the detector echoes it, else as recorded on enqueue
+    parent = tracing.extract(data.get("trace_context") or bot.prediction_traces.get(prediction_id))
+    with tracing.span('receive_prediction', parent=parent, prediction_id=prediction_id, labels=len(labels)):
+        bot.receive_prediction(prediction_id, chat_id, labels)
     return "Received", 200
 
 
-
 if __name__ == "__main__":
+    # development server only; production runs gunicorn with polybot/gunicorn_conf.py
     app.run(host='0.0.0.0', port=8000)
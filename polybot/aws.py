@@ -0,0 +1,34 @@
+import os
+import threading
+import boto3
+
+AWS_REGION = 'eu-west-2'
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def shared_client(service, region_name=AWS_REGION):
+    """
+    One boto3 client per service, region and process; clients are thread-safe so every bot and
+    worker thread can share them. Keyed by pid so a forked child never reuses its parent's connections.
+    """
+    key = (service, region_name, os.getpid())
+    with _lock:
+        if key not in _clients:
+            _clients[key] = boto3.client(service, region_name=region_name)
+        return _clients[key]
+
+
+class LazyClient:
+    """Stands in for a boto3 client and creates the shared one on first use, keeping it off the startup path"""
+
+    def __init__(self, service, region_name=AWS_REGION):
+        self.service = service
+        self.region_name = region_name
+
+    def __getattr__(self, name):
+        return getattr(shared_client(self.service, self.region_name), name)
+
+    def __repr__(self):
+        return f'LazyClient({self.service!r}, {self.region_name!r})'
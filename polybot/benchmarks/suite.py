@@ -0,0 +1,235 @@
+"""
+Speed benchmarks for every Img filter and for ImageProcessingBot.handle_message end to end.
+
+    python -m polybot.benchmarks.suite                                # all sizes, print a table
+    python -m polybot.benchmarks.suite --sizes 90,320 --only blur     # a subset
+    python -m polybot.benchmarks.suite --save-baseline baseline.json  # record numbers for this machine
+    python -m polybot.benchmarks.suite --check baseline.json          # exit 1 if p50 regressed > 20%
+
+Filters and encoding run on synthetic grayscale images of each size (square, or 3840x2160 for
+``4k``), decoding on a JPEG of that size; the handler benchmark feeds the same JPEG through
+handle_message with Telegram and S3 mocked and the result cache off. Each benchmark reports
+p50/p99 latency, throughput and the peak memory traced by tracemalloc during one extra run.
+Baselines are machine specific: save and check them on the same host.
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+from loguru import logger
+
+from polybot.img_proc import Img
+
+SIZES = {'90': (90, 90), '320': (320, 320), '1280': (1280, 1280), '4k': (2160, 3840)}
+BLUR_LEVELS = (2, 16, 64)
+HANDLER_CAPTIONS = ('blur', 'contour', 'rotate then segment')
+
+# name -> function applying the filter to an Img
+FILTER_BENCHMARKS = {
+    **{f'blur({level})': (lambda level: lambda img: img.blur(level))(level) for level in BLUR_LEVELS},
+    'blur(16, gaussian)': lambda img: img.blur(16, kernel='gaussian'),
+    'contour': lambda img: img.contour(),
+    'rotate': lambda img: img.rotate(),
+    'rotate2': lambda img: img.rotate2(),
+    'salt_n_pepper': lambda img: img.salt_n_pepper(),
+    'salt_n_pepper(seeded)': lambda img: img.salt_n_pepper(seed=0),
+    'gaussian_noise': lambda img: img.gaussian_noise(),
+    'speckle': lambda img: img.speckle(),
+    'segment': lambda img: img.segment(),
+    'brighten': lambda img: img.brighten(),
+    'darken': lambda img: img.darken(),
+    'invert': lambda img: img.invert(),
+    'concat': lambda img: img.concat(img),
+    'concat(9, grid)': lambda img: img.concat(img, 'grid', others=[img] * 7),
+    'encode': lambda img: img.encode(),
+}
+# name -> function decoding a JPEG (bytes) to an Img
+DECODE_BENCHMARKS = {
+    'decode': lambda data: Img(data),
+    'decode(max_size=320)': lambda data: Img(data, max_size=320),
+}
+
+
+def synthetic_pixels(shape, seed=0):
+    """Deterministic image with smooth gradients and texture, so no filter hits a trivial fast path"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:shape[0], 0:shape[1]]
+    pixels = 127.5 + 60 * np.sin(x / 37.0) * np.cos(y / 23.0) + rng.normal(0, 25, shape)
+    return np.clip(pixels, 0, 255)
+
+
+def encoded_image(shape):
+    return Img.from_array(synthetic_pixels(shape)).encode()
+
+
+def repeats_for(shape, repeat):
+    """Fewer runs for big images so a full suite finishes in minutes"""
+    return max(5, min(repeat, int(repeat * 320 * 320 / (shape[0] * shape[1]))))
+
+
+def measure(fn, setup, runs):
+    """Run ``fn(setup())`` ``runs`` times, timing only ``fn``; returns sorted seconds and peak traced bytes"""
+    durations = []
+    for _ in range(runs):
+        arg = setup()
+        start = time.perf_counter()
+        fn(arg)
+        durations.append(time.perf_counter() - start)
+
+    arg = setup()
+    tracemalloc.start()
+    try:
+        fn(arg)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return sorted(durations), peak
+
+
+def summarize(name, size, shape, durations, peak):
+    p50 = durations[len(durations) // 2]
+    return {
+        'name': name,
+        'size': size,
+        'runs': len(durations),
+        'p50_ms': p50 * 1000,
+        'p99_ms': durations[min(len(durations) - 1, int(len(durations) * 0.99))] * 1000,
+        'throughput_per_s': len(durations) / sum(durations),
+        'mpix_per_s': shape[0] * shape[1] / 1e6 / p50,
+        'peak_mb': peak / 2 ** 20,
+    }
+
+
+def bench_filters(sizes, repeat, only=None):
+    results = []
+    for size in sizes:
+        shape = SIZES[size]
+        pixels = synthetic_pixels(shape)
+
+        def setup():
+            return Img.from_array(pixels.copy())
+
+        for name, fn in FILTER_BENCHMARKS.items():
+            if only and not name.startswith(only):
+                continue
+            durations, peak = measure(fn, setup, repeats_for(shape, repeat))
+            results.append(summarize(name, size, shape, durations, peak))
+    return results
+
+
+def bench_decode(sizes, repeat, only=None):
+    results = []
+    for size in sizes:
+        shape = SIZES[size]
+        data = encoded_image(shape)
+        for name, fn in DECODE_BENCHMARKS.items():
+            if only and not name.startswith(only):
+                continue
+            durations, peak = measure(fn, lambda: data, repeats_for(shape, repeat))
+            results.append(summarize(name, size, shape, durations, peak))
+    return results
+
+
+def bench_handler(sizes, repeat, only=None):
+    from polybot.bot import ImageProcessingBot
+
+    with patch('telebot.TeleBot') as mock_telebot:
+        bot = ImageProcessingBot(token='bot_token', telegram_chat_url='webhook_url', register_webhook=False)
+    bot.telegram_bot_client = mock_telebot.return_value
+    bot.storage_mode = 'memory'
+    bot.s3_bucket_name = 'bucket'
+    bot.s3_client = MagicMock()
+    bot.new_users.add_if_absent(1)
+
+    results = []
+    counter = iter(range(sys.maxsize))
+    for size in sizes:
+        shape = SIZES[size]
+        bot.telegram_bot_client.download_file.return_value = encoded_image(shape)
+        for caption in HANDLER_CAPTIONS:
+            name = f'handle_message({caption})'
+            if only and not name.startswith(only):
+                continue
+
+            def setup():
+                n = next(counter)
+                return {'message_id': n, 'from': {'id': 1}, 'chat': {'id': 1}, 'caption': caption,
+                        'photo': [{'file_id': f'file{n}', 'file_unique_id': f'unique{n}'}]}
+
+            durations, peak = measure(bot.handle_message, setup, repeats_for(shape, repeat))
+            if bot.telegram_bot_client.send_photo.call_count == 0:
+                raise RuntimeError(f"{name} did not send a photo, the benchmark is not measuring the filter path")
+            bot.telegram_bot_client.send_photo.reset_mock()
+            results.append(summarize(name, size, shape, durations, peak))
+    return results
+
+
+def key(result):
+    return f"{result['name']}@{result['size']}"
+
+
+def find_regressions(results, baseline, threshold):
+    """Results whose p50 is more than ``threshold`` (0.2 = 20%) slower than the baseline's"""
+    previous = {key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(key(result))
+        if old and result['p50_ms'] > old['p50_ms'] * (1 + threshold):
+            regressions.append((result, old))
+    return regressions
+
+
+def print_table(results, out=sys.stdout):
+    print(f"{'benchmark':<38}{'size':>6}{'runs':>6}{'p50 ms':>10}{'p99 ms':>10}{'ops/s':>9}{'Mpix/s':>9}{'peak MB':>9}",
+          file=out)
+    for r in results:
+        print(f"{r['name']:<38}{r['size']:>6}{r['runs']:>6}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+              f"{r['throughput_per_s']:>9.1f}{r['mpix_per_s']:>9.1f}{r['peak_mb']:>9.1f}", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=','.join(SIZES), help=f"comma separated, from {', '.join(SIZES)}")
+    parser.add_argument('--repeat', type=int, default=30, help='runs per benchmark at 320px (scaled down for larger)')
+    parser.add_argument('--only', help='run benchmarks whose name starts with this')
+    parser.add_argument('--no-handler', action='store_true', help='skip the end-to-end handle_message benchmarks')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--save-baseline', help='write the results as a baseline file')
+    parser.add_argument('--check', help='compare against this baseline file and exit 1 on regressions')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed p50 slowdown for --check (0.2 = 20%%)')
+    args = parser.parse_args(argv)
+    # per-message INFO logs would drown the table
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+    sizes = args.sizes.split(',')
+    unknown = set(sizes) - set(SIZES)
+    if unknown:
+        parser.error(f"unknown sizes: {', '.join(sorted(unknown))}")
+
+    results = bench_filters(sizes, args.repeat, args.only) + bench_decode(sizes, args.repeat, args.only)
+    if not args.no_handler:
+        results += bench_handler(sizes, args.repeat, args.only)
+    print_table(results)
+
+    for path in filter(None, (args.json, args.save_baseline)):
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.check:
+        with open(args.check) as f:
+            regressions = find_regressions(results, json.load(f), args.threshold)
+        for result, old in regressions:
+            print(f"REGRESSION {key(result)}: p50 {old['p50_ms']:.2f}ms -> {result['p50_ms']:.2f}ms", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"No regressions over {args.threshold:.0%} against {args.check}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""
+Webhook load benchmark: how many Telegram updates per second the web tier can acknowledge.
+
+    python -m polybot.benchmarks.webhook_load --server dev
+    python -m polybot.benchmarks.webhook_load --server gunicorn --requests 4000 --concurrency 32
+
+The script starts a stub Telegram Bot API on localhost (every method answers ``ok``), launches
+polybot against it with the chosen server, waits for /health, then posts text-message updates
+to the webhook from ``--concurrency`` client threads and reports throughput and latency.
+Use ``--url`` instead of ``--server`` to load an already running instance.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+TOKEN = '123456:bench'
+
+
+class StubTelegramApi(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        method = self.path.split('?', 1)[0].rsplit('/', 1)[-1]
+        result = {'url': '', 'has_custom_certificate': False, 'pending_update_count': 0} if method == 'getWebhookInfo' else True
+        if method in ('getMe', 'sendMessage'):
+            result = {'id': 1, 'is_bot': True, 'first_name': 'bench', 'message_id': 1, 'date': 0,
+                      'chat': {'id': 1, 'type': 'private'}}
+        body = json.dumps({'ok': True, 'result': result}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(kind, api_port, port):
+    env = dict(os.environ,
+               TELEGRAM_BOT_TOKEN=TOKEN,
+               BOT_APP_URL='https://bench.invalid',
+               TELEGRAM_API_URL=f'http://127.0.0.1:{api_port}/bot{{0}}/{{1}}',
+               POLYBOT_BIND=f'127.0.0.1:{port}',
+               AWS_DEFAULT_REGION='eu-west-2',
+               PYTHONPATH=os.getcwd())
+    if kind == 'dev':
+        command = [sys.executable, 'polybot/app.py']
+    else:
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'polybot/gunicorn_conf.py', 'polybot.app:app']
+    return subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_until_healthy(base_url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f'{base_url}/health', timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{base_url} did not become healthy within {timeout}s")
+
+
+def run_load(base_url, total, concurrency):
+    local = threading.local()
+    update = {'update_id': 1, 'message': {'message_id': 1, 'from': {'id': 1}, 'chat': {'id': 1}, 'text': 'hi'}}
+
+    def post(_):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        response = local.session.post(f'{base_url}/{TOKEN}/', json=update, timeout=30)
+        return time.perf_counter() - start, response.ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(post, range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        'requests': total,
+        'errors': sum(1 for _, ok in results if not ok),
+        'throughput_rps': total / elapsed,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=['dev', 'gunicorn'], default='gunicorn')
+    parser.add_argument('--url', help='benchmark an already running instance instead of starting one')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    process = None
+    stub = None
+    base_url = args.url
+    if base_url is None:
+        stub = ThreadingHTTPServer(('127.0.0.1', 0), StubTelegramApi)
+        threading.Thread(target=stub.serve_forever, daemon=True).start()
+        process = start_server(args.server, stub.server_port, args.port)
+        base_url = f'http://127.0.0.1:{args.port}'
+
+    try:
+        wait_until_healthy(base_url)
+        run_load(base_url, min(200, args.requests), args.concurrency)  # warm-up
+        result = run_load(base_url, args.requests, args.concurrency)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=60)
+        if stub is not None:
+            stub.shutdown()
+
+    print(json.dumps(dict(result, server=args.url or args.server, concurrency=args.concurrency), indent=2))
+
+
+if __name__ == '__main__':
+    main()
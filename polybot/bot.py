@@ -1,55 +1,122 @@
 import json
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from io import BytesIO
 
 import requests
 import telebot
 from loguru import logger
 import os
-import time
-from telebot.types import InputFile
+import threading
+from telebot.types import InputFile, InputMediaPhoto
 from polybot.img_proc import Img
-import boto3
+from polybot.pipeline import parse_caption, describe, is_deterministic
+from polybot.cache import ResultCache
+from polybot.photo_sizes import PhotoSizePolicy
+from polybot.predictions import Prediction, format_predictions
+from polybot.state import create_backend, compact_photo_message
+from polybot import metrics, tracing
+from polybot.workers import DelayedCalls, filter_image_with_stats, record_filter_stats, run_with_retries
+from polybot.aws import LazyClient
+from polybot.telegram_http import install_session
+from polybot.outbound import REPLY, NOTICE
 from botocore.exceptions import NoCredentialsError
 import uuid
 
+# one filtered album photo: a Telegram file_id from the result cache, or the image (path or bytes) to upload;
+# ``fresh`` marks images filtered for this request, which are archived and cached once sent
+AlbumPhoto = namedtuple('AlbumPhoto', ['file_id', 'image', 'cache_key', 'fresh'])
+
+# Telegram accepts 2-10 photos per sendMediaGroup call
+MAX_ALBUM_SIZE = 10
+
+# point at a self-hosted Bot API server (or a local stub for load tests)
+if os.environ.get('TELEGRAM_API_URL'):
+    telebot.apihelper.API_URL = os.environ['TELEGRAM_API_URL']
 
 
 class Bot:
 
-    def __init__(self, token, telegram_chat_url):
+    def __init__(self, token, telegram_chat_url, register_webhook=None):
+        # all bots share one pooled keep-alive session for Telegram calls
+        install_session()
+
         # create a new instance of the TeleBot class.
         # all communication with Telegram servers are done using self.telegram_bot_client
         self.telegram_bot_client = telebot.TeleBot(token)
-
-        # remove any existing webhooks configured in Telegram servers
-        self.telegram_bot_client.remove_webhook()
-        time.sleep(0.5)
-
-        # set the webhook URL
-        self.telegram_bot_client.set_webhook(url=f'{telegram_chat_url}/{token}/', timeout=60)
-
-        logger.info(f'Telegram Bot information\n\n{self.telegram_bot_client.get_me()}')
-
-    def send_text(self, chat_id, text):
-        self.telegram_bot_client.send_message(chat_id, text)
+        self.webhook_url = f'{telegram_chat_url}/{token}/'
+        # optional polybot.outbound.OutboundScheduler; messages are sent immediately when unset
+        self.outbound = None
+
+        # registration runs off the startup path so a slow Telegram API never delays binding the port;
+        # under gunicorn the master registers once and workers start with $POLYBOT_REGISTER_WEBHOOK=0
+        if register_webhook is None:
+            register_webhook = os.environ.get('POLYBOT_REGISTER_WEBHOOK', '1') == '1'
+        if register_webhook:
+            threading.Thread(target=run_with_retries, args=(self.register_webhook, ()),
+                             kwargs={'retries': 3, 'backoff': 1}, name='webhook-registration', daemon=True).start()
+
+    def register_webhook(self):
+        """Point Telegram at this bot's webhook, skipping the call when it is already set"""
+        if self.telegram_bot_client.get_webhook_info().url == self.webhook_url:
+            logger.info('Webhook already registered')
+            return True
+        # set_webhook replaces any existing webhook, so no remove_webhook round trip is needed
+        self.telegram_bot_client.set_webhook(url=self.webhook_url, timeout=60)
+        logger.info('Webhook registered')
+        return True
+
+    def _send(self, chat_id, fn, *args, priority=NOTICE, coalesce_key=None, wait=False):
+        """Call ``fn(*args)`` now, or queue it on the outbound scheduler (waiting for the result if ``wait``)"""
+        if self.outbound is None:
+            return fn(*args)
+        future = self.outbound.submit(chat_id, fn, *args, priority=priority, coalesce_key=coalesce_key)
+        return future.result() if wait else None
+
+    def send_text(self, chat_id, text, priority=NOTICE):
+        """Status texts default to NOTICE priority; repeats of one still queued for the chat are sent once"""
+        self._send(chat_id, self.telegram_bot_client.send_message, chat_id, text,
+                   priority=priority, coalesce_key=text if priority == NOTICE else None)
 
     def send_text_with_quote(self, chat_id, text, quoted_msg_id):
-        self.telegram_bot_client.send_message(chat_id, text, reply_to_message_id=quoted_msg_id)
+        self._send(chat_id, lambda: self.telegram_bot_client.send_message(chat_id, text, reply_to_message_id=quoted_msg_id),
+                   priority=REPLY)
 
     def is_current_msg_photo(self, msg):
         return 'photo' in msg
 
-    def download_user_photo(self, msg):
+    def _download_photo(self, msg, photo=None):
         if not self.is_current_msg_photo(msg):
             raise RuntimeError(f'Message content of type \'photo\' expected')
 
-        file_info = self.telegram_bot_client.get_file(msg['photo'][-1]['file_id'])
-        data = self.telegram_bot_client.download_file(file_info.file_path)
+        largest = msg['photo'][-1]
+        photo = photo or largest
+        with metrics.stage('download'):
+            file_info = self.telegram_bot_client.get_file(photo['file_id'])
+            data = self.telegram_bot_client.download_file(file_info.file_path)
+        metrics.IMAGE_BYTES.labels(direction='download').observe(len(data))
+        if photo is not largest:
+            metrics.PHOTO_DOWNSIZED.inc()
+            if largest.get('file_size'):
+                metrics.PHOTO_BYTES_SAVED.inc(max(0, largest['file_size'] - len(data)))
+        return file_info, data
+
+    def download_user_photo_bytes(self, msg, photo=None):
+        """Download the photo into memory and return its encoded bytes"""
+        return self._download_photo(msg, photo)[1]
+
+    def download_user_photo(self, msg, photo=None):
+        """
+        Download the photo to ``photos_dir`` and return the path. ``photo`` is one of the message's
+        PhotoSize dicts, the largest by default.
+        """
+        file_info, data = self._download_photo(msg, photo)
 
         # Generate a unique filename using UUID
         ext = os.path.splitext(file_info.file_path)[1] or ".jpg"
         unique_filename = f"{uuid.uuid4()}{ext}"
-        folder_name = "photos"
+        folder_name = self.photos_dir
         os.makedirs(folder_name, exist_ok=True)
         full_path = os.path.join(folder_name, unique_filename)
 
@@ -59,13 +126,24 @@ class Bot:
         return full_path
 
     def send_photo(self, chat_id, img_path):
-        if not os.path.exists(img_path):
+        """``img_path`` is a path to the image, or the encoded image bytes"""
+        if isinstance(img_path, bytes):
+            photo = InputFile(BytesIO(img_path), file_name='photo.jpg')
+            size = len(img_path)
+        elif not os.path.exists(img_path):
             raise RuntimeError("Image path doesn't exist")
+        else:
+            photo = InputFile(img_path)
+            size = os.path.getsize(img_path)
+
+        metrics.IMAGE_BYTES.labels(direction='send').observe(size)
+        with metrics.stage('send'):
+            return self._send(chat_id, self.telegram_bot_client.send_photo, chat_id, photo, priority=REPLY, wait=True)
 
-        self.telegram_bot_client.send_photo(
-            chat_id,
-            InputFile(img_path)
-        )
+    def send_photo_by_id(self, chat_id, file_id):
+        """Send a photo already stored on Telegram's servers, without uploading it again"""
+        with metrics.stage('send'):
+            return self._send(chat_id, self.telegram_bot_client.send_photo, chat_id, file_id, priority=REPLY, wait=True)
 
     def handle_message(self, msg):
         """Bot Main message handler"""
@@ -81,27 +159,67 @@ class QuoteBot(Bot):
             self.send_text_with_quote(msg['chat']['id'], msg["text"], quoted_msg_id=msg["message_id"])
 
 
+def image_document_as_photo(msg):
+    """
+    A message with an image sent as a file (a document, kept at full resolution) as a photo
+    message whose only size is that file, so it is filtered like a photo
+    """
+    document = msg.get('document')
+    if 'photo' in msg or not document or not document.get('mime_type', '').startswith('image/'):
+        return msg
+    return dict(msg, photo=[document])
+
+
 class ImageProcessingBot(Bot):
-    def __init__(self, token, telegram_chat_url):
-        super().__init__(token, telegram_chat_url)
-        self.media_groups = {}
-        self.image_counter = {}
-        self.prediction_number_map = {}
-        self.new_users = set()
-        self.processed_media_groups = set()
+    def __init__(self, token, telegram_chat_url, register_webhook=None):
+        super().__init__(token, telegram_chat_url, register_webhook)
+        # bounded, expiring state so abandoned albums and old predictions do not pile up; with a
+        # shared backend ($POLYBOT_STATE_BACKEND) any replica can continue an album or answer a prediction
+        self.state = create_backend()
+        self.media_groups = self.state.namespace('media_groups', max_size=10000, ttl=300)
+        self.media_group_captions = self.state.namespace('media_group_captions', max_size=10000, ttl=300)
+        self.image_counter = self.state.namespace('image_counter', max_size=100000, ttl=24 * 3600)
+        self.prediction_number_map = self.state.namespace('prediction_number_map', max_size=100000, ttl=3600)
+        self.new_users = self.state.namespace('new_users', max_size=100000, ttl=7 * 24 * 3600)
+        self.processed_media_groups = self.state.namespace('processed_media_groups', max_size=10000, ttl=600)
+        # trace context of each detect request, so the prediction callback joins its trace
+        self.prediction_traces = self.state.namespace('prediction_traces', max_size=100000, ttl=3600)
         self.valid_filters = [
-            'concat','concat horizontal', 'concat vertical', 'blur', 'contour',
-            'rotate', 'segment', 'salt and pepper', 'rotate2',
+            'concat','concat horizontal', 'concat vertical', 'concat grid', 'blur', 'contour',
+            'rotate', 'segment', 'salt and pepper', 'gaussian', 'speckle', 'rotate2',
             'brighten', 'darken', 'invert','detect'
         ]
         self.s3_bucket_name = os.environ.get("S3_BUCKET_NAME")
-        self.s3_client = boto3.client("s3", region_name="eu-west-2")
-        self.sqs_client = boto3.client("sqs", region_name="eu-west-2")
+        # created on first upload / enqueue and shared by every bot in the process
+        self.s3_client = LazyClient("s3")
+        self.sqs_client = LazyClient("sqs")
         self.sqs_queue_url = os.environ.get("SQS_QUEUE_URL")
+        # optional polybot.sqs_producer.BatchingSqsProducer; one send_message per request when unset
+        self.sqs_producer = None
+        # optional polybot.workers.FilterPool; filters run in-process when unset
+        self.filter_pool = None
+        # optional polybot.workers.BackgroundTasks; side effects run inline (single attempt) when unset
+        self.background_tasks = None
+        # optional polybot.workers.MessageDispatcher; albums are processed on the debounce thread when unset
+        self.dispatcher = None
+        # optional polybot.predictions.PredictionAggregator; each detection result is sent on its own when unset
+        self.prediction_results = None
+        self.upload_retries = int(os.environ.get('POLYBOT_UPLOAD_RETRIES', 3))
+        self.result_cache = ResultCache()
+        # which photo size to download for a filter pipeline (the largest unless a smaller one is enough)
+        self.photo_policy = PhotoSizePolicy()
+        # an album is filtered once no photo has joined it for this long
+        self.album_debounce = float(os.environ.get('POLYBOT_ALBUM_DEBOUNCE', 1.0))
+        self.album_threads = int(os.environ.get('POLYBOT_ALBUM_THREADS', 4))
+        self.album_timers = DelayedCalls()
+        # 'disk' keeps every photo under photos_dir, 'memory' never touches the filesystem
+        self.storage_mode = os.environ.get('POLYBOT_STORAGE', 'disk')
+        self.photos_dir = os.environ.get('POLYBOT_PHOTOS_DIR', 'photos')
 
         logger.info(f"Loaded S3_BUCKET_NAME from env: {self.s3_bucket_name}")
 
-    def send_to_sqs(self, prediction_id, chat_id, image_name, image_number=None):
+    def send_to_sqs(self, prediction_id, chat_id, image_name, image_number=None, on_failure=None):
+        """Queue the image for detection; with a batching producer, ``on_failure()`` runs if SQS never takes it"""
         message = {
             "prediction_id": prediction_id,
             "chat_id": chat_id,
@@ -112,22 +230,44 @@ class ImageProcessingBot(Bot):
         if image_number is not None:
             message["image_number"] = image_number
 
-        response = self.sqs_client.send_message(
-            QueueUrl=self.sqs_queue_url,
-            MessageBody=json.dumps(message)
-        )
+        trace_context = tracing.inject()
+        if trace_context:
+            message["trace_context"] = trace_context
+            self.prediction_traces[prediction_id] = trace_context
+
+        if self.sqs_producer is not None:
+            with metrics.stage('enqueue'):
+                self.sqs_producer.send(json.dumps(message), on_failure=on_failure)
+            logger.info(f"Queued prediction {prediction_id} (image {image_number}) for SQS.")
+            return None
+
+        with metrics.stage('enqueue'):
+            response = self.sqs_client.send_message(
+                QueueUrl=self.sqs_queue_url,
+                MessageBody=json.dumps(message)
+            )
         logger.success(f"✅ Sent prediction {prediction_id} (image {image_number}) to SQS.")
         return response
 
     def upload_to_s3(self, file_path):
+        """``file_path`` is a path to the image, or the encoded image bytes to upload as ``<uuid>.jpg``"""
         try:
             if not self.s3_bucket_name:
                 logger.error("S3_BUCKET_NAME not defined; cannot upload")
                 return None
 
+            if isinstance(file_path, bytes):
+                image_name = f"{uuid.uuid4()}.jpg"
+                logger.info(f"Attempting to upload {len(file_path)} bytes as {image_name} to bucket {self.s3_bucket_name}")
+                with metrics.stage('upload'):
+                    self.s3_client.upload_fileobj(BytesIO(file_path), self.s3_bucket_name, image_name)
+                logger.success(f" Uploaded {image_name} to S3 bucket {self.s3_bucket_name}")
+                return image_name
+
             image_name = os.path.basename(file_path)
             logger.info(f"Attempting to upload {file_path} as {image_name} to bucket {self.s3_bucket_name}")
-            self.s3_client.upload_file(file_path, self.s3_bucket_name, image_name)
+            with metrics.stage('upload'):
+                self.s3_client.upload_file(file_path, self.s3_bucket_name, image_name)
             logger.success(f" Uploaded {image_name} to S3 bucket {self.s3_bucket_name}")
             return image_name
 
@@ -141,23 +281,298 @@ class ImageProcessingBot(Bot):
             return None
 
 
+    def run_side_effect(self, fn, *args, on_failure=None):
+        """Run a side effect the reply does not wait for, retried in the background when possible"""
+        if self.background_tasks is None:
+            return run_with_retries(fn, args, on_failure=on_failure)
+        return self.background_tasks.submit(fn, *args, retries=self.upload_retries, on_failure=on_failure)
+
+    def upload_and_enqueue(self, path, prediction_id, chat_id, image_number, on_failure=None):
+        """
+        Archive the photo in S3, then queue it for detection. Returns True on success;
+        ``on_failure`` is handed to the SQS producer for a message it gives up on later
+        """
+        image_name = self.upload_to_s3(path)
+        if not image_name:
+            return False
+
+        self.send_to_sqs(prediction_id, chat_id, image_name, image_number=image_number, on_failure=on_failure)
+        return True
+
+    def receive_prediction(self, prediction_id, chat_id, labels):
+        """Report a detection result to its chat, together with the chat's other results when aggregated"""
+        image_number = None
+        if prediction_id in self.prediction_number_map:
+            chat_id, image_number = self.prediction_number_map[prediction_id]
+
+        if self.prediction_results is None:
+            self.deliver_predictions(chat_id, [Prediction(prediction_id, image_number, labels)])
+        else:
+            self.prediction_results.add(chat_id, prediction_id, image_number, labels)
+
+    def deliver_predictions(self, chat_id, predictions):
+        """Send ``predictions`` to ``chat_id`` as one message and forget their image numbers and traces"""
+        for text in format_predictions(predictions):
+            self.send_text(chat_id, text, priority=REPLY)
+        for prediction in predictions:
+            self.prediction_number_map.pop(prediction.prediction_id, None)
+            self.prediction_traces.pop(prediction.prediction_id, None)
+
+    def fetch_photo(self, msg, photo=None):
+        """Download the message photo: a file path in 'disk' storage mode, the raw bytes in 'memory' mode"""
+        if self.storage_mode == 'memory':
+            return self.download_user_photo_bytes(msg, photo)
+        return self.download_user_photo(msg, photo)
+
+    def save_result(self, img):
+        """Persist a filtered Img according to the storage mode (a path, or the encoded bytes)"""
+        if img.path is None:
+            return img.encode()
+        return img.save_img()
+
+    def apply_filters(self, path, caption, seed=None):
+        """
+        Apply the caption's filters to the image at ``path`` (a file path or encoded bytes) and
+        return the filtered image in the same form
+        """
+        with metrics.stage('filter'):
+            if self.filter_pool is not None:
+                return self.filter_pool.apply(path, caption, seed)
+            result, stats = filter_image_with_stats(path, caption, seed)
+            record_filter_stats(stats)
+            return result
+
+    @staticmethod
+    def noise_seed(steps, cache_key):
+        """
+        Seed for the pipeline's random filters, taken from its cache key: the same photo and
+        caption always get the same noise, so those results are cached like any other
+        """
+        return None if is_deterministic(steps) else int(cache_key[:16], 16)
+
+    def send_cached_result(self, chat_id, cache_key):
+        """Answer from the result cache if possible. Returns True if the photo was sent"""
+        cached = self.result_cache.get(cache_key)
+        if cached is None:
+            return False
+
+        if cached.file_id:
+            logger.info(f"Result cache hit, resending Telegram file {cached.file_id}")
+            self.send_photo_by_id(chat_id, cached.file_id)
+        else:
+            logger.info(f"Result cache hit, sending {cached.path}")
+            self.cache_result(cache_key, None, self.send_photo(chat_id, cached.path))
+        return True
+
+    def cache_result(self, cache_key, path, sent_message):
+        if path:
+            self.result_cache.put_file(cache_key, path)
+
+        photo_sizes = getattr(sent_message, 'photo', None)
+        if photo_sizes and isinstance(photo_sizes[-1].file_id, str):
+            self.result_cache.put_file_id(cache_key, photo_sizes[-1].file_id)
+
+    def schedule_album(self, media_group_id, count):
+        """
+        Process the album ``album_debounce`` seconds from now unless another photo joins it first.
+        Every photo schedules a check with the album size it saw, so only the last one's check
+        (on whichever replica received it) finds the size unchanged.
+        """
+        self.album_timers.call_later(self.album_debounce, tracing.bind(self.dispatch_album), media_group_id, count)
+
+    def album_ready(self, media_group_id, count):
+        """True if the album still has ``count`` photos and its caption has arrived"""
+        msgs = self.media_groups.get(media_group_id) or []
+        return len(msgs) == count and bool(self.media_group_captions.get(media_group_id))
+
+    def dispatch_album(self, media_group_id, count):
+        """
+        Queue a complete album on the dispatcher, so albums share the bounded job queue with
+        webhook messages instead of each getting a thread of its own
+        """
+        if not self.album_ready(media_group_id, count):
+            return
+        if self.dispatcher is None:
+            self.process_album(media_group_id, count)
+        elif not self.dispatcher.submit_call(tracing.bind(self.process_album), media_group_id, count):
+            chat_id = self.media_groups.get(media_group_id)[0]['chat']['id']
+            self.send_text(chat_id, "I'm busy with other images right now, please try again in a minute.")
+
+    def process_album(self, media_group_id, count):
+        if not self.album_ready(media_group_id, count):
+            return
+        msgs = self.media_groups.get(media_group_id)
+        caption = self.media_group_captions.get(media_group_id)
+        if not self.processed_media_groups.add_if_absent(media_group_id):
+            return
+
+        chat_id = msgs[0]['chat']['id']
+        try:
+            with tracing.span('process_album', chat_id=chat_id, photos=count, caption=caption):
+                if caption == 'detect':
+                    self.detect_album(msgs[:MAX_ALBUM_SIZE])
+                elif caption.startswith('concat'):
+                    self.concat_album(msgs[:MAX_ALBUM_SIZE], caption)
+                else:
+                    self.filter_album(msgs[:MAX_ALBUM_SIZE], caption)
+        except Exception as e:
+            logger.error(f"Error while processing album {media_group_id}: {e}")
+            self.send_text(chat_id, "Something went wrong please try again")
+
+    def detect_photo(self, msg, notify=True):
+        """Queue the message photo for object detection and return its image number"""
+        path = self.fetch_photo(msg)
+        chat_id = msg['chat']['id']
+        prediction_id = str(uuid.uuid4())
+
+        # Increment and track image number per user
+        image_number = self.image_counter.incr(chat_id)
+        self.prediction_number_map[prediction_id] = (chat_id, image_number)
+
+        # Notify the user
+        if notify:
+            self.send_text(chat_id, f"🕐 Image {image_number} received. You'll get results soon.")
+
+        def notify_failure():
+            self.send_text(chat_id, f"Failed to upload image {image_number} to cloud, please try again.")
+
+        self.run_side_effect(self.upload_and_enqueue, path, prediction_id, chat_id, image_number, notify_failure,
+                             on_failure=notify_failure)
+        return image_number
+
+    def detect_album(self, msgs):
+        """Queue every photo of an album for detection, with one notice for the whole album"""
+        chat_id = msgs[0]['chat']['id']
+
+        def detect(msg):
+            try:
+                return self.detect_photo(msg, notify=False)
+            except Exception as e:
+                logger.error(f"Could not queue album photo for detection: {e}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=min(len(msgs), self.album_threads),
+                                thread_name_prefix='polybot-album') as executor:
+            results = list(executor.map(tracing.bind(detect), msgs))
+
+        numbers = sorted(number for number in results if number is not None)
+        if len(numbers) < len(results):
+            self.send_text(chat_id, f"Could not queue {len(results) - len(numbers)} of the {len(results)} photos.")
+        if numbers:
+            images = f"Image {numbers[0]}" if len(numbers) == 1 else f"Images {', '.join(map(str, numbers))}"
+            self.send_text(chat_id, f"🕐 {images} received. You'll get results soon.")
+
+    def concat_album(self, msgs, caption):
+        """Join all photos of an album into one image: 'concat [horizontal|vertical|grid]'"""
+        chat_id = msgs[0]['chat']['id']
+        if len(msgs) < 2:
+            self.send_text(chat_id, f"Please send 2 to {MAX_ALBUM_SIZE} photos as an album to concat them")
+            return
+
+        direction = caption[len('concat'):].strip() or 'horizontal'
+        with ThreadPoolExecutor(max_workers=min(len(msgs), self.album_threads),
+                                thread_name_prefix='polybot-album') as executor:
+            imgs = list(executor.map(tracing.bind(lambda msg: Img(self.fetch_photo(msg))), msgs))
+
+        # album photos rarely share a size, so each is scaled to the first one's height / width / cell
+        with metrics.stage('filter'), metrics.FILTER_SECONDS.labels(filter='concat').time():
+            imgs[0].concat(imgs[1], direction, others=imgs[2:], fit='resize')
+
+        self.send_photo(chat_id, self.save_result(imgs[0]))
+
+    def filter_album(self, msgs, caption):
+        """Filter every photo of an album and answer with a single album of the results"""
+        chat_id = msgs[0]['chat']['id']
+        steps = parse_caption(caption)
+        # downloads overlap each other and the filters, which run in parallel on the filter pool's processes
+        with ThreadPoolExecutor(max_workers=min(len(msgs), self.album_threads),
+                                thread_name_prefix='polybot-album') as executor:
+            results = list(executor.map(tracing.bind(lambda msg: self.filter_album_photo(msg, steps, caption)), msgs))
+
+        photos = [photo for photo in results if photo is not None]
+        if len(photos) < len(results):
+            self.send_text(chat_id, f"Could not filter {len(results) - len(photos)} of the {len(results)} photos.")
+        if not photos:
+            return
+
+        if len(photos) == 1 and photos[0].file_id:
+            sent = [self.send_photo_by_id(chat_id, photos[0].file_id)]
+        elif len(photos) == 1:
+            sent = [self.send_photo(chat_id, photos[0].image)]
+        else:
+            sent = self.send_media_group(chat_id, photos)
+
+        for photo, message in zip(photos, sent or []):
+            if photo.cache_key:
+                self.cache_result(photo.cache_key, photo.image if photo.fresh else None, message)
+        for photo in photos:
+            if photo.fresh:
+                self.run_side_effect(self.upload_to_s3, photo.image)
+
+    def filter_album_photo(self, msg, steps, caption):
+        """AlbumPhoto for one album message, or None if it could not be filtered"""
+        try:
+            photo = self.photo_policy.choose(msg['photo'], steps)
+            cache_key = self.result_cache.key(photo['file_unique_id'], describe(steps))
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                return AlbumPhoto(cached.file_id, cached.path, cache_key, False)
+            seed = self.noise_seed(steps, cache_key)
+            return AlbumPhoto(None, self.apply_filters(self.fetch_photo(msg, photo), caption, seed), cache_key, True)
+        except Exception as e:
+            logger.exception(f"Failed to filter album photo {msg.get('message_id')}: {e}")
+            return None
+
+    def send_media_group(self, chat_id, photos):
+        """Send AlbumPhotos as one album (2-10 photos); returns the sent messages"""
+        media = []
+        for i, photo in enumerate(photos):
+            if photo.file_id:
+                media.append(InputMediaPhoto(photo.file_id))
+                continue
+            if isinstance(photo.image, bytes):
+                image = InputFile(BytesIO(photo.image), file_name=f'photo{i}.jpg')
+                size = len(photo.image)
+            else:
+                image = InputFile(photo.image)
+                size = os.path.getsize(photo.image)
+            metrics.IMAGE_BYTES.labels(direction='send').observe(size)
+            media.append(InputMediaPhoto(image))
+
+        with metrics.stage('send'):
+            return self._send(chat_id, self.telegram_bot_client.send_media_group, chat_id, media,
+                              priority=REPLY, wait=True)
+
+    def caption_error(self, caption):
+        """Why the caption is not a known filter or a chain of filters (e.g. 'blur then contour'); None if it is"""
+        if caption in self.valid_filters:
+            return None
+        try:
+            parse_caption(caption)
+        except RuntimeError as e:
+            return str(e)
+        return None
+
     def handle_message(self, msg):
         """Bot Main message handler for image processing"""
+        # Telegram caps photos at 2560px; images too large to filter whole (see polybot.tiled) come as documents
+        msg = image_document_as_photo(msg)
+        with tracing.span('handle_message', chat_id=msg['chat']['id'], caption=msg.get('caption', ''),
+                          has_photo='photo' in msg):
+            self._handle_message(msg)
+
+    def _handle_message(self, msg):
         logger.info(f'Incoming message: {msg}')
 
         try:
             user_id = msg['from']['id']
-            if not hasattr(self, 'new_users'):
-                self.new_users = set()
-
-            if user_id not in self.new_users:
-                self.new_users.add(user_id)
+            if self.new_users.add_if_absent(user_id):
                 if 'photo' not in msg:
-                    self.send_text(msg['chat']['id'], "Hiii! How can I help you?")
+                    self.send_text(msg['chat']['id'], "Hiii! How can I help you?", priority=REPLY)
                     return
 
             if 'photo' not in msg:
-                self.send_text(msg['chat']['id'], "Please send a photo with a caption to apply a filter")
+                self.send_text(msg['chat']['id'], "Please send a photo with a caption to apply a filter", priority=REPLY)
                 return
 
 
@@ -165,34 +580,13 @@ class ImageProcessingBot(Bot):
             caption =  caption.lower()
             media_group_id = msg.get('media_group_id')
 
-            if caption and caption not in self.valid_filters:
-                self.send_text(msg['chat']['id'],f"Unknown filter '{caption}'. Please use one of: Blur, Contour, Rotate, Rotate2, Segment, Salt and pepper, Concat, Concat Horizontal, Concat Vertical, Brighten, Darken, Invert, Detect.")
+            error = self.caption_error(caption) if caption else None
+            if error:
+                self.send_text(msg['chat']['id'],f"{error}. Please use one of: Blur, Contour, Rotate, Rotate2, Segment, Salt and pepper, Gaussian, Speckle, Concat, Concat Horizontal, Concat Vertical, Concat Grid, Brighten, Darken, Invert, Detect. Filters can be chained, e.g. 'Blur then Contour'.", priority=REPLY)
                 return
 
-            if caption == "detect":
-                path = self.download_user_photo(msg)
-                image_name = self.upload_to_s3(path)
-                if not image_name:
-                    self.send_text(msg['chat']['id'], "Failed to upload image to cloud.")
-                    return
-
-                chat_id = msg['chat']['id']
-                prediction_id = str(uuid.uuid4())
-
-                # Increment and track image number per user
-                if chat_id not in self.image_counter:
-                    self.image_counter[chat_id] = 1
-                else:
-                    self.image_counter[chat_id] += 1
-
-                image_number = self.image_counter[chat_id]
-                self.prediction_number_map[prediction_id] = (chat_id, image_number)
-
-                # Notify the user
-                self.send_text(chat_id, f"🕐 Image {image_number} received. You'll get results soon.")
-
-                self.send_to_sqs(prediction_id, chat_id, image_name, image_number=image_number)
-
+            if caption == "detect" and not media_group_id:
+                self.detect_photo(msg)
                 return
 
 
@@ -201,87 +595,33 @@ class ImageProcessingBot(Bot):
                 return
 
             if media_group_id:
-                if caption and caption not in ['concat', 'concat horizontal', 'concat vertical']:
-                    if media_group_id not in self.media_groups:
-                        self.media_groups[media_group_id] = {
-                            "caption": caption,
-                            "messages": [msg]
-                        }
-                        self.send_text(msg['chat']['id'], f"The filter '{caption}' does not support multiple images.")
-                    else:
-                        self.media_groups[media_group_id]["messages"].append(msg)
-                    return
-
-                if media_group_id not in self.media_groups:
-                    self.media_groups[media_group_id] = {
-                        "caption": caption,
-                        "messages": [msg]
-                    }
-                    return
-
-                else:
-                    stored_caption = self.media_groups[media_group_id]["caption"]
-                    if not stored_caption.startswith('concat'):
-                        return
-
-                    if len(self.media_groups[media_group_id]["messages"]) >= 2:
-                        self.send_text(msg['chat']['id'], "Only two images are allowed for concat filter")
-                        return
-
-                    self.media_groups[media_group_id]["messages"].append(msg)
-                    if len(self.media_groups[media_group_id]["messages"]) == 2:
-                        data = self.media_groups.pop(media_group_id)
-                        msgs = data["messages"]
-                        stored_caption = data["caption"]
-                        path1 = self.download_user_photo({'photo': [msgs[0]['photo'][-1]], 'chat': msgs[0]['chat']})
-                        img1 = Img(path1)
-                        path2 = self.download_user_photo({'photo': [msgs[1]['photo'][-1]], 'chat': msgs[1]['chat']})
-                        img2 = Img(path2)
-
-                        if stored_caption in ['concat', 'concat horizontal']:
-                            img1.concat(img2)
-                        else:
-                            img1.concat(img2, direction='vertical')
-
-                        new_path = img1.save_img()
-                        self.send_photo(msg['chat']['id'], new_path)
-
-                        return
-
-            path = self.download_user_photo(msg)
-            img = Img(path)
-
-            if caption == 'blur':
-                img.blur()
-            elif caption == 'contour':
-                img.contour()
-            elif caption == 'rotate':
-                img.rotate()
-            elif caption == 'rotate2':
-                img.rotate2()
-            elif caption == 'segment':
-                img.segment()
-            elif caption == 'salt and pepper':
-                img.salt_n_pepper()
-            elif caption == 'brighten':
-                img.brighten()
-            elif caption == 'darken':
-                img.darken()
-            elif caption == 'invert':
-                img.invert()
-            elif caption.startswith('concat'):
-                self.send_text(msg['chat']['id'], "Only two images are allowed for concat filter")
+                # album photos may land on different replicas: the caption (only on the first photo) is
+                # recorded before the atomic append, so whichever message completes the album sees it
+                if caption:
+                    self.media_group_captions[media_group_id] = caption
+                count = self.media_groups.append(media_group_id, compact_photo_message(msg))
+                # every filter, concat and detect included, runs once the whole album has arrived
+                self.schedule_album(media_group_id, count)
                 return
 
+            if caption.startswith('concat'):
+                self.send_text(msg['chat']['id'], f"Please send 2 to {MAX_ALBUM_SIZE} photos as an album to concat them")
+                return
 
-            new_path = img.save_img()
-            # Upload filtered image to S3
-            uploaded_name = self.upload_to_s3(new_path)
-            if not uploaded_name:
-                self.send_text(msg['chat']['id'], "Failed to upload filtered image to cloud.")
+            steps = parse_caption(caption)
+            photo = self.photo_policy.choose(msg['photo'], steps)
+            # results differ per variant, so the key is the downloaded variant's id
+            cache_key = self.result_cache.key(photo['file_unique_id'], describe(steps))
+            if self.send_cached_result(msg['chat']['id'], cache_key):
                 return
 
-            self.send_photo(msg['chat']['id'], new_path)
+            path = self.fetch_photo(msg, photo)
+            new_path = self.apply_filters(path, caption, self.noise_seed(steps, cache_key))
+
+            # Reply first; archiving the filtered image in S3 happens alongside
+            sent = self.send_photo(msg['chat']['id'], new_path)
+            self.run_side_effect(self.upload_to_s3, new_path)
+            self.cache_result(cache_key, new_path, sent)
 
 
         except Exception as e:
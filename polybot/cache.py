@@ -0,0 +1,105 @@
+import hashlib
+import os
+import shutil
+import threading
+from collections import OrderedDict, namedtuple
+
+from loguru import logger
+
+from polybot import metrics
+
+CachedResult = namedtuple('CachedResult', ['file_id', 'path'])
+
+
+class ResultCache:
+    """
+    Two-tier LRU cache of filtered images, keyed on the source photo's Telegram
+    ``file_unique_id`` and the canonical filter pipeline.
+
+    The memory tier maps a key to the ``file_id`` Telegram returned when we first sent the
+    result, so a hit is answered with no download, filtering or upload at all. The optional
+    disk tier (``disk_dir``) keeps the encoded bytes, bounded by ``max_disk_bytes``, for keys
+    whose ``file_id`` was evicted or never known.
+    """
+
+    def __init__(self, max_entries=None, disk_dir=None, max_disk_bytes=None):
+        self.max_entries = max_entries or int(os.environ.get('POLYBOT_CACHE_ENTRIES', 1024))
+        self.disk_dir = disk_dir or os.environ.get('POLYBOT_CACHE_DIR')
+        self.max_disk_bytes = max_disk_bytes or int(os.environ.get('POLYBOT_CACHE_DISK_BYTES', 256 * 1024 * 1024))
+        self.file_ids = OrderedDict()
+        self.files = OrderedDict()  # key -> size in bytes, least recently used first
+        self.disk_bytes = 0
+        self.lock = threading.Lock()
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    @staticmethod
+    def key(file_unique_id, pipeline):
+        return hashlib.sha256(f'{file_unique_id}\0{pipeline}'.encode()).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.file_ids:
+                self.file_ids.move_to_end(key)
+                metrics.CACHE_HITS.labels(tier='memory').inc()
+                return CachedResult(self.file_ids[key], None)
+
+            if key in self.files:
+                self.files.move_to_end(key)
+                metrics.CACHE_HITS.labels(tier='disk').inc()
+                return CachedResult(None, self._disk_path(key))
+
+        metrics.CACHE_MISSES.inc()
+        return None
+
+    def put_file_id(self, key, file_id):
+        with self.lock:
+            self.file_ids[key] = file_id
+            self.file_ids.move_to_end(key)
+            while len(self.file_ids) > self.max_entries:
+                self.file_ids.popitem(last=False)
+
+    def put_file(self, key, path):
+        """Store the filtered image (a file path or the encoded bytes) in the disk tier"""
+        if not self.disk_dir:
+            return
+
+        size = len(path) if isinstance(path, bytes) else os.path.getsize(path)
+        if size > self.max_disk_bytes:
+            return
+
+        with self.lock:
+            if isinstance(path, bytes):
+                with open(self._disk_path(key), 'wb') as f:
+                    f.write(path)
+            else:
+                shutil.copyfile(path, self._disk_path(key))
+            self.disk_bytes += size - self.files.pop(key, 0)
+            self.files[key] = size
+            self._trim_disk()
+
+    def _trim_disk(self):
+        while self.disk_bytes > self.max_disk_bytes:
+            old_key, old_size = self.files.popitem(last=False)
+            self.disk_bytes -= old_size
+            try:
+                os.remove(self._disk_path(old_key))
+            except OSError as e:
+                logger.warning(f"Could not evict cached image {old_key}: {e}")
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f'{key}.jpg')
+
+    def _load_disk_index(self):
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if name.endswith('.jpg'):
+                stat = os.stat(os.path.join(self.disk_dir, name))
+                entries.append((stat.st_mtime, name[:-len('.jpg')], stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self.files[key] = size
+            self.disk_bytes += size
+        self._trim_disk()
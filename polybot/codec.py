@@ -0,0 +1,85 @@
+"""
+Grayscale decoding and encoding for Img on Pillow alone.
+
+matplotlib's imread decodes to RGB (or 0..1 floats for PNG) and imsave renders the array through
+a colormap into an RGBA image before writing it, for what is a single-channel result. Here JPEGs
+are decoded straight to their luma channel (optionally scaled down by the decoder itself) and
+written back as one-channel images, with the same min/max stretch ``imsave(cmap='gray')`` applies.
+"""
+import math
+import os
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from polybot.rotation import rotate_array
+
+
+def jpeg_quality():
+    return int(os.environ.get('POLYBOT_JPEG_QUALITY', 75))
+
+
+def open_image(source):
+    """PIL image for ``source``: a path, encoded bytes or a binary file-like object"""
+    return Image.open(BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+
+
+def fit_size(size, max_size):
+    """``size`` scaled down (never up) to fit in a ``max_size`` x ``max_size`` box"""
+    scale = max(size) / max_size
+    if scale <= 1:
+        return size
+    return max(1, math.ceil(size[0] / scale)), max(1, math.ceil(size[1] / scale))
+
+
+def decode_gray(source, max_size=None, dtype=np.float64):
+    """
+    Decode ``source`` to a 2D grayscale array. With ``max_size`` the result fits in
+    ``max_size`` x ``max_size``; JPEGs then decode at 1/2, 1/4 or 1/8 scale (draft mode)
+    before the final resize, so the full-resolution pixels are never produced.
+    """
+    with open_image(source) as image:
+        target = fit_size(image.size, max_size) if max_size else image.size
+        image.draft('L', target)
+        gray = image.convert('L')
+    if gray.size != target:
+        gray = gray.resize(target, Image.Resampling.BILINEAR)
+    return np.asarray(gray, dtype=dtype)
+
+
+def resize_gray(array, shape):
+    """Bilinear resize of a 2D float array to ``shape`` (height, width)"""
+    if array.shape == tuple(shape):
+        return array
+    image = Image.fromarray(np.asarray(array, dtype=np.float32))
+    return np.asarray(image.resize((shape[1], shape[0]), Image.Resampling.BILINEAR), dtype=np.float64)
+
+
+def to_uint8(array, rows=1024):
+    """Normalise to 0..255 over the array's own range, as imsave(cmap='gray') does, strip by strip"""
+    low, high = float(array.min()), float(array.max())
+    scale = 256 / (high - low) if high > low else 0.0
+    out = np.empty(array.shape, dtype=np.uint8)
+    for start in range(0, array.shape[0], rows):
+        strip = (array[start:start + rows] - low) * scale
+        out[start:start + rows] = np.minimum(strip, 255)
+    return out
+
+
+def save_gray(array, target, format=None, quality=None, turns=0):
+    """
+    Write ``array`` as a one-channel image to ``target`` (a path or binary file-like object),
+    rotated clockwise by ``turns`` quarter turns after the (rotation-independent) conversion to
+    8 bits. ``format`` defaults to the path's suffix; JPEGs use ``quality`` ($POLYBOT_JPEG_QUALITY,
+    default 75).
+    """
+    pixels = rotate_array(to_uint8(array), turns)
+    Image.fromarray(pixels).save(target, format=format, quality=quality or jpeg_quality())
+
+
+def encode_gray(array, format='jpeg', quality=None, turns=0):
+    """``array`` encoded as ``format``, returned as bytes"""
+    buffer = BytesIO()
+    save_gray(array, buffer, format=format, quality=quality, turns=turns)
+    return buffer.getvalue()
@@ -0,0 +1,59 @@
+"""
+Gunicorn settings for serving polybot in production:
+
+    gunicorn -c polybot/gunicorn_conf.py polybot.app:app
+
+Every worker imports polybot.app and so gets its own bot, filter pool and dispatcher.
+Albums, image counters and prediction numbers must be visible to every worker, so more than one
+worker needs a shared state backend (POLYBOT_STATE_BACKEND); with the default in-memory state
+there is a single worker, and asking for more refuses to start.
+The master registers the Telegram webhook once; workers skip it.
+"""
+import os
+import shutil
+
+bind = os.environ.get('POLYBOT_BIND', '0.0.0.0:8000')
+state_backend = os.environ.get('POLYBOT_STATE_BACKEND', 'memory')
+workers = int(os.environ.get('POLYBOT_WEB_WORKERS', 1 if state_backend == 'memory' else 2))
+# webhook handlers only enqueue work, so a few threads per worker cover slow clients
+worker_class = 'gthread'
+threads = int(os.environ.get('POLYBOT_WEB_THREADS', 4))
+keepalive = int(os.environ.get('POLYBOT_KEEPALIVE', 5))
+timeout = int(os.environ.get('POLYBOT_WORKER_TIMEOUT', 60))
+# time a worker gets to finish queued jobs and flush SQS after SIGTERM
+graceful_timeout = int(os.environ.get('POLYBOT_GRACEFUL_TIMEOUT', 30))
+accesslog = '-'
+
+
+def check_state_backend(workers, backend=None):
+    """Refuse to run several workers that would each keep their own in-memory state"""
+    backend = backend or os.environ.get('POLYBOT_STATE_BACKEND', 'memory')
+    if workers > 1 and backend == 'memory':
+        raise RuntimeError(f"{workers} workers need a shared POLYBOT_STATE_BACKEND (sqlite:/// or redis://), "
+                           f"not per-worker 'memory' state")
+
+
+def on_starting(server):
+    check_state_backend(server.cfg.workers)
+
+    # start every run with an empty multiprocess metrics directory
+    metrics_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir)
+
+    # register the webhook once from the master instead of once per worker
+    from polybot.bot import Bot
+    Bot(os.environ['TELEGRAM_BOT_TOKEN'], os.environ['BOT_APP_URL'], register_webhook=True)
+    os.environ['POLYBOT_REGISTER_WEBHOOK'] = '0'
+
+
+def worker_exit(server, worker):
+    from polybot import app
+    app.shutdown()
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_flask_exporter.multiprocess import GunicornInternalPrometheusMetrics
+        GunicornInternalPrometheusMetrics.mark_process_dead_on_child_exit(worker.pid)
@@ -1,120 +1,262 @@
+import math
+from itertools import accumulate
 from pathlib import Path
-import random
 
-from matplotlib.image import imread, imsave
+import numpy as np
 
+from polybot import noise
+from polybot.codec import decode_gray, encode_gray, resize_gray, save_gray
+from polybot.rotation import rotate_array
 
-def rgb2gray(rgb):
-    r, g, b = rgb[:, :, 0], rgb[:, :, 1], rgb[:, :, 2]
-    gray = 0.2989 * r + 0.5870 * g + 0.1140 * b
-    return gray
+
+def _is_integral(data, rows=256):
+    """Whether every value of ``data`` is a whole number, checked a block of rows at a time"""
+    return all(np.array_equal(block, np.rint(block)) for block in
+               (data[top:top + rows] for top in range(0, data.shape[0], rows)))
+
+
+def _window_sums(data, size):
+    """
+    Sum of every size x size window, read off a summed-area table in O(1) per window. Integer
+    pixels (every decoded photo) are summed exactly in int64; for fractional pixels the
+    differences of large prefix sums are rounded to 6 decimals, so a window of equal values
+    does not come out a hair below its exact sum.
+    """
+    exact = _is_integral(data)
+    table = np.zeros((data.shape[0] + 1, data.shape[1] + 1), dtype=np.int64 if exact else np.float64)
+    np.cumsum(data, axis=0, dtype=table.dtype, out=table[1:, 1:])
+    np.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+    sums = table[size:, size:] - table[:-size, size:] - table[size:, :-size] + table[:-size, :-size]
+    return sums if exact else np.round(sums, 6, out=sums)
+
+
+def _box_filter_1d(data, size, axis):
+    """Moving average of length ``size`` along ``axis`` (valid part only)"""
+    sums = np.cumsum(data, axis=axis)
+    sums = np.insert(sums, 0, 0, axis=axis)
+    upper = np.take(sums, np.arange(size, sums.shape[axis]), axis=axis)
+    lower = np.take(sums, np.arange(0, sums.shape[axis] - size), axis=axis)
+    return (upper - lower) / size
+
+
+def _gaussian_kernel(size, sigma=None):
+    if sigma is None:
+        sigma = size / 6
+    offsets = np.arange(size) - (size - 1) / 2
+    weights = np.exp(-offsets ** 2 / (2 * sigma ** 2))
+    return weights / weights.sum()
+
+
+def _convolve_1d(data, weights, axis):
+    """Correlate ``data`` with the 1D ``weights`` along ``axis`` (valid part only)"""
+    windows = np.lib.stride_tricks.sliding_window_view(data, len(weights), axis=axis)
+    return windows @ weights
+
+
+def _fit_inside(shape, box):
+    """``shape`` scaled, keeping its aspect ratio, to the largest size that fits in ``box``"""
+    scale = min(box[0] / shape[0], box[1] / shape[1])
+    return max(1, round(shape[0] * scale)), max(1, round(shape[1] * scale))
+
+
+def mosaic(arrays, direction='horizontal', cols=None, fit=None, fill=0.0):
+    """
+    Lay 2D ``arrays`` out in a row ('horizontal'), a column ('vertical') or a grid with ``cols``
+    columns ('grid', default ceil(sqrt(n))), copying each once into a single preallocated output.
+
+    Mismatched sizes raise RuntimeError unless ``fit`` is 'resize' (scale each image, keeping its
+    aspect ratio, to the first one's height, width or size) or 'pad' (centre each in the largest
+    height, width or size). Uncovered space is set to ``fill``.
+    """
+    if direction not in ('horizontal', 'vertical', 'grid'):
+        raise RuntimeError("direction must be either 'horizontal', 'vertical' or 'grid'")
+    if fit not in (None, 'resize', 'pad'):
+        raise RuntimeError("fit must be None, 'resize' or 'pad'")
+
+    if direction == 'grid':
+        if fit is None and len({array.shape for array in arrays}) > 1:
+            raise RuntimeError("images must have the same size")
+        if fit == 'resize':
+            cell = arrays[0].shape
+            arrays = [resize_gray(array, _fit_inside(array.shape, cell)) for array in arrays]
+        else:
+            cell = (max(array.shape[0] for array in arrays), max(array.shape[1] for array in arrays))
+        cols = cols or math.ceil(math.sqrt(len(arrays)))
+        rows = math.ceil(len(arrays) / cols)
+        slots = [((i // cols) * cell[0], (i % cols) * cell[1], cell) for i in range(len(arrays))]
+        shape = (rows * cell[0], cols * cell[1])
+    else:
+        # images are laid out along ``axis`` and share their size across it
+        axis = 1 if direction == 'horizontal' else 0
+        across = 1 - axis
+        if fit is None and len({array.shape[across] for array in arrays}) > 1:
+            raise RuntimeError(f"images must have the same {'height' if axis == 1 else 'width'}")
+        if fit == 'resize':
+            size = arrays[0].shape[across]
+            arrays = [resize_gray(array, _fit_inside(array.shape, (size, math.inf) if axis == 1 else (math.inf, size)))
+                      for array in arrays]
+        size = max(array.shape[across] for array in arrays)
+        offsets = list(accumulate((array.shape[axis] for array in arrays), initial=0))
+        if axis == 1:
+            slots = [(0, offset, (size, array.shape[1])) for offset, array in zip(offsets, arrays)]
+            shape = (size, offsets[-1])
+        else:
+            slots = [(offset, 0, (array.shape[0], size)) for offset, array in zip(offsets, arrays)]
+            shape = (offsets[-1], size)
+
+    covered = sum(array.size for array in arrays) == shape[0] * shape[1]
+    out = np.empty(shape) if covered else np.full(shape, fill, dtype=np.float64)
+    for array, (top, left, slot) in zip(arrays, slots):
+        top += (slot[0] - array.shape[0]) // 2
+        left += (slot[1] - array.shape[1]) // 2
+        out[top:top + array.shape[0], left:left + array.shape[1]] = array
+    return out
 
 
 class Img:
 
-    def __init__(self, path):
+    def __init__(self, path, max_size=None):
         """
-        Do not change the constructor implementation
+        ``path`` is either a path to an image file or the encoded image itself (bytes or a
+        binary file-like object), in which case nothing is read from disk. With ``max_size``
+        the image is scaled down while decoding to fit in ``max_size`` x ``max_size``.
         """
-        self.path = Path(path)
-        self.data = rgb2gray(imread(path)).tolist()
+        in_memory = isinstance(path, (bytes, bytearray)) or hasattr(path, 'read')
+        self.path = None if in_memory else Path(path)
+        self._array = decode_gray(path, max_size=max_size)
+        self._list = None
+        self._turns = 0
 
-    def save_img(self):
+    @classmethod
+    def from_array(cls, array):
+        """An in-memory Img (``path`` is None) holding the 2D grayscale ``array``, without decoding anything"""
+        img = cls.__new__(cls)
+        img.path = None
+        img.array = array
+        return img
+
+    @property
+    def data(self):
         """
-        Do not change the below implementation
+        List-of-lists view of the pixels, kept for backward compatibility.
+
+        Once handed out, the list becomes the source of truth so that callers mutating
+        it in place (e.g. ``img.data[i][j] = 0``) are still honoured by the next filter.
         """
-        new_path = self.path.with_name(self.path.stem + '_filtered' + self.path.suffix)
-        imsave(new_path, self.data, cmap='gray')
-        return new_path
+        if self._list is None:
+            self._list = self.array.tolist()
+            self._array = None
+        return self._list
 
-    def blur(self, blur_level=16):
+    @data.setter
+    def data(self, value):
+        self._array = np.asarray(value, dtype=np.float64)
+        self._list = None
+        self._turns = 0
 
-        height = len(self.data)
-        width = len(self.data[0])
-        filter_sum = blur_level ** 2
+    @property
+    def array(self):
+        """2D float64 ndarray holding the grayscale pixels"""
+        if self._turns:
+            self._array = rotate_array(self._unrotated(), self._turns)
+            self._turns = 0
+        return self._unrotated()
 
-        result = []
-        for i in range(height - blur_level + 1):
-            row_result = []
-            for j in range(width - blur_level + 1):
-                sub_matrix = [row[j:j + blur_level] for row in self.data[i:i + blur_level]]
-                average = sum(sum(sub_row) for sub_row in sub_matrix) // filter_sum
-                row_result.append(average)
-            result.append(row_result)
+    @array.setter
+    def array(self, value):
+        self._array = value
+        self._list = None
+        self._turns = 0
 
-        self.data = result
+    def _unrotated(self):
+        """The pixels without any pending lazy rotation applied"""
+        if self._array is None:
+            self._array = np.asarray(self._list, dtype=np.float64)
+            self._list = None
+        return self._array
 
-    def contour(self):
-        for i, row in enumerate(self.data):
-            res = []
-            for j in range(1, len(row)):
-                res.append(abs(row[j-1] - row[j]))
+    def save_img(self, quality=None):
+        if self.path is None:
+            raise RuntimeError("Image was loaded from memory, use encode() instead")
+
+        new_path = self.path.with_name(self.path.stem + '_filtered' + self.path.suffix)
+        save_gray(self._unrotated(), new_path, quality=quality, turns=self._turns)
+        return new_path
 
-            self.data[i] = res
+    def encode(self, format='jpeg', quality=None):
+        """Return the filtered image encoded as ``format``, without touching the filesystem"""
+        return encode_gray(self._unrotated(), format=format, quality=quality, turns=self._turns)
 
-    def rotate(self):
-        for i in range(len(self.data)):
-            for j in range(i,len(self.data[0])):
-                self.data[i][j] , self.data[j][i] = self.data[j][i] , self.data[i][j]
-        for row in self.data:
-            row.reverse()
+    def blur(self, blur_level=16, kernel='mean', sigma=None):
+        """
+        Blur the image with a ``blur_level`` x ``blur_level`` window, cropping the borders
+        the window cannot cover (the output shrinks by ``blur_level - 1`` on each axis).
 
-    def rotate2(self):
-        self.rotate()
-        self.rotate()
+        kernel='mean' (default) floors the window average, using a summed-area table so the
+        cost does not depend on ``blur_level``. kernel='box' and kernel='gaussian' apply the
+        equivalent separable 1D kernels along rows then columns, without flooring.
+        """
+        height, width = self.array.shape
+        if not 1 <= blur_level <= min(height, width):
+            raise RuntimeError("blur_level must be between 1 and the image size")
 
+        if kernel == 'mean':
+            self.array = np.floor_divide(_window_sums(self.array, blur_level), blur_level ** 2, dtype=np.float64)
+        elif kernel == 'box':
+            self.array = _box_filter_1d(_box_filter_1d(self.array, blur_level, axis=1), blur_level, axis=0)
+        elif kernel == 'gaussian':
+            weights = _gaussian_kernel(blur_level, sigma)
+            self.array = _convolve_1d(_convolve_1d(self.array, weights, axis=1), weights, axis=0)
+        else:
+            raise RuntimeError("kernel must be one of 'mean', 'box' or 'gaussian'")
 
-    def salt_n_pepper(self):
-        for i in range(len(self.data)):
-            for j in range(len(self.data[0])):
-                random_number = random.random()
-                if random_number < 0.2:
-                    self.data[i][j] = 255
-                elif random_number > 0.8:
-                    self.data[i][j] = 0
+    def contour(self):
+        self.array = np.abs(np.diff(self.array, axis=1))
 
-    def concat(self, other_img, direction='horizontal'):
-        if direction=='horizontal':
-            if len(self.data) != len(other_img.data):
-                raise RuntimeError("images must have the same height")
+    def rotate(self, turns=1, lazy=False):
+        """
+        Rotate clockwise by ``turns`` quarter turns (any shape). With ``lazy`` the turn is only
+        recorded: pending turns are applied in one copy when the pixels are next read, and
+        encode() / save_img() rotate the 8-bit output instead of the float64 pixels.
+        """
+        turns = (self._turns + turns) % 4
+        if lazy:
+            self._unrotated()
+            self._turns = turns
+        else:
+            self.array = rotate_array(self._unrotated(), turns)
 
-            new_data = []
-            for row_self, row_other in zip(self.data, other_img.data):
-                new_row = row_self + row_other
-                new_data.append(new_row)
+    def rotate2(self):
+        self.rotate(2)
 
-            self.data = new_data
-        elif direction=='vertical':
-            if len(self.data[0]) != len(other_img.data[0]):
-                raise RuntimeError("images must have the same width")
+    def salt_n_pepper(self, salt=0.2, pepper=None, seed=None):
+        """Set a ``salt`` share of pixels to white and a ``pepper`` share (default: same) to black"""
+        self.array = noise.salt_and_pepper(self.array, salt, pepper, seed=seed)
 
-            self.data = self.data + other_img.data
+    def gaussian_noise(self, sigma=20, seed=None):
+        """Add normal noise with standard deviation ``sigma`` gray levels"""
+        self.array = noise.gaussian(self.array, sigma, seed=seed)
 
-        else:
-            raise RuntimeError("direction must be either 'horizontal' or 'vertical'")
+    def speckle(self, sigma=0.2, seed=None):
+        """Scale each pixel by 1 + normal noise with standard deviation ``sigma``"""
+        self.array = noise.speckle(self.array, sigma, seed=seed)
 
+    def concat(self, other_img, direction='horizontal', others=(), cols=None, fit=None, fill=0.0):
+        """
+        Join this image with ``other_img`` (and the images in ``others``) side by side, stacked,
+        or as a grid; see ``mosaic`` for ``cols``, ``fit`` and ``fill``.
+        """
+        arrays = [self.array, other_img.array] + [img.array for img in others]
+        self.array = mosaic(arrays, direction=direction, cols=cols, fit=fit, fill=fill)
 
     def segment(self):
-        for i in range(len(self.data)):
-            for j in range(len(self.data[0])):
-                if self.data[i][j] > 100 :
-                    self.data[i][j]  = 255
-                else:
-                    self.data[i][j] = 0
+        self.array = np.where(self.array > 100, 255.0, 0.0)
 
     def brighten(self, value=30):
-        for i in range(len(self.data)):
-            for j in range(len(self.data[0])):
-                self.data[i][j] = min(255, self.data[i][j] + value)
+        self.array = np.minimum(255, self.array + value)
 
     def darken(self, value=30):
-        for i in range(len(self.data)):
-            for j in range(len(self.data[0])):
-                self.data[i][j] = max(0, self.data[i][j] - value)
+        self.array = np.maximum(0, self.array - value)
 
     def invert(self):
-        for i in range(len(self.data)):
-            for j in range(len(self.data[0])):
-                self.data[i][j] = 255 - self.data[i][j]
-
-
+        self.array = 255 - self.array
@@ -0,0 +1,91 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from polybot import tracing
+
+# Process startup
+TIME_TO_READY = Gauge('polybot_time_to_ready_seconds', 'Seconds from importing the app to being ready to serve')
+
+# Webhook jobs dispatched off the Flask request thread
+JOBS_SUBMITTED = Counter('polybot_jobs_submitted_total', 'Messages accepted for background processing')
+JOBS_REJECTED = Counter('polybot_jobs_rejected_total', 'Messages rejected because the job queue was full')
+JOBS_FAILED = Counter('polybot_jobs_failed_total', 'Background jobs that raised an exception')
+JOBS_PENDING = Gauge('polybot_jobs_pending', 'Jobs queued or running in the dispatcher')
+JOB_QUEUE_SECONDS = Histogram('polybot_job_queue_seconds', 'Time a job waited before a worker picked it up')
+JOB_SECONDS = Histogram('polybot_job_seconds', 'Wall time of a background message job',
+                        buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60))
+FILTER_POOL_SECONDS = Histogram('polybot_filter_pool_seconds', 'Wall time of a filter job in the process pool',
+                                buckets=(.01, .05, .1, .25, .5, 1, 2.5, 5, 10, 30))
+FILTER_POOL_RESTARTS = Counter('polybot_filter_pool_restarts_total',
+                               'Filter worker processes replaced after crashing or hanging', ['reason'])
+
+# Image pipeline hot path: per-filter time, image size, and each stage of a request
+FILTER_SECONDS = Histogram('polybot_filter_seconds', 'Time spent in one filter (or fused run of point filters)',
+                           ['filter'], buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5))
+IMAGE_PIXELS = Histogram('polybot_image_pixels', 'Pixels in an image entering the filter pipeline',
+                         buckets=(1e4, 1e5, 2.5e5, 5e5, 1e6, 2e6, 5e6, 1e7))
+IMAGE_BYTES = Histogram('polybot_image_bytes', 'Encoded size of downloaded and sent images', ['direction'],
+                        buckets=(1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7))
+STAGE_SECONDS = Histogram('polybot_stage_seconds', 'Wall time of a request stage', ['stage'],
+                          buckets=(.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30))
+STAGE_ERRORS = Counter('polybot_stage_errors_total', 'Exceptions raised by a request stage', ['stage'])
+
+# Photo variant picked by polybot.photo_sizes instead of the largest one
+PHOTO_DOWNSIZED = Counter('polybot_photo_downsized_total', 'Downloads of a smaller photo variant than the largest')
+PHOTO_BYTES_SAVED = Counter('polybot_photo_bytes_saved_total',
+                            'Bytes not downloaded by picking a smaller photo variant (from Telegram file_size)')
+
+# Telegram Bot API calls made through polybot.telegram_http
+TELEGRAM_REQUEST_SECONDS = Histogram('polybot_telegram_request_seconds', 'Latency of a Telegram Bot API call',
+                                     ['endpoint'], buckets=(.025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30))
+TELEGRAM_RETRIES = Counter('polybot_telegram_retries_total', 'Telegram calls retried after a 429 or 5xx',
+                           ['endpoint', 'status'])
+
+# Outbound Telegram messages queued by polybot.outbound.OutboundScheduler
+OUTBOUND_QUEUE_DEPTH = Gauge('polybot_outbound_queue_depth', 'Messages waiting for a send slot')
+OUTBOUND_DELAY_SECONDS = Histogram('polybot_outbound_delay_seconds', 'Time a message waited for its rate limit',
+                                   ['priority'], buckets=(.01, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60))
+OUTBOUND_COALESCED = Counter('polybot_outbound_coalesced_total', 'Notices merged into an identical queued one')
+OUTBOUND_DROPPED = Counter('polybot_outbound_dropped_total', 'Notices dropped because the outbound queue was full')
+
+# Filtered image result cache
+CACHE_HITS = Counter('polybot_cache_hits_total', 'Filtered images served from the result cache', ['tier'])
+CACHE_MISSES = Counter('polybot_cache_misses_total', 'Result cache lookups that had to run the filters')
+
+# Side effects run after the user's reply (S3 archive, SQS enqueue)
+BACKGROUND_TASK_RETRIES = Counter('polybot_background_task_retries_total', 'Background task retries', ['task'])
+BACKGROUND_TASK_FAILURES = Counter('polybot_background_task_failures_total',
+                                   'Background tasks that failed after all retries', ['task'])
+
+# Detection requests sent to SQS
+SQS_BATCH_SIZE = Histogram('polybot_sqs_batch_size', 'Messages per send_message_batch call', buckets=(1, 2, 3, 5, 8, 10))
+SQS_ENQUEUE_SECONDS = Histogram('polybot_sqs_enqueue_seconds', 'Time from buffering a message to SQS accepting it',
+                                buckets=(.01, .025, .05, .1, .25, .5, 1, 2.5, 5))
+SQS_MESSAGES_DROPPED = Counter('polybot_sqs_messages_dropped_total', 'SQS messages given up on')
+
+# Detection results grouped per chat by polybot.predictions.PredictionAggregator
+PREDICTIONS_PER_MESSAGE = Histogram('polybot_predictions_per_message', 'Detection results answered by one delivery',
+                                    buckets=(1, 2, 3, 5, 10, 20, 50))
+
+# In-memory bot state (media groups, counters, prediction map, seen users)
+STATE_SIZE = Gauge('polybot_state_entries', 'Entries held by a bot state store', ['store'])
+STATE_EVICTIONS = Counter('polybot_state_evictions_total', 'Entries evicted from a bot state store', ['store', 'reason'])
+
+
+@contextmanager
+def stage(name):
+    """
+    Time the block as request stage ``name``, count the exceptions it raises (which propagate)
+    and trace it as a ``polybot.<name>`` span
+    """
+    start = time.perf_counter()
+    try:
+        with tracing.span(f'polybot.{name}'):
+            yield
+    except Exception:
+        STAGE_ERRORS.labels(stage=name).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage=name).observe(time.perf_counter() - start)
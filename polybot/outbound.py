@@ -0,0 +1,172 @@
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from loguru import logger
+
+from polybot import metrics
+
+# lower sends first: results the user is waiting for go ahead of status notices
+REPLY = 0
+NOTICE = 1
+PRIORITY_NAMES = {REPLY: 'reply', NOTICE: 'notice'}
+
+MAX_CHAT_BUCKETS = 10000
+
+
+class TokenBucket:
+    """``rate`` tokens per second, holding at most ``capacity``"""
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """Seconds until a token is available, 0 if one is available now"""
+        self._refill()
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+
+class _Job:
+
+    def __init__(self, seq, chat_id, priority, fn, args, coalesce_key):
+        self.seq = seq
+        self.chat_id = chat_id
+        self.priority = priority
+        self.fn = fn
+        self.args = args
+        self.coalesce_key = coalesce_key
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class OutboundScheduler:
+    """
+    Sends Telegram messages from a few sender threads while keeping under Telegram's limits:
+    a global token bucket (``global_rate`` msg/s) plus one bucket per chat, ``chat_rate`` msg/s for
+    private chats and ``group_rate`` msg/s for groups (negative chat ids). Among sendable jobs the
+    lowest priority wins, then the oldest. A chat has at most one send in flight, so messages to
+    the same chat keep their order within a priority. A notice identical to one still queued for
+    the same chat is coalesced into it, and notices are dropped once ``max_pending`` jobs wait.
+    """
+
+    def __init__(self, global_rate=None, chat_rate=None, group_rate=None, max_pending=None, threads=None,
+                 clock=time.monotonic):
+        self.global_rate = global_rate or float(os.environ.get('POLYBOT_OUTBOUND_GLOBAL_RATE', 30))
+        self.chat_rate = chat_rate or float(os.environ.get('POLYBOT_OUTBOUND_CHAT_RATE', 1))
+        self.group_rate = group_rate or float(os.environ.get('POLYBOT_OUTBOUND_GROUP_RATE', 20 / 60))
+        self.max_pending = max_pending or int(os.environ.get('POLYBOT_OUTBOUND_QUEUE', 1000))
+        self.clock = clock
+        self.global_bucket = TokenBucket(self.global_rate, self.global_rate, clock)
+        self.chat_buckets = {}
+        self.in_flight = set()
+        self.pending = []
+        self.seq = 0
+        self.closed = False
+        self.cond = threading.Condition()
+        self.threads = [threading.Thread(target=self._run, name=f'outbound-{i}', daemon=True)
+                        for i in range(threads or int(os.environ.get('POLYBOT_OUTBOUND_THREADS', 4)))]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, chat_id, fn, *args, priority=NOTICE, coalesce_key=None):
+        """Queue ``fn(*args)`` as a send to ``chat_id``; returns a Future with its result"""
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("Outbound scheduler is shut down")
+            if coalesce_key is not None:
+                for job in self.pending:
+                    if job.chat_id == chat_id and job.coalesce_key == coalesce_key:
+                        metrics.OUTBOUND_COALESCED.inc()
+                        return job.future
+            if priority == NOTICE and len(self.pending) >= self.max_pending:
+                metrics.OUTBOUND_DROPPED.inc()
+                logger.warning(f"Outbound queue full, dropping notice to chat {chat_id}")
+                future = Future()
+                future.set_result(None)
+                return future
+
+            self.seq += 1
+            job = _Job(self.seq, chat_id, priority, fn, args, coalesce_key)
+            self.pending.append(job)
+            metrics.OUTBOUND_QUEUE_DEPTH.set(len(self.pending))
+            self.cond.notify()
+            return job.future
+
+    def _bucket(self, chat_id):
+        if chat_id not in self.chat_buckets:
+            rate = self.group_rate if int(chat_id) < 0 else self.chat_rate
+            self.chat_buckets[chat_id] = TokenBucket(rate, 1, self.clock)
+        return self.chat_buckets[chat_id]
+
+    def _prune_buckets(self):
+        """Forget chats whose bucket has refilled; a fresh bucket would behave the same"""
+        waiting = {job.chat_id for job in self.pending} | self.in_flight
+        for chat_id, bucket in list(self.chat_buckets.items()):
+            if chat_id not in waiting and bucket.wait_time() == 0:
+                del self.chat_buckets[chat_id]
+
+    def _next_job(self):
+        """The job to send now, or how long to wait before one may be ready"""
+        global_wait = self.global_bucket.wait_time()
+        wait = None
+        for job in sorted(self.pending, key=lambda job: (job.priority, job.seq)):
+            if job.chat_id in self.in_flight:
+                continue
+            chat_wait = self._bucket(job.chat_id).wait_time()
+            if chat_wait == 0 and global_wait == 0:
+                return job, None
+            job_wait = max(chat_wait, global_wait)
+            wait = job_wait if wait is None else min(wait, job_wait)
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while True:
+                    job, wait = self._next_job()
+                    if job is not None or (self.closed and not self.pending):
+                        break
+                    self.cond.wait(wait)
+                if job is None:
+                    return
+                self.pending.remove(job)
+                self.in_flight.add(job.chat_id)
+                self.global_bucket.take()
+                self._bucket(job.chat_id).take()
+                metrics.OUTBOUND_QUEUE_DEPTH.set(len(self.pending))
+
+            metrics.OUTBOUND_DELAY_SECONDS.labels(priority=PRIORITY_NAMES[job.priority]).observe(
+                time.perf_counter() - job.enqueued_at)
+            try:
+                job.future.set_result(job.fn(*job.args))
+            except Exception as e:
+                logger.warning(f"Sending to chat {job.chat_id} failed: {e}")
+                job.future.set_exception(e)
+            finally:
+                with self.cond:
+                    self.in_flight.discard(job.chat_id)
+                    if len(self.chat_buckets) > MAX_CHAT_BUCKETS:
+                        self._prune_buckets()
+                    self.cond.notify_all()
+
+    def shutdown(self):
+        """Send everything still queued, then stop the sender threads"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join()
@@ -0,0 +1,76 @@
+"""
+Which of the sizes Telegram offers for a photo to download.
+
+A photo message lists the same image at several sizes (typically 90, 320, 800 and 1280px on the
+long side), each with ``width``, ``height`` and usually ``file_size``. The largest is the last.
+Filters whose result looks the same in a chat preview at 320px (segment, contour, salt and
+pepper) do not need the full-size variant, and global caps bound what any request downloads.
+"""
+import os
+
+# filter -> longest side (px) its result needs; filters not listed need the largest variant
+DEFAULT_FILTER_SIDES = {'segment': 320, 'contour': 320, 'salt and pepper': 320}
+
+
+def parse_filter_sides(value):
+    """'segment=320,contour=640' -> {'segment': 320, 'contour': 640}"""
+    sides = {}
+    for item in filter(None, (item.strip() for item in value.split(','))):
+        name, _, side = item.rpartition('=')
+        if not name or not side.strip().isdigit():
+            raise RuntimeError(f"Invalid filter size '{item}', expected <filter>=<pixels>")
+        sides[name.strip().lower()] = int(side)
+    return sides
+
+
+def long_side(photo):
+    return max(photo.get('width', 0), photo.get('height', 0))
+
+
+def pixels(photo):
+    return photo.get('width', 0) * photo.get('height', 0)
+
+
+class PhotoSizePolicy:
+    """
+    Picks the smallest photo variant adequate for a filter pipeline.
+
+    ``filter_sides`` ($POLYBOT_PHOTO_FILTER_SIDES, e.g. ``segment=320,contour=320``) maps a
+    filter to the longest side its result needs; a pipeline needs the most any of its steps
+    does, and a step not listed needs the largest variant. ``max_pixels``
+    ($POLYBOT_PHOTO_MAX_PIXELS) and ``max_bytes`` ($POLYBOT_PHOTO_MAX_BYTES) cap every
+    download, falling back to the smallest variant if none fits.
+    """
+
+    def __init__(self, filter_sides=None, max_pixels=None, max_bytes=None):
+        if filter_sides is None:
+            env = os.environ.get('POLYBOT_PHOTO_FILTER_SIDES')
+            filter_sides = parse_filter_sides(env) if env is not None else DEFAULT_FILTER_SIDES
+        self.filter_sides = filter_sides
+        self.max_pixels = max_pixels or int(os.environ.get('POLYBOT_PHOTO_MAX_PIXELS', 0)) or None
+        self.max_bytes = max_bytes or int(os.environ.get('POLYBOT_PHOTO_MAX_BYTES', 0)) or None
+
+    def needed_side(self, steps):
+        """Longest side (px) the pipeline's result needs, or None for full size"""
+        sides = [self.filter_sides.get(step.name) for step in steps]
+        if not sides or None in sides:
+            return None
+        return max(sides)
+
+    def fits_caps(self, photo):
+        if self.max_pixels and pixels(photo) > self.max_pixels:
+            return False
+        # variants without a file_size cannot be checked against the byte cap
+        return not (self.max_bytes and photo.get('file_size', 0) > self.max_bytes)
+
+    def choose(self, photos, steps=()):
+        """The PhotoSize dict from ``photos`` (a message's ``photo`` list) to download for ``steps``"""
+        ordered = sorted(photos, key=pixels)
+        needed = self.needed_side(steps)
+        adequate = [photo for photo in ordered if needed is None or long_side(photo) >= needed]
+        # the smallest adequate variant, or the largest one when none is big enough
+        chosen = adequate[0] if needed is not None and adequate else ordered[-1]
+        if self.fits_caps(chosen):
+            return chosen
+        capped = [photo for photo in ordered if self.fits_caps(photo)]
+        return capped[-1] if capped else ordered[0]
@@ -0,0 +1,252 @@
+import re
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from polybot import noise
+
+# caption name -> (Img method, name of the optional numeric argument)
+FILTERS = {
+    'blur': ('blur', 'blur_level'),
+    'contour': ('contour', None),
+    'rotate': ('rotate', None),
+    'rotate2': ('rotate2', None),
+    'segment': ('segment', None),
+    'salt and pepper': ('salt_n_pepper', 'salt'),
+    'gaussian': ('gaussian_noise', 'sigma'),
+    'speckle': ('speckle', 'sigma'),
+    'brighten': ('brighten', 'value'),
+    'darken': ('darken', 'value'),
+    'invert': ('invert', None),
+}
+
+# caption arguments given in percent, e.g. "salt and pepper 5" sets 5% of pixels each to white and black
+PERCENT_ARGS = {'salt and pepper', 'speckle'}
+
+# accepted caption argument per filter: (lowest, highest or None for no upper bound)
+ARG_RANGES = {
+    'blur': (1, None),
+    'salt and pepper': (0, 50),
+    'gaussian': (0, 255),
+    'speckle': (0, 100),
+    'brighten': (0, 255),
+    'darken': (0, 255),
+}
+
+# filters whose output depends on a random draw as well as the input image (and on the seed, when given)
+RANDOM_FILTERS = {'salt and pepper', 'gaussian', 'speckle'}
+
+POINT_FILTERS = {'brighten', 'darken', 'invert', 'segment'}
+
+# filters a quarter turn can be moved across without changing the result
+ROTATION_EQUIVARIANT = POINT_FILTERS | {'blur'}
+
+SEPARATORS = re.compile(r'\s*(?:,|;|\||->|=>|>|\+)\s*')
+
+Step = namedtuple('Step', ['name', 'arg'])
+
+
+def parse_caption(caption):
+    """
+    Parse a caption such as "blur 8 then contour" or "brighten, invert" into a list of Steps.
+    Filters may be separated by whitespace, "then", ",", ";", "|", "+", ">" or "->", and
+    filters with an argument accept an optional integer within ARG_RANGES.
+    """
+    tokens = [token for token in SEPARATORS.sub(' ', caption.lower()).split() if token != 'then']
+    if not tokens:
+        raise RuntimeError("Empty filter caption")
+
+    names = sorted((tuple(name.split()) for name in FILTERS), key=len, reverse=True)
+    steps = []
+    i = 0
+    while i < len(tokens):
+        match = next((name for name in names if tuple(tokens[i:i + len(name)]) == name), None)
+        if match is None:
+            raise RuntimeError(f"Unknown filter '{tokens[i]}'")
+        i += len(match)
+        name = ' '.join(match)
+
+        arg = None
+        if FILTERS[name][1] and i < len(tokens) and tokens[i].isdigit():
+            arg = int(tokens[i])
+            i += 1
+            low, high = ARG_RANGES[name]
+            if arg < low or (high is not None and arg > high):
+                allowed = f"of at least {low}" if high is None else f"from {low} to {high}"
+                raise RuntimeError(f"'{name}' takes a value {allowed}, not {arg}")
+        steps.append(Step(name, arg))
+
+    return steps
+
+
+def describe(steps):
+    """Canonical text form of a pipeline, e.g. 'blur(8)|contour'"""
+    return '|'.join(step.name if step.arg is None else f'{step.name}({step.arg})' for step in steps)
+
+
+def is_deterministic(steps):
+    return not any(step.name in RANDOM_FILTERS for step in steps)
+
+
+class PointMap:
+    """Clamped affine pixel map: y = clip(scale * x + offset, low, high)"""
+
+    def __init__(self, scale=1.0, offset=0.0, low=-np.inf, high=np.inf):
+        self.scale = scale
+        self.offset = offset
+        self.low = low
+        self.high = high
+
+    def then(self, other):
+        """Compose with ``other`` applied afterwards; the result is still a single PointMap"""
+        low = other.scale * self.low + other.offset
+        high = other.scale * self.high + other.offset
+        if other.scale < 0:
+            low, high = high, low
+        # clip(clip(v, low, high), other.low, other.high) == clip(v, new_low, new_high)
+        new_low = min(max(low, other.low), other.high)
+        new_high = max(min(high, other.high), other.low)
+        return PointMap(other.scale * self.scale, other.scale * self.offset + other.offset, new_low, new_high)
+
+    def __call__(self, values):
+        if np.isscalar(values):
+            return float(min(max(self.scale * values + self.offset, self.low), self.high))
+        out = np.multiply(values, self.scale)
+        out += self.offset
+        return np.clip(out, self.low, self.high, out=out)
+
+
+def point_map(step):
+    if step.name == 'brighten':
+        return PointMap(offset=30 if step.arg is None else step.arg, high=255)
+    if step.name == 'darken':
+        return PointMap(offset=-(30 if step.arg is None else step.arg), low=0)
+    if step.name == 'invert':
+        return PointMap(scale=-1.0, offset=255)
+    raise RuntimeError(f"'{step.name}' is not a clamped affine filter")
+
+
+class FusedPointStage:
+    """
+    A run of point-wise filters compiled into one pass: a clamped affine map, optionally
+    followed by a threshold whose two outputs absorb every filter applied after it.
+    """
+
+    def __init__(self, steps):
+        self.steps = list(steps)
+        self.name = self.steps[0].name if len(self.steps) == 1 else 'fused'
+        self.pre = PointMap()
+        self.threshold = None
+        self.below = self.above = None
+
+        for step in self.steps:
+            if step.name == 'segment':
+                if self.threshold is None:
+                    self.threshold, self.below, self.above = 100, 0.0, 255.0
+                else:
+                    self.below = 255.0 if self.below > 100 else 0.0
+                    self.above = 255.0 if self.above > 100 else 0.0
+            elif self.threshold is None:
+                self.pre = self.pre.then(point_map(step))
+            else:
+                self.below = point_map(step)(self.below)
+                self.above = point_map(step)(self.above)
+
+    def __call__(self, img):
+        if len(self.steps) == 1:
+            run_step(img, self.steps[0])
+            return
+
+        values = self.pre(img.array)
+        if self.threshold is not None:
+            values = np.where(values > self.threshold, self.above, self.below)
+        img.array = values
+
+
+class RotateStage:
+    """Net clockwise quarter turns of every rotation merged into a single rotation"""
+
+    name = 'rotate'
+
+    def __init__(self, turns):
+        self.turns = turns % 4
+
+    def __call__(self, img):
+        # usually the last stage: the pixels are only rotated when read, or the 8-bit output when encoded
+        img.rotate(self.turns, lazy=True)
+
+
+class StepStage:
+
+    def __init__(self, step, rng=None):
+        self.step = step
+        self.name = step.name
+        self.rng = rng
+
+    def __call__(self, img):
+        run_step(img, self.step, self.rng)
+
+
+def run_step(img, step, rng=None):
+    """Apply one Step to ``img``; random filters draw from ``rng`` (a Generator, or fresh entropy if None)"""
+    method, arg_name = FILTERS[step.name]
+    kwargs = {}
+    if step.arg is not None:
+        kwargs[arg_name] = step.arg / 100 if step.name in PERCENT_ARGS else step.arg
+    if step.name in RANDOM_FILTERS:
+        kwargs['seed'] = rng
+    getattr(img, method)(**kwargs)
+
+
+def compile_pipeline(steps, seed=None):
+    """
+    Turn parsed Steps into the list of stages to run. Consecutive point-wise filters are
+    fused into one FusedPointStage, and rotations are merged and postponed past every
+    filter they commute with (point-wise filters and blur), so they run once, on the
+    smallest image. With a ``seed`` every random filter draws from one generator seeded
+    with it, so the whole pipeline is reproducible.
+    """
+    rng = noise.generator(seed) if seed is not None else None
+    stages = []
+    point_run = []
+    turns = 0
+
+    def flush_points():
+        if point_run:
+            stages.append(FusedPointStage(point_run))
+            point_run.clear()
+
+    def flush_rotation():
+        nonlocal turns
+        flush_points()
+        if turns % 4:
+            stages.append(RotateStage(turns))
+        turns = 0
+
+    for step in steps:
+        if step.name in ('rotate', 'rotate2'):
+            turns += 1 if step.name == 'rotate' else 2
+        elif step.name in POINT_FILTERS:
+            point_run.append(step)
+        else:
+            flush_points()
+            if step.name not in ROTATION_EQUIVARIANT:
+                flush_rotation()
+            stages.append(StepStage(step, rng))
+
+    flush_rotation()
+    return stages
+
+
+def run_pipeline(img, steps, timings=None, seed=None):
+    """
+    Run ``steps`` on ``img`` in place, seeding random filters with ``seed`` if given; seconds
+    spent per stage name are added to ``timings`` if given
+    """
+    for stage in compile_pipeline(steps, seed):
+        start = time.perf_counter()
+        stage(img)
+        if timings is not None:
+            timings[stage.name] = timings.get(stage.name, 0.0) + time.perf_counter() - start
+    return img
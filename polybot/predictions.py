@@ -0,0 +1,111 @@
+import os
+import threading
+import time
+from collections import Counter, namedtuple
+
+from loguru import logger
+
+from polybot import metrics
+from polybot.state import MemoryStateBackend
+from polybot.workers import DelayedCalls
+
+# Telegram rejects longer text messages
+MAX_MESSAGE_LENGTH = 4096
+
+Prediction = namedtuple('Prediction', ['prediction_id', 'image_number', 'labels'])
+
+
+def count_labels(labels):
+    """'3 person, 1 dog' for three 'person' and one 'dog' labels, most frequent first"""
+    if not labels:
+        return "Nothing detected"
+    return ', '.join(f'{count} {label}' for label, count in Counter(labels).most_common())
+
+
+def format_predictions(predictions):
+    """
+    Texts reporting ``predictions`` to their chat: one line per image, ordered by image number,
+    split into as few messages as Telegram's length limit allows
+    """
+    if len(predictions) == 1:
+        prediction = predictions[0]
+        if prediction.image_number is None:
+            return [f"Detection result: {count_labels(prediction.labels)}"]
+        return [f"Detection result for Image {prediction.image_number}: {count_labels(prediction.labels)}"]
+
+    ordered = sorted(predictions, key=lambda p: (p.image_number is None, p.image_number or 0))
+    texts = ["Detection results:"]
+    for prediction in ordered:
+        name = "Image" if prediction.image_number is None else f"Image {prediction.image_number}"
+        line = f"{name}: {count_labels(prediction.labels)}"
+        if len(texts[-1]) + 1 + len(line) > MAX_MESSAGE_LENGTH:
+            texts.append(line)
+        else:
+            texts[-1] += '\n' + line
+    return texts
+
+
+class PredictionAggregator:
+    """
+    Collects detection results per chat and hands each chat's batch to ``deliver(chat_id, predictions)``
+    once ``window`` seconds have passed since the chat's first pending result, so an album sent to
+    detect is answered with one message instead of one per photo.
+
+    Pending results live in ``pending``, a StateNamespace of the bot's state backend, so with a
+    shared backend the callbacks for one chat are batched together whichever worker or replica
+    receives them. The process that adds a chat's first result delivers the batch; taking it is
+    an atomic pop, so a result added meanwhile starts a new batch instead of getting lost, and a
+    batch left behind by a process that died goes out with the chat's next result. A repeated
+    callback for a pending prediction replaces the earlier one. ``close()`` delivers the batches
+    this process is due to deliver.
+    """
+
+    def __init__(self, deliver, pending=None, window=None):
+        self.deliver = deliver
+        # chat id -> [[prediction id, image number, labels, received at], ...]
+        self.pending = pending if pending is not None else MemoryStateBackend().namespace('pending_predictions')
+        self.window = window if window is not None else float(os.environ.get('POLYBOT_PREDICTION_WINDOW', 2.0))
+        self.timers = DelayedCalls()
+        self.owned = set()
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def add(self, chat_id, prediction_id, image_number, labels):
+        if self.closed:
+            raise RuntimeError("Prediction aggregator is closed")
+        now = time.time()
+        if self.pending.append(chat_id, [prediction_id, image_number, list(labels), now]) == 1:
+            with self.lock:
+                self.owned.add(chat_id)
+            self.timers.call_later(self.window, self.deliver_chat, chat_id)
+            return
+
+        first = (self.pending.get(chat_id) or [[None, None, None, now]])[0]
+        if now - first[3] > 2 * self.window:
+            # whoever started this batch never delivered it
+            self.deliver_chat(chat_id)
+
+    def deliver_chat(self, chat_id):
+        """Deliver the chat's pending results, if another process has not already"""
+        with self.lock:
+            self.owned.discard(chat_id)
+        items = self.pending.pop(chat_id, None)
+        if not items:
+            return
+        predictions = {item[0]: Prediction(*item[:3]) for item in items}
+        metrics.PREDICTIONS_PER_MESSAGE.observe(len(predictions))
+        try:
+            self.deliver(chat_id, list(predictions.values()))
+        except Exception as e:
+            logger.exception(f"Delivering {len(predictions)} detection results to chat {chat_id} failed: {e}")
+
+    def flush(self):
+        """Deliver the batches this process is due to deliver right now, from the calling thread"""
+        with self.lock:
+            chats = list(self.owned)
+        for chat_id in chats:
+            self.deliver_chat(chat_id)
+
+    def close(self):
+        self.closed = True
+        self.flush()
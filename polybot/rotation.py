@@ -0,0 +1,38 @@
+"""
+Quarter-turn rotations of 2D arrays of any shape.
+
+``np.ascontiguousarray(np.rot90(a))`` copies element by element in output order, reading the
+source a whole row apart each time, so on large images almost every read misses the cache.
+Here 90 and 270 degree turns copy square blocks small enough for the source and destination
+block to stay in cache together, and a half turn is one reversal pass instead of two quarter
+turns.
+"""
+import numpy as np
+
+# 256 x 256 float64 pixels = 512KB per block
+BLOCK = 256
+
+
+def rotate_array(array, turns=1, block=BLOCK):
+    """
+    ``array`` rotated clockwise by ``turns`` quarter turns (negative turns rotate counterclockwise),
+    as a new C-contiguous array; ``array`` itself when that is a whole number of full turns.
+    """
+    turns %= 4
+    if turns == 0:
+        return array
+    if turns == 2:
+        return array[::-1, ::-1].copy()
+
+    height, width = array.shape
+    out = np.empty((width, height), dtype=array.dtype)
+    for top in range(0, height, block):
+        bottom = min(height, top + block)
+        for left in range(0, width, block):
+            right = min(width, left + block)
+            tile = array[top:bottom, left:right]
+            if turns == 1:
+                out[left:right, height - bottom:height - top] = tile[::-1].T
+            else:
+                out[width - right:width - left, top:bottom] = tile[:, ::-1].T
+    return out
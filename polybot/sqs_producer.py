@@ -0,0 +1,181 @@
+import atexit
+import os
+import threading
+import time
+import uuid
+
+from loguru import logger
+
+from polybot import metrics
+
+MAX_BATCH_ENTRIES = 10
+MAX_BATCH_BYTES = 256 * 1024
+
+
+class _Entry:
+
+    def __init__(self, body, on_failure=None):
+        self.id = uuid.uuid4().hex
+        self.body = body
+        self.size = len(body.encode())
+        self.on_failure = on_failure
+        self.enqueued_at = time.perf_counter()
+        # a retried entry waits in the buffer until then instead of blocking the sender thread
+        self.not_before = 0.0
+        self.attempts = 0
+
+
+class BatchingSqsProducer:
+    """
+    Buffers SQS messages and sends them with ``send_message_batch``.
+
+    A batch is sent as soon as 10 messages (or 256KB of bodies) are waiting, or once the
+    oldest message has waited ``linger`` seconds. Entries SQS reports as failed are retried
+    up to ``max_retries`` times with exponential backoff (other batches go out meanwhile) unless
+    the failure is the sender's fault; a message given up on calls its ``on_failure``. Whatever
+    is still buffered is flushed by ``close()``, which is also registered to run at interpreter exit.
+    """
+
+    def __init__(self, sqs_client, queue_url, linger=None, max_retries=None):
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+        self.linger = linger if linger is not None else float(os.environ.get('POLYBOT_SQS_LINGER', 0.05))
+        self.max_retries = max_retries if max_retries is not None else int(os.environ.get('POLYBOT_SQS_RETRIES', 3))
+        self.buffer = []
+        self.condition = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name='polybot-sqs', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def send(self, body, on_failure=None):
+        """Buffer ``body``; ``on_failure()`` is called if SQS never accepts it"""
+        entry = _Entry(body, on_failure)
+        if entry.size > MAX_BATCH_BYTES:
+            raise RuntimeError(f"SQS message of {entry.size} bytes exceeds the {MAX_BATCH_BYTES} bytes limit")
+
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("SQS producer is closed")
+            self.buffer.append(entry)
+            self.condition.notify()
+
+    def flush(self):
+        """Send everything buffered right now, from the calling thread (waiting out retry backoffs)"""
+        while True:
+            with self.condition:
+                if not self.buffer:
+                    return
+                batch = self._take_batch()
+                wait = min(entry.not_before for entry in self.buffer) - time.perf_counter() if not batch else 0
+            if batch:
+                self._send_batch(batch)
+            elif wait > 0:
+                time.sleep(wait)
+
+    def close(self):
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.closed and not self._batch_ready():
+                    self.condition.wait(self._next_wake())
+                if self.closed:
+                    return
+                batch = self._take_batch()
+            self._send_batch(batch)
+
+    def _ready(self, now):
+        return [entry for entry in self.buffer if entry.not_before <= now]
+
+    def _next_wake(self):
+        """Seconds until the oldest ready entry has lingered long enough or a backoff ends; None if idle"""
+        if not self.buffer:
+            return None
+        now = time.perf_counter()
+        ready = self._ready(now)
+        times = [entry.not_before for entry in self.buffer if entry.not_before > now]
+        if ready:
+            times.append(ready[0].enqueued_at + self.linger)
+        return max(0.0, min(times) - now)
+
+    def _batch_ready(self):
+        now = time.perf_counter()
+        ready = self._ready(now)
+        if not ready:
+            return False
+        if len(ready) >= MAX_BATCH_ENTRIES or sum(entry.size for entry in ready) >= MAX_BATCH_BYTES:
+            return True
+        return now - ready[0].enqueued_at >= self.linger
+
+    def _take_batch(self):
+        batch = []
+        size = 0
+        for entry in self._ready(time.perf_counter()):
+            if len(batch) == MAX_BATCH_ENTRIES or size + entry.size > MAX_BATCH_BYTES:
+                break
+            batch.append(entry)
+            size += entry.size
+        for entry in batch:
+            self.buffer.remove(entry)
+        return batch
+
+    def _send_batch(self, batch):
+        metrics.SQS_BATCH_SIZE.observe(len(batch))
+        entries = {entry.id: entry for entry in batch}
+        try:
+            response = self.sqs_client.send_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[{'Id': entry.id, 'MessageBody': entry.body} for entry in batch]
+            )
+        except Exception as e:
+            logger.exception(f"send_message_batch failed for {len(batch)} messages: {e}")
+            self._retry(batch)
+            return
+
+        now = time.perf_counter()
+        for success in response.get('Successful', []):
+            metrics.SQS_ENQUEUE_SECONDS.observe(now - entries[success['Id']].enqueued_at)
+
+        retryable = []
+        for failure in response.get('Failed', []):
+            entry = entries[failure['Id']]
+            if failure.get('SenderFault'):
+                logger.error(f"SQS rejected message {entry.id}: {failure.get('Code')} {failure.get('Message')}")
+                self._give_up(entry)
+            else:
+                retryable.append(entry)
+        self._retry(retryable)
+
+        logger.success(f"✅ Sent {len(batch) - len(response.get('Failed', []))}/{len(batch)} messages to SQS.")
+
+    def _retry(self, entries):
+        requeue = []
+        for entry in entries:
+            entry.attempts += 1
+            if entry.attempts > self.max_retries:
+                logger.error(f"Giving up on SQS message {entry.id} after {entry.attempts} attempts")
+                self._give_up(entry)
+            else:
+                entry.not_before = time.perf_counter() + min(2.0, 0.1 * 2 ** (entry.attempts - 1))
+                requeue.append(entry)
+
+        if requeue:
+            with self.condition:
+                self.buffer[:0] = requeue
+                self.condition.notify()
+
+    def _give_up(self, entry):
+        metrics.SQS_MESSAGES_DROPPED.inc()
+        if entry.on_failure is not None:
+            try:
+                entry.on_failure()
+            except Exception as e:
+                logger.exception(f"on_failure for SQS message {entry.id} raised: {e}")
@@ -0,0 +1,437 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+
+from polybot import metrics
+
+
+class TTLDict(MutableMapping):
+    """
+    Thread-safe dict whose entries expire ``ttl`` seconds after they were last written and
+    which holds at most ``max_size`` entries, evicting the least recently written first.
+    Sizes and evictions are exported under the store's ``name``.
+    """
+
+    def __init__(self, name, max_size=10000, ttl=3600, clock=time.monotonic):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()  # key -> (expires_at, value), oldest write first
+        self.lock = threading.RLock()
+
+    def __getitem__(self, key):
+        with self.lock:
+            expires_at, value = self.entries[key]
+            if expires_at <= self.clock():
+                self._evict(key, 'ttl')
+                raise KeyError(key)
+            return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.entries[key] = (self.clock() + self.ttl, value)
+            self.entries.move_to_end(key)
+            self.purge_expired()
+            while len(self.entries) > self.max_size:
+                self._evict(next(iter(self.entries)), 'size')
+            self._report_size()
+
+    def __delitem__(self, key):
+        with self.lock:
+            del self.entries[key]
+            self._report_size()
+
+    def __iter__(self):
+        with self.lock:
+            self.purge_expired()
+            return iter(list(self.entries))
+
+    def __len__(self):
+        with self.lock:
+            self.purge_expired()
+            return len(self.entries)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def purge_expired(self):
+        """Drop expired entries; they are ordered by expiry, so this stops at the first live one"""
+        with self.lock:
+            now = self.clock()
+            while self.entries:
+                key, (expires_at, _) = next(iter(self.entries.items()))
+                if expires_at > now:
+                    break
+                self._evict(key, 'ttl')
+
+    def _evict(self, key, reason):
+        del self.entries[key]
+        metrics.STATE_EVICTIONS.labels(store=self.name, reason=reason).inc()
+        self._report_size()
+
+    def _report_size(self):
+        metrics.STATE_SIZE.labels(store=self.name).set(len(self.entries))
+
+
+def compact_photo_message(msg):
+    """Keep only what album processing needs from a Telegram photo message (all sizes, for PhotoSizePolicy)"""
+    return {
+        'message_id': msg.get('message_id'),
+        'chat': {'id': msg['chat']['id']},
+        'photo': list(msg['photo']),
+    }
+
+
+_MISSING = object()
+
+
+class StateNamespace(MutableMapping):
+    """
+    Dict-like view of one namespace of a state backend. Keys are stored as strings so every
+    backend behaves the same. Besides the mapping API it exposes the backend's atomic
+    operations, which stay correct when several processes or replicas share the backend.
+    """
+
+    def __init__(self, backend, name):
+        self.backend = backend
+        self.name = name
+
+    def __getitem__(self, key):
+        value = self.backend.get(self.name, str(key), _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.backend.set(self.name, str(key), value)
+
+    def __delitem__(self, key):
+        if self.backend.pop(self.name, str(key), _MISSING) is _MISSING:
+            raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.backend.keys(self.name))
+
+    def __len__(self):
+        return len(self.backend.keys(self.name))
+
+    def __contains__(self, key):
+        return self.backend.get(self.name, str(key), _MISSING) is not _MISSING
+
+    def get(self, key, default=None):
+        return self.backend.get(self.name, str(key), default)
+
+    def pop(self, key, default=_MISSING):
+        value = self.backend.pop(self.name, str(key), default)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def incr(self, key, amount=1):
+        """Atomically add ``amount`` to the counter at ``key`` (starting from 0); returns the new value"""
+        return self.backend.incr(self.name, str(key), amount)
+
+    def append(self, key, item):
+        """Atomically append ``item`` to the list at ``key``; returns the new length"""
+        return self.backend.append(self.name, str(key), item)
+
+    def set_if_absent(self, key, value):
+        """Store ``value`` unless ``key`` already exists; returns True if it was stored"""
+        return self.backend.set_if_absent(self.name, str(key), value)
+
+    def compare_and_set(self, key, expected, value):
+        """Store ``value`` only if the current value equals ``expected`` (None meaning absent)"""
+        return self.backend.compare_and_set(self.name, str(key), expected, value)
+
+    def add(self, item):
+        self[item] = True
+
+    def add_if_absent(self, item):
+        return self.set_if_absent(item, True)
+
+
+class MemoryStateBackend:
+    """Process-local backend built on TTLDict; the default for a single replica"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.stores = {}
+        self.lock = threading.RLock()
+
+    def namespace(self, name, ttl=3600, max_size=10000):
+        with self.lock:
+            if name not in self.stores:
+                self.stores[name] = TTLDict(name, max_size=max_size, ttl=ttl, clock=self.clock)
+        return StateNamespace(self, name)
+
+    def get(self, namespace, key, default=None):
+        return self.stores[namespace].get(key, default)
+
+    def set(self, namespace, key, value):
+        self.stores[namespace][key] = value
+
+    def pop(self, namespace, key, default=None):
+        store = self.stores[namespace]
+        with store.lock:
+            return store.pop(key, default)
+
+    def keys(self, namespace):
+        return list(self.stores[namespace])
+
+    def incr(self, namespace, key, amount=1):
+        store = self.stores[namespace]
+        with store.lock:
+            store[key] = store.get(key, 0) + amount
+            return store[key]
+
+    def append(self, namespace, key, item):
+        store = self.stores[namespace]
+        with store.lock:
+            items = store.get(key, []) + [item]
+            store[key] = items
+            return len(items)
+
+    def set_if_absent(self, namespace, key, value):
+        return self.compare_and_set(namespace, key, None, value)
+
+    def compare_and_set(self, namespace, key, expected, value):
+        store = self.stores[namespace]
+        with store.lock:
+            if store.get(key) != expected:
+                return False
+            store[key] = value
+            return True
+
+
+class SqliteStateBackend:
+    """
+    Backend on a SQLite database file, shared by every process (e.g. gunicorn workers) that
+    can reach the file. Values are stored as JSON, so tuples come back as lists. Each
+    read-modify-write runs in a ``BEGIN IMMEDIATE`` transaction, which makes it atomic
+    across processes.
+    """
+
+    PURGE_EVERY = 100
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self.namespaces = {}
+        self.writes = {}
+        self.local = threading.local()
+        with self._transaction() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS state ('
+                         'namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL, '
+                         'PRIMARY KEY (namespace, key))')
+            conn.execute('CREATE INDEX IF NOT EXISTS state_expiry ON state (namespace, expires_at)')
+
+    def namespace(self, name, ttl=3600, max_size=10000):
+        self.namespaces[name] = (ttl, max_size)
+        self.writes.setdefault(name, 0)
+        return StateNamespace(self, name)
+
+    def _connection(self):
+        # one connection per thread, and never one inherited across a fork
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _read(self, conn, namespace, key, default=None):
+        row = conn.execute('SELECT value FROM state WHERE namespace = ? AND key = ? AND expires_at > ?',
+                           (namespace, key, self.clock())).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def _write(self, conn, namespace, key, value):
+        ttl, max_size = self.namespaces[namespace]
+        conn.execute('INSERT OR REPLACE INTO state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)',
+                     (namespace, key, json.dumps(value), self.clock() + ttl))
+
+        self.writes[namespace] += 1
+        if self.writes[namespace] % self.PURGE_EVERY == 0:
+            self._purge(conn, namespace, max_size)
+
+    def _purge(self, conn, namespace, max_size):
+        expired = conn.execute('DELETE FROM state WHERE namespace = ? AND expires_at <= ?',
+                               (namespace, self.clock())).rowcount
+        metrics.STATE_EVICTIONS.labels(store=namespace, reason='ttl').inc(expired)
+
+        size = conn.execute('SELECT COUNT(*) FROM state WHERE namespace = ?', (namespace,)).fetchone()[0]
+        if size > max_size:
+            conn.execute('DELETE FROM state WHERE rowid IN ('
+                         'SELECT rowid FROM state WHERE namespace = ? ORDER BY expires_at LIMIT ?)',
+                         (namespace, size - max_size))
+            metrics.STATE_EVICTIONS.labels(store=namespace, reason='size').inc(size - max_size)
+            size = max_size
+        metrics.STATE_SIZE.labels(store=namespace).set(size)
+
+    def get(self, namespace, key, default=None):
+        return self._read(self._connection(), namespace, key, default)
+
+    def set(self, namespace, key, value):
+        with self._transaction() as conn:
+            self._write(conn, namespace, key, value)
+
+    def pop(self, namespace, key, default=None):
+        with self._transaction() as conn:
+            value = self._read(conn, namespace, key, _MISSING)
+            if value is _MISSING:
+                return default
+            conn.execute('DELETE FROM state WHERE namespace = ? AND key = ?', (namespace, key))
+            return value
+
+    def keys(self, namespace):
+        rows = self._connection().execute('SELECT key FROM state WHERE namespace = ? AND expires_at > ?',
+                                          (namespace, self.clock()))
+        return [row[0] for row in rows]
+
+    def incr(self, namespace, key, amount=1):
+        with self._transaction() as conn:
+            value = self._read(conn, namespace, key, 0) + amount
+            self._write(conn, namespace, key, value)
+            return value
+
+    def append(self, namespace, key, item):
+        with self._transaction() as conn:
+            items = self._read(conn, namespace, key, []) + [item]
+            self._write(conn, namespace, key, items)
+            return len(items)
+
+    def set_if_absent(self, namespace, key, value):
+        return self.compare_and_set(namespace, key, None, value)
+
+    def compare_and_set(self, namespace, key, expected, value):
+        with self._transaction() as conn:
+            if self._read(conn, namespace, key) != expected:
+                return False
+            self._write(conn, namespace, key, value)
+            return True
+
+
+class RedisStateBackend:
+    """
+    Backend on a Redis (or Redis-compatible) server, for replicas on different hosts.
+    Requires the optional ``redis`` package. Values are JSON strings under
+    ``polybot:<namespace>:<key>`` with a per-namespace expiry; Redis' own eviction policy
+    takes the place of ``max_size``.
+    """
+
+    def __init__(self, url=None, client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise RuntimeError("The redis package is required for a redis:// state backend") from e
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.namespaces = {}
+
+    def namespace(self, name, ttl=3600, max_size=10000):
+        self.namespaces[name] = int(ttl)
+        return StateNamespace(self, name)
+
+    def _key(self, namespace, key):
+        return f'polybot:{namespace}:{key}'
+
+    def get(self, namespace, key, default=None):
+        value = self.client.get(self._key(namespace, key))
+        return default if value is None else json.loads(value)
+
+    def set(self, namespace, key, value):
+        self.client.set(self._key(namespace, key), json.dumps(value), ex=self.namespaces[namespace])
+
+    def pop(self, namespace, key, default=None):
+        pipe = self.client.pipeline()
+        pipe.get(self._key(namespace, key))
+        pipe.delete(self._key(namespace, key))
+        value, _ = pipe.execute()
+        return default if value is None else json.loads(value)
+
+    def keys(self, namespace):
+        prefix = self._key(namespace, '')
+        return [key.decode()[len(prefix):] for key in self.client.scan_iter(match=f'{prefix}*')]
+
+    def incr(self, namespace, key, amount=1):
+        pipe = self.client.pipeline()
+        pipe.incrby(self._key(namespace, key), amount)
+        pipe.expire(self._key(namespace, key), self.namespaces[namespace])
+        return pipe.execute()[0]
+
+    def append(self, namespace, key, item):
+        return self._update(namespace, key, lambda items: (items or []) + [item], len)
+
+    def set_if_absent(self, namespace, key, value):
+        return bool(self.client.set(self._key(namespace, key), json.dumps(value),
+                                    ex=self.namespaces[namespace], nx=True))
+
+    def compare_and_set(self, namespace, key, expected, value):
+        def update(current):
+            if current != expected:
+                raise _CasMismatch()
+            return value
+
+        try:
+            return self._update(namespace, key, update, lambda _: True)
+        except _CasMismatch:
+            return False
+
+    def _update(self, namespace, key, fn, result):
+        """Optimistic read-modify-write with WATCH/MULTI, retried when another writer wins"""
+        import redis
+
+        redis_key = self._key(namespace, key)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(redis_key)
+                    current = pipe.get(redis_key)
+                    new_value = fn(None if current is None else json.loads(current))
+                    pipe.multi()
+                    pipe.set(redis_key, json.dumps(new_value), ex=self.namespaces[namespace])
+                    pipe.execute()
+                    return result(new_value)
+                except redis.WatchError:
+                    continue
+
+
+class _CasMismatch(Exception):
+    pass
+
+
+def create_backend(url=None):
+    """
+    Build the state backend named by ``url`` (default: $POLYBOT_STATE_BACKEND or 'memory'):
+    'memory', 'sqlite:///path/to/state.db' or 'redis://host:6379/0'.
+    """
+    url = url or os.environ.get('POLYBOT_STATE_BACKEND', 'memory')
+    if url == 'memory':
+        return MemoryStateBackend()
+    if url.startswith('sqlite:///'):
+        return SqliteStateBackend(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://')):
+        return RedisStateBackend(url)
+    raise RuntimeError(f"Unknown state backend '{url}'")
@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from telebot import apihelper
+from urllib3.util.retry import Retry
+from loguru import logger
+
+from polybot import metrics
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_session = None
+_lock = threading.Lock()
+
+
+def endpoint_name(url):
+    """Bot API method of a request URL (``sendPhoto``), or ``downloadFile`` for file downloads; never the token"""
+    path = requests.utils.urlparse(url).path
+    if '/file/bot' in path:
+        return 'downloadFile'
+    return path.rstrip('/').rsplit('/', 1)[-1]
+
+
+def retry_delay(response, attempt, backoff, max_wait):
+    """Seconds to wait before retrying ``response``: Telegram's ``retry_after`` when given, else exponential backoff"""
+    delay = backoff * 2 ** attempt
+    try:
+        delay = float(response.json()['parameters']['retry_after'])
+    except (ValueError, KeyError, TypeError):
+        if response.headers.get('Retry-After', '').isdigit():
+            delay = float(response.headers['Retry-After'])
+    return min(delay, max_wait)
+
+
+class TelegramAdapter(HTTPAdapter):
+    """
+    Connection-pooling adapter for the Bot API. Records per-endpoint latency and retries
+    429 and 5xx responses, waiting for the ``retry_after`` Telegram asks for. Connection
+    errors are retried by urllib3 only when the request never reached the server.
+    """
+
+    def __init__(self, pool_size, retries, backoff, max_wait):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_wait = max_wait
+        super().__init__(pool_connections=pool_size, pool_maxsize=pool_size,
+                         max_retries=Retry(total=None, connect=retries, read=0, status=0, other=0,
+                                           backoff_factor=backoff))
+
+    def send(self, request, **kwargs):
+        endpoint = endpoint_name(request.url)
+        for attempt in range(self.retries + 1):
+            start = time.perf_counter()
+            response = super().send(request, **kwargs)
+            metrics.TELEGRAM_REQUEST_SECONDS.labels(endpoint=endpoint).observe(time.perf_counter() - start)
+            if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                return response
+
+            delay = retry_delay(response, attempt, self.backoff, self.max_wait)
+            metrics.TELEGRAM_RETRIES.labels(endpoint=endpoint, status=response.status_code).inc()
+            logger.warning(f"Telegram {endpoint} returned {response.status_code}, retrying in {delay:.1f}s")
+            response.close()
+            time.sleep(delay)
+
+
+def create_session(pool_size=None, retries=None, backoff=None, max_wait=None):
+    adapter = TelegramAdapter(
+        pool_size=pool_size or int(os.environ.get('POLYBOT_TELEGRAM_POOL_SIZE', 16)),
+        retries=retries if retries is not None else int(os.environ.get('POLYBOT_TELEGRAM_RETRIES', 3)),
+        backoff=backoff if backoff is not None else float(os.environ.get('POLYBOT_TELEGRAM_BACKOFF', 0.5)),
+        max_wait=max_wait if max_wait is not None else float(os.environ.get('POLYBOT_TELEGRAM_MAX_RETRY_WAIT', 30)))
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def install_session():
+    """
+    Route every telebot call (API methods and file downloads) through one pooled keep-alive
+    session shared by all threads, instead of telebot's per-thread sessions. Safe to call
+    more than once; a forked child drops the pooled connections it inherited.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            _session = create_session()
+            os.register_at_fork(after_in_child=_session.close)
+        apihelper.session = _session
+        return _session
@@ -0,0 +1,164 @@
+import threading
+import time
+import unittest
+from unittest.mock import patch, MagicMock, Mock
+import numpy as np
+from polybot.bot import ImageProcessingBot
+from polybot.codec import decode_gray, encode_gray
+from polybot.workers import MessageDispatcher
+
+def album_msg(message_id, caption=None, album='album'):
+    msg = {'message_id': message_id, 'from': {'id': 1}, 'chat': {'id': 10}, 'media_group_id': album,
+           'photo': [{'file_id': f'file{message_id}', 'file_unique_id': f'unique{message_id}'}]}
+    if caption:
+        msg['caption'] = caption
+    return msg
+
+
+def sent_album(*file_ids):
+    return [MagicMock(photo=[Mock(file_id=file_id)]) for file_id in file_ids]
+
+
+class TestAlbumFiltering(unittest.TestCase):
+
+    @patch('telebot.TeleBot')
+    def setUp(self, mock_telebot):
+        bot = ImageProcessingBot(token='bot_token', telegram_chat_url='webhook_url', register_webhook=False)
+        bot.telegram_bot_client = mock_telebot.return_value
+        bot.telegram_bot_client.send_media_group.return_value = sent_album('r1', 'r2', 'r3')
+        bot.storage_mode = 'memory'
+        bot.new_users.add(1)
+        bot.upload_to_s3 = MagicMock(return_value='archived.jpg')
+        self.bot = bot
+        self.scheduled = []
+
+    def receive(self, *msgs):
+        with patch.object(self.bot, 'schedule_album', side_effect=lambda *args: self.scheduled.append(args)):
+            for msg in msgs:
+                self.bot.handle_message(msg)
+
+    def test_one_album_reply_once_the_album_stops_growing(self):
+        with patch.object(self.bot, 'fetch_photo', side_effect=lambda msg, photo: photo['file_id'].encode()), \
+                patch.object(self.bot, 'apply_filters', side_effect=lambda data, caption, seed: data + b' ' + caption.encode()):
+            self.receive(album_msg(1, caption='Blur'), album_msg(2), album_msg(3))
+            self.assertEqual([('album', 1), ('album', 2), ('album', 3)], self.scheduled)
+
+            # the checks of earlier photos see a grown album and leave it to the last one
+            self.bot.process_album('album', 1)
+            self.bot.process_album('album', 2)
+            self.bot.telegram_bot_client.send_media_group.assert_not_called()
+            self.bot.process_album('album', 3)
+            self.bot.process_album('album', 3)
+
+        self.bot.telegram_bot_client.send_media_group.assert_called_once()
+        chat_id, media = self.bot.telegram_bot_client.send_media_group.call_args.args
+        self.assertEqual(10, chat_id)
+        self.assertEqual([b'file1 blur', b'file2 blur', b'file3 blur'], [item.media.file.getvalue() for item in media])
+        self.assertEqual(3, self.bot.upload_to_s3.call_count)
+        self.bot.telegram_bot_client.send_message.assert_not_called()
+
+    def test_photos_are_fetched_concurrently(self):
+        barrier = threading.Barrier(3, timeout=5)
+
+        def fetch(msg, photo):
+            barrier.wait()
+            return b'photo'
+
+        with patch.object(self.bot, 'fetch_photo', side_effect=fetch), \
+                patch.object(self.bot, 'apply_filters', return_value=b'filtered'):
+            self.receive(album_msg(1, caption='contour'), album_msg(2), album_msg(3))
+            self.bot.process_album('album', 3)
+
+        self.assertEqual(3, len(self.bot.telegram_bot_client.send_media_group.call_args.args[1]))
+
+    def test_repeated_album_is_answered_from_the_cache(self):
+        with patch.object(self.bot, 'fetch_photo', return_value=b'photo') as mock_fetch, \
+                patch.object(self.bot, 'apply_filters', return_value=b'filtered'):
+            self.receive(album_msg(1, caption='invert', album='a'), album_msg(2, album='a'), album_msg(3, album='a'))
+            self.bot.process_album('a', 3)
+            self.receive(album_msg(1, caption='invert', album='b'), album_msg(2, album='b'), album_msg(3, album='b'))
+            self.bot.process_album('b', 3)
+
+        self.assertEqual(3, mock_fetch.call_count)
+        media = self.bot.telegram_bot_client.send_media_group.call_args.args[1]
+        self.assertEqual(['r1', 'r2', 'r3'], [item.media for item in media])
+
+    def test_failed_photo_is_reported_and_the_rest_sent(self):
+        def fetch(msg, photo):
+            if photo['file_id'] == 'file2':
+                raise RuntimeError('download failed')
+            return b'photo'
+
+        with patch.object(self.bot, 'fetch_photo', side_effect=fetch), \
+                patch.object(self.bot, 'apply_filters', return_value=b'filtered'):
+            self.receive(album_msg(1, caption='segment'), album_msg(2), album_msg(3))
+            self.bot.process_album('album', 3)
+
+        self.bot.telegram_bot_client.send_message.assert_called_once_with(10, 'Could not filter 1 of the 3 photos.')
+        self.assertEqual(2, len(self.bot.telegram_bot_client.send_media_group.call_args.args[1]))
+
+    def test_concat_joins_every_photo(self):
+        photos = {f'file{i}': encode_gray(np.full(shape, 50.0 * i)) for i, shape in
+                  enumerate([(60, 80), (30, 40), (90, 60)], start=1)}
+        with patch.object(self.bot, 'fetch_photo', side_effect=lambda msg: photos[msg['photo'][-1]['file_id']]), \
+                patch.object(self.bot, 'send_photo') as mock_send:
+            self.receive(album_msg(1, caption='concat grid'), album_msg(2), album_msg(3))
+            self.bot.process_album('album', 3)
+
+        # three photos in a 2x2 grid of the first photo's size, each scaled to fit its cell
+        chat_id, result = mock_send.call_args.args
+        self.assertEqual((120, 160), decode_gray(result).shape)
+        self.bot.telegram_bot_client.send_media_group.assert_not_called()
+
+    def test_detect_queues_every_photo(self):
+        with patch.object(self.bot, 'fetch_photo', side_effect=lambda msg: msg['photo'][-1]['file_id']), \
+                patch.object(self.bot, 'upload_and_enqueue', return_value=True) as mock_enqueue:
+            self.receive(album_msg(1, caption='Detect'), album_msg(2), album_msg(3))
+            self.bot.process_album('album', 3)
+
+        self.assertEqual(['file1', 'file2', 'file3'], sorted(call.args[0] for call in mock_enqueue.call_args_list))
+        self.assertEqual([1, 2, 3], sorted(call.args[3] for call in mock_enqueue.call_args_list))
+        self.assertEqual(3, len(self.bot.prediction_number_map))
+        self.bot.telegram_bot_client.send_message.assert_called_once_with(
+            10, "🕐 Images 1, 2, 3 received. You'll get results soon.")
+
+    def test_complete_album_runs_as_a_dispatcher_job(self):
+        self.bot.dispatcher = MessageDispatcher(Mock(), max_threads=1, max_pending=1)
+        threads = []
+        with patch.object(self.bot, 'filter_album', side_effect=lambda *args: threads.append(threading.current_thread().name)):
+            self.receive(album_msg(1, caption='blur'), album_msg(2))
+            with patch.object(self.bot.dispatcher, 'submit_call', wraps=self.bot.dispatcher.submit_call) as mock_submit:
+                self.bot.dispatch_album('album', 1)
+                mock_submit.assert_not_called()
+            self.bot.dispatch_album('album', 2)
+            self.bot.dispatcher.shutdown()
+
+        self.assertEqual(1, len(threads))
+        self.assertTrue(threads[0].startswith('polybot-job'))
+
+    def test_album_rejected_by_a_full_dispatcher(self):
+        self.bot.dispatcher = Mock(**{'submit_call.return_value': False})
+        with patch.object(self.bot, 'filter_album') as mock_filter:
+            self.receive(album_msg(1, caption='blur'), album_msg(2))
+            self.bot.dispatch_album('album', 2)
+
+        mock_filter.assert_not_called()
+        self.bot.telegram_bot_client.send_message.assert_called_once_with(
+            10, "I'm busy with other images right now, please try again in a minute.")
+
+    def test_debounce_timer(self):
+        self.bot.album_debounce = 0.05
+        with patch.object(self.bot, 'filter_album') as mock_filter:
+            self.bot.handle_message(album_msg(1, caption='blur'))
+            self.bot.handle_message(album_msg(2))
+            deadline = time.monotonic() + 5
+            while not mock_filter.called and time.monotonic() < deadline:
+                time.sleep(0.01)
+            time.sleep(0.1)
+
+        mock_filter.assert_called_once()
+        self.assertEqual(2, len(mock_filter.call_args.args[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+from unittest.mock import patch
+from polybot.benchmarks import suite
+
+
+class TestBenchmarkSuite(unittest.TestCase):
+
+    def test_reports_every_filter_and_handler_caption(self):
+        with patch.dict(suite.SIZES, {'tiny': (96, 128)}):
+            results = (suite.bench_filters(['tiny'], repeat=2) + suite.bench_decode(['tiny'], repeat=2)
+                       + suite.bench_handler(['tiny'], repeat=2))
+
+        names = {result['name'] for result in results}
+        self.assertTrue(set(suite.FILTER_BENCHMARKS) | set(suite.DECODE_BENCHMARKS) <= names)
+        self.assertIn('handle_message(rotate then segment)', names)
+        for result in results:
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            self.assertGreater(result['throughput_per_s'], 0)
+            self.assertGreater(result['peak_mb'], 0)
+
+    def test_regression_threshold(self):
+        baseline = [{'name': 'blur(16)', 'size': '320', 'p50_ms': 10.0},
+                    {'name': 'invert', 'size': '320', 'p50_ms': 1.0}]
+        results = [{'name': 'blur(16)', 'size': '320', 'p50_ms': 11.9},
+                   {'name': 'invert', 'size': '320', 'p50_ms': 1.3},
+                   {'name': 'contour', 'size': '320', 'p50_ms': 50.0}]
+
+        regressions = suite.find_regressions(results, baseline, threshold=0.2)
+        self.assertEqual(['invert@320'], [suite.key(result) for result, _ in regressions])
+
+
+if __name__ == '__main__':
+    unittest.main()
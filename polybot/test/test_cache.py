@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+from polybot.bot import ImageProcessingBot
+from polybot.cache import ResultCache
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_key_depends_on_photo_and_pipeline(self):
+        key = ResultCache.key('AQADAb8xG8e94FF9', 'blur')
+        self.assertEqual(key, ResultCache.key('AQADAb8xG8e94FF9', 'blur'))
+        self.assertNotEqual(key, ResultCache.key('AQADAb8xG8e94FF9', 'blur(8)'))
+        self.assertNotEqual(key, ResultCache.key('AQADAb8xG8e94FFy', 'blur'))
+
+    def test_memory_tier_is_lru(self):
+        cache = ResultCache(max_entries=2)
+        cache.put_file_id('a', 'file-a')
+        cache.put_file_id('b', 'file-b')
+        self.assertEqual('file-a', cache.get('a').file_id)
+
+        cache.put_file_id('c', 'file-c')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual('file-a', cache.get('a').file_id)
+        self.assertEqual('file-c', cache.get('c').file_id)
+
+    def test_disk_tier_is_size_bounded(self):
+        size = os.path.getsize(img_path)
+        cache = ResultCache(disk_dir=self.tmp_dir, max_disk_bytes=2 * size)
+        for key in ('a', 'b', 'c'):
+            cache.put_file(key, img_path)
+
+        self.assertIsNone(cache.get('a'))
+        self.assertTrue(os.path.exists(cache.get('c').path))
+        self.assertEqual(2, len(os.listdir(self.tmp_dir)))
+
+    def test_disk_tier_survives_restart(self):
+        ResultCache(disk_dir=self.tmp_dir).put_file('a', img_path)
+        self.assertIsNotNone(ResultCache(disk_dir=self.tmp_dir).get('a'))
+
+
+class TestBotResultCache(unittest.TestCase):
+
+    @patch('telebot.TeleBot')
+    def setUp(self, mock_telebot):
+        bot = ImageProcessingBot(token='bot_token', telegram_chat_url='webhook_url')
+        bot.telegram_bot_client = mock_telebot.return_value
+        bot.new_users.add(1)
+        self.bot = bot
+        self.msg = {
+            'message_id': 1,
+            'from': {'id': 1},
+            'chat': {'id': 10},
+            'photo': [{'file_id': 'file', 'file_unique_id': 'unique', 'width': 90, 'height': 90}],
+        }
+
+    def send(self, caption):
+        self.bot.handle_message(dict(self.msg, caption=caption))
+
+    def test_repeated_request_resends_telegram_file_id(self):
+        sent = MagicMock()
+        sent.photo[-1].file_id = 'filtered-file-id'
+
+        with patch.object(self.bot, 'download_user_photo', return_value=img_path) as mock_download, \
+                patch.object(self.bot, 'apply_filters', return_value='photos/fake_filtered.jpeg'), \
+                patch.object(self.bot, 'upload_to_s3', return_value='fake_filtered.jpeg'), \
+                patch.object(self.bot, 'send_photo', return_value=sent):
+            self.send('Blur')
+            self.send('blur')
+
+            mock_download.assert_called_once()
+            self.bot.telegram_bot_client.send_photo.assert_called_once_with(10, 'filtered-file-id')
+
+    def test_noise_filters_are_seeded_from_the_key_and_cached(self):
+        sent = MagicMock()
+        sent.photo[-1].file_id = 'noisy-file-id'
+
+        with patch.object(self.bot, 'download_user_photo', return_value=img_path) as mock_download, \
+                patch.object(self.bot, 'apply_filters', return_value='photos/fake_filtered.jpeg') as mock_filters, \
+                patch.object(self.bot, 'upload_to_s3', return_value='fake_filtered.jpeg'), \
+                patch.object(self.bot, 'send_photo', return_value=sent):
+            self.send('salt and pepper')
+            self.send('salt and pepper')
+
+        mock_download.assert_called_once()
+        key = ResultCache.key('unique', 'salt and pepper')
+        mock_filters.assert_called_once_with(img_path, 'salt and pepper', int(key[:16], 16))
+        self.bot.telegram_bot_client.send_photo.assert_called_once_with(10, 'noisy-file-id')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import numpy as np
+from PIL import Image
+from polybot.codec import decode_gray, encode_gray, fit_size, open_image, save_gray, to_uint8
+from polybot.img_proc import Img
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+
+class TestDecode(unittest.TestCase):
+
+    def test_decodes_to_2d_float_gray(self):
+        gray = decode_gray(img_path)
+        with open_image(img_path) as image:
+            expected = np.asarray(image.convert('RGB'), dtype=np.float64) @ [0.299, 0.587, 0.114]
+        self.assertEqual(np.float64, gray.dtype)
+        self.assertEqual(expected.shape, gray.shape)
+        # luma straight from the JPEG decoder vs converting its RGB output
+        self.assertLess(np.abs(gray - expected).mean(), 1.5)
+
+    def test_bytes_and_path_agree(self):
+        with open(img_path, 'rb') as f:
+            np.testing.assert_array_equal(decode_gray(img_path), decode_gray(f.read()))
+
+    def test_max_size_fits_and_keeps_aspect(self):
+        wide = encode_gray(np.random.default_rng(0).integers(0, 256, (300, 800)))
+        self.assertEqual((75, 200), decode_gray(wide, max_size=200).shape)
+        self.assertEqual((300, 800), decode_gray(wide, max_size=1000).shape)
+        self.assertEqual((75, 200), Img(wide, max_size=200).array.shape)
+
+    def test_max_size_uses_draft_mode(self):
+        with patch.object(Image.Image, 'resize') as resize:
+            # 660 / 165 is an exact 1/4 scale, which the JPEG decoder produces without a resize
+            self.assertEqual((165, 165), decode_gray(img_path, max_size=165).shape)
+        resize.assert_not_called()
+
+    def test_fit_size(self):
+        self.assertEqual((100, 50), fit_size((100, 50), 100))
+        self.assertEqual((100, 50), fit_size((400, 200), 100))
+        self.assertEqual((1, 100), fit_size((1, 1000), 100))
+
+
+class TestEncode(unittest.TestCase):
+
+    def test_to_uint8_stretches_range_like_imsave(self):
+        self.assertEqual([[0, 128, 255]], to_uint8(np.array([[10.0, 137.5, 265.0]])).tolist())
+        self.assertEqual([[0, 0]], to_uint8(np.array([[7.0, 7.0]])).tolist())
+        full_range = np.arange(256, dtype=np.float64).reshape(16, 16)
+        np.testing.assert_array_equal(full_range, to_uint8(full_range))
+
+    def test_single_channel_jpeg(self):
+        with open_image(encode_gray(decode_gray(img_path))) as image:
+            self.assertEqual(('JPEG', 'L', (660, 660)), (image.format, image.mode, image.size))
+
+    def test_quality(self):
+        gray = decode_gray(img_path)
+        self.assertLess(len(encode_gray(gray, quality=30)), len(encode_gray(gray, quality=95)))
+        with patch.dict(os.environ, {'POLYBOT_JPEG_QUALITY': '30'}):
+            self.assertEqual(encode_gray(gray, quality=30), encode_gray(gray))
+
+    def test_format_from_suffix(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        gray = np.arange(256, dtype=np.float64).reshape(16, 16)
+        path = os.path.join(tmp_dir, 'gray.png')
+        save_gray(gray, path)
+        # PNG is lossless, so the pixels come back exactly
+        np.testing.assert_array_equal(gray, decode_gray(path))
+
+    def test_save_img_keeps_suffix(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        img = Img(shutil.copy(img_path, tmp_dir))
+        img.invert()
+        new_path = img.save_img(quality=90)
+        self.assertEqual('beatles_filtered.jpeg', new_path.name)
+        self.assertEqual((660, 660), decode_gray(new_path).shape)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 import unittest
-from polybot.img_proc import Img
+import numpy as np
+from polybot.img_proc import Img, mosaic
 import os
 
 img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
@@ -37,5 +38,64 @@ class TestImgConcat(unittest.TestCase):
         self.assertEqual(left_half, right_half)
 
 
+class TestMosaic(unittest.TestCase):
+
+    def arrays(self, *shapes):
+        return [np.full(shape, float(i + 1)) for i, shape in enumerate(shapes)]
+
+    def test_n_way_horizontal_and_vertical(self):
+        out = mosaic(self.arrays((4, 2), (4, 3), (4, 1)))
+        self.assertEqual((4, 6), out.shape)
+        self.assertEqual([1, 1, 2, 2, 2, 3], out[0].tolist())
+
+        out = mosaic(self.arrays((2, 5), (1, 5), (3, 5)), direction='vertical')
+        self.assertEqual([1, 1, 2, 3, 3, 3], out[:, 0].tolist())
+
+    def test_mismatched_sizes_raise_without_fit(self):
+        with self.assertRaises(RuntimeError):
+            mosaic(self.arrays((4, 2), (5, 2)))
+        with self.assertRaises(RuntimeError):
+            mosaic(self.arrays((4, 2), (4, 3)), direction='vertical')
+        with self.assertRaises(RuntimeError):
+            mosaic(self.arrays((4, 2), (4, 3)), direction='grid')
+        with self.assertRaises(RuntimeError):
+            mosaic(self.arrays((4, 2), (4, 2)), direction='diagonal')
+
+    def test_pad_centres_in_the_largest(self):
+        out = mosaic(self.arrays((4, 2), (2, 1)), fit='pad', fill=-1)
+        self.assertEqual([[1, 1, -1], [1, 1, 2], [1, 1, 2], [1, 1, -1]], out.tolist())
+
+    def test_resize_keeps_aspect_ratio(self):
+        out = mosaic(self.arrays((40, 20), (20, 30)), fit='resize')
+        # the second image is scaled to height 40, so 60 wide
+        self.assertEqual((40, 80), out.shape)
+        np.testing.assert_allclose(2.0, out[:, 20:], atol=1e-5)
+
+    def test_grid(self):
+        out = mosaic(self.arrays((2, 3), (2, 3), (2, 3), (2, 3), (2, 3)), direction='grid', fill=0)
+        self.assertEqual((4, 9), out.shape)
+        self.assertEqual([[1, 2, 3], [4, 5, 0]], out[::2, ::3].tolist())
+
+        out = mosaic(self.arrays((2, 2), (2, 2), (2, 2)), direction='grid', cols=3)
+        self.assertEqual((2, 6), out.shape)
+
+        out = mosaic(self.arrays((10, 20), (20, 20)), direction='grid', fit='resize')
+        # the square image fits the 10x20 cell at 10x10, centred
+        self.assertEqual((10, 40), out.shape)
+        self.assertEqual([0] * 5 + [2] * 10 + [0] * 5, out[5, 20:].tolist())
+
+    def test_img_concat_many(self):
+        img = Img.from_array(np.zeros((3, 3)))
+        img.concat(Img.from_array(np.ones((3, 3))), direction='vertical', others=[Img.from_array(np.ones((3, 3)))])
+        self.assertEqual((9, 3), img.array.shape)
+
+    def test_img_concat_positional_direction(self):
+        img = Img.from_array(np.zeros((3, 3)))
+        img.concat(Img.from_array(np.ones((2, 3))), 'vertical')
+        self.assertEqual((5, 3), img.array.shape)
+        with self.assertRaises(RuntimeError):
+            img.concat(Img.from_array(np.ones((5, 3))), 'diagonal')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+import numpy as np
+from polybot.img_proc import Img
+import os
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+
+def reference_blur(data, blur_level):
+    filter_sum = blur_level ** 2
+    result = []
+    for i in range(len(data) - blur_level + 1):
+        row_result = []
+        for j in range(len(data[0]) - blur_level + 1):
+            sub_matrix = [row[j:j + blur_level] for row in data[i:i + blur_level]]
+            row_result.append(sum(sum(sub_row) for sub_row in sub_matrix) // filter_sum)
+        result.append(row_result)
+    return result
+
+
+class TestImgArray(unittest.TestCase):
+
+    def setUp(self):
+        self.img = Img(img_path)
+        # keep the pure-Python reference implementations fast
+        self.img.data = [row[:60] for row in self.img.data[:40]]
+        self.original = [row[:] for row in self.img.data]
+
+    def assertDataAlmostEqual(self, expected, actual):
+        self.assertEqual((len(expected), len(expected[0])), (len(actual), len(actual[0])))
+        for expected_row, actual_row in zip(expected, actual):
+            for expected_pixel, actual_pixel in zip(expected_row, actual_row):
+                self.assertAlmostEqual(expected_pixel, actual_pixel, places=6)
+
+    def test_data_is_list_view(self):
+        self.assertIsInstance(self.img.data, list)
+        self.assertIsInstance(self.img.data[0], list)
+
+    def test_list_mutation_is_honoured(self):
+        self.img.data[0][0] = 250
+        self.img.invert()
+        self.assertAlmostEqual(self.img.data[0][0], 5)
+
+    def test_blur_matches_reference(self):
+        self.img.blur(blur_level=4)
+        self.assertDataAlmostEqual(reference_blur(self.original, 4), self.img.data)
+
+    def test_blur_of_saturated_regions_is_exact(self):
+        # large prefix sums used to leave whole 255 windows a hair short, flooring them to 254
+        gray = np.random.default_rng(0).uniform(0, 255, (400, 600))
+        gray[100:200, 100:300] += 105
+        for blur_level in (3, 16):
+            img = Img.from_array(gray)
+            img.brighten(150)
+            windows = np.lib.stride_tricks.sliding_window_view(img.array, (blur_level, blur_level))
+            expected = np.round(windows.sum(axis=(2, 3)), 6) // blur_level ** 2
+            img.blur(blur_level)
+            np.testing.assert_array_equal(expected, img.array)
+            self.assertEqual(255, img.array.max())
+
+    def test_blur_of_fractional_pixels_sums_to_whole_windows(self):
+        checkerboard = np.indices((600, 800)).sum(axis=0) % 2 * 0.6 - 0.3
+        img = Img.from_array(checkerboard + 200)
+        img.blur(blur_level=2)
+        np.testing.assert_array_equal(np.full((599, 799), 200.0), img.array)
+
+    def test_blur_default_level_matches_reference(self):
+        self.img.blur()
+        self.assertDataAlmostEqual(reference_blur(self.original, 16), self.img.data)
+
+    def test_box_and_gaussian_blur_keep_cropped_shape(self):
+        for kernel in ('box', 'gaussian'):
+            with self.subTest(kernel=kernel):
+                self.img.data = self.original
+                self.img.blur(blur_level=5, kernel=kernel)
+                self.assertEqual((36, 56), self.img.array.shape)
+
+    def test_box_blur_is_unfloored_mean(self):
+        self.img.blur(blur_level=3, kernel='box')
+        expected = sum(self.original[i][j] for i in range(3) for j in range(3)) / 9
+        self.assertAlmostEqual(expected, self.img.data[0][0], places=6)
+
+    def test_invalid_blur_level(self):
+        with self.assertRaises(RuntimeError):
+            self.img.blur(blur_level=41)
+
+    def test_contour_matches_reference(self):
+        self.img.contour()
+        expected = [[abs(row[j - 1] - row[j]) for j in range(1, len(row))] for row in self.original]
+        self.assertDataAlmostEqual(expected, self.img.data)
+
+    def test_point_filters_match_reference(self):
+        cases = {
+            'segment': lambda p: 255 if p > 100 else 0,
+            'brighten': lambda p: min(255, p + 30),
+            'darken': lambda p: max(0, p - 30),
+            'invert': lambda p: 255 - p,
+        }
+        for name, reference in cases.items():
+            with self.subTest(filter=name):
+                self.img.data = self.original
+                getattr(self.img, name)()
+                expected = [[reference(p) for p in row] for row in self.original]
+                self.assertDataAlmostEqual(expected, self.img.data)
+
+    def test_rotate_non_square(self):
+        self.img.rotate()
+        expected = [list(row) for row in zip(*self.original[::-1])]
+        self.assertEqual(expected, self.img.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
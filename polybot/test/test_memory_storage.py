@@ -0,0 +1,65 @@
+import unittest
+from io import BytesIO
+from unittest.mock import patch, Mock, MagicMock
+from polybot.bot import ImageProcessingBot
+from polybot.img_proc import Img
+import os
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+with open(img_path, 'rb') as f:
+    img_bytes = f.read()
+
+mock_msg = {
+    'message_id': 1,
+    'from': {'id': 1},
+    'chat': {'id': 10},
+    'photo': [{'file_id': 'file', 'file_unique_id': 'unique', 'width': 660, 'height': 660}],
+    'caption': 'Segment',
+}
+
+
+class TestImgInMemory(unittest.TestCase):
+
+    def test_load_and_encode_bytes(self):
+        img = Img(img_bytes)
+        self.assertIsNone(img.path)
+        self.assertEqual((660, 660), img.array.shape)
+
+        encoded = img.encode()
+        self.assertTrue(encoded.startswith(b'\xff\xd8'))
+        self.assertEqual((660, 660), Img(BytesIO(encoded)).array.shape)
+
+    def test_save_img_requires_path(self):
+        with self.assertRaises(RuntimeError):
+            Img(img_bytes).save_img()
+
+
+class TestBotInMemory(unittest.TestCase):
+
+    @patch('telebot.TeleBot')
+    def setUp(self, mock_telebot):
+        bot = ImageProcessingBot(token='bot_token', telegram_chat_url='webhook_url')
+        bot.telegram_bot_client = mock_telebot.return_value
+        bot.telegram_bot_client.get_file.return_value = Mock(file_path='photos/beatles.jpeg')
+        bot.telegram_bot_client.download_file.return_value = img_bytes
+        bot.s3_client = MagicMock()
+        bot.s3_bucket_name = 'bucket'
+        bot.storage_mode = 'memory'
+        bot.new_users.add(1)
+        self.bot = bot
+
+    def test_filter_without_touching_disk(self):
+        with patch('builtins.open', side_effect=OSError("Read-only file system")):
+            self.bot.handle_message(mock_msg)
+
+        self.bot.s3_client.upload_fileobj.assert_called_once()
+        self.bot.s3_client.upload_file.assert_not_called()
+
+        sent_file = self.bot.telegram_bot_client.send_photo.call_args[0][1]
+        self.assertIsInstance(sent_file.file, BytesIO)
+        self.assertEqual((660, 660), Img(sent_file.file.getvalue()).array.shape)
+
+
+if __name__ == '__main__':
+    unittest.main()
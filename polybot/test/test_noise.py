@@ -0,0 +1,80 @@
+import os
+import unittest
+import numpy as np
+from polybot import noise
+from polybot.img_proc import Img
+from polybot.pipeline import parse_caption, run_pipeline
+from polybot.workers import filter_image_with_stats
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+
+class TestNoiseGenerators(unittest.TestCase):
+
+    def setUp(self):
+        self.gray = np.full((400, 500), 128.0)
+
+    def test_seeded_noise_is_reproducible(self):
+        for fn in (noise.salt_and_pepper, noise.gaussian, noise.speckle):
+            with self.subTest(fn=fn.__name__):
+                np.testing.assert_array_equal(fn(self.gray, seed=7), fn(self.gray, seed=7))
+                self.assertFalse(np.array_equal(fn(self.gray, seed=7), fn(self.gray, seed=8)))
+
+    def test_salt_and_pepper_densities(self):
+        noisy = noise.salt_and_pepper(self.gray, salt=0.05, pepper=0.1, seed=0)
+        self.assertAlmostEqual(0.05, np.mean(noisy == 255), delta=0.005)
+        self.assertAlmostEqual(0.1, np.mean(noisy == 0), delta=0.005)
+        self.assertAlmostEqual(0.85, np.mean(noisy == 128), delta=0.005)
+
+        with self.assertRaises(RuntimeError):
+            noise.salt_and_pepper(self.gray, salt=0.6, pepper=0.5)
+        with self.assertRaises(RuntimeError):
+            noise.salt_and_pepper(self.gray, salt=-0.1)
+
+    def test_gaussian_and_speckle_spread(self):
+        noisy = noise.gaussian(self.gray, sigma=10, seed=0)
+        self.assertAlmostEqual(128, noisy.mean(), delta=0.5)
+        self.assertAlmostEqual(10, noisy.std(), delta=0.5)
+
+        noisy = noise.speckle(self.gray, sigma=0.1, seed=0)
+        self.assertAlmostEqual(12.8, noisy.std(), delta=0.5)
+        self.assertEqual(0, noise.speckle(np.zeros((4, 4)), seed=0).max())
+
+        self.assertGreaterEqual(noise.gaussian(self.gray, sigma=500, seed=0).min(), 0)
+        self.assertLessEqual(noise.gaussian(self.gray, sigma=500, seed=0).max(), 255)
+
+
+class TestSeededPipeline(unittest.TestCase):
+
+    def run_caption(self, caption, seed):
+        img = Img.from_array(np.full((100, 120), 128.0))
+        run_pipeline(img, parse_caption(caption), seed=seed)
+        return img.array
+
+    def test_seed_makes_the_pipeline_reproducible(self):
+        np.testing.assert_array_equal(self.run_caption('salt and pepper then blur', 3),
+                                      self.run_caption('salt and pepper then blur', 3))
+        self.assertFalse(np.array_equal(self.run_caption('gaussian', 3), self.run_caption('gaussian', 4)))
+
+    def test_noise_steps_share_one_generator(self):
+        # the second step continues the first one's stream rather than repeating its draws
+        twice = self.run_caption('gaussian 10 then gaussian 10', 3)
+        once = self.run_caption('gaussian 10', 3)
+        self.assertFalse(np.allclose(twice - 128, 2 * (once - 128)))
+
+    def test_caption_arguments_in_percent(self):
+        noisy = self.run_caption('salt and pepper 5', 0)
+        self.assertAlmostEqual(0.05, np.mean(noisy == 255), delta=0.01)
+        noisy = self.run_caption('speckle 10', 0)
+        self.assertAlmostEqual(12.8, noisy.std(), delta=1)
+
+    def test_filter_image_with_seed(self):
+        with open(img_path, 'rb') as f:
+            data = f.read()
+        first, _ = filter_image_with_stats(data, 'salt and pepper', seed=1)
+        second, _ = filter_image_with_stats(data, 'salt and pepper', seed=1)
+        self.assertEqual(first, second)
+
+
+if __name__ == '__main__':
+    unittest.main()
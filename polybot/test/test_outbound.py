@@ -0,0 +1,126 @@
+import threading
+import time
+import unittest
+from polybot.outbound import OutboundScheduler, TokenBucket, REPLY, NOTICE
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_refills_at_rate_up_to_capacity(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, capacity=2, clock=clock)
+        bucket.take()
+        bucket.take()
+        self.assertAlmostEqual(0.5, bucket.wait_time())
+
+        clock.now = 10
+        self.assertEqual(0, bucket.wait_time())
+        bucket.take()
+        bucket.take()
+        self.assertGreater(bucket.wait_time(), 0)
+
+
+class TestOutboundScheduler(unittest.TestCase):
+
+    def make_scheduler(self, **kwargs):
+        kwargs.setdefault('global_rate', 1000)
+        kwargs.setdefault('chat_rate', 1000)
+        kwargs.setdefault('group_rate', 1000)
+        scheduler = OutboundScheduler(**kwargs)
+        self.addCleanup(scheduler.shutdown)
+        return scheduler
+
+    def block_chat(self, scheduler, chat_id):
+        """Occupy the only sender thread until the returned event is set"""
+        release, started = threading.Event(), threading.Event()
+        scheduler.submit(chat_id, lambda: (started.set(), release.wait()), priority=REPLY)
+        started.wait(1)
+        return release
+
+    def test_returns_send_result(self):
+        scheduler = self.make_scheduler()
+        self.assertEqual(3, scheduler.submit(1, lambda a, b: a + b, 1, 2).result(timeout=1))
+
+    def test_per_chat_rate_is_respected(self):
+        scheduler = self.make_scheduler(chat_rate=20)
+        sent = []
+        futures = [scheduler.submit(1, lambda: sent.append(time.monotonic())) for _ in range(4)]
+        for future in futures:
+            future.result(timeout=2)
+        self.assertGreaterEqual(sent[-1] - sent[0], 3 / 20 * 0.9)
+
+    def test_group_chats_get_their_own_rate(self):
+        scheduler = self.make_scheduler(chat_rate=1000, group_rate=2)
+        scheduler.submit(-100, lambda: None).result(timeout=1)
+        slow = scheduler.submit(-100, lambda: None)
+        fast = scheduler.submit(7, lambda: None)
+        fast.result(timeout=1)
+        self.assertFalse(slow.done())
+
+    def test_replies_go_before_notices(self):
+        scheduler = self.make_scheduler(threads=1)
+        order = []
+        release = self.block_chat(scheduler, 1)
+        notice = scheduler.submit(2, order.append, 'notice', priority=NOTICE)
+        reply = scheduler.submit(3, order.append, 'reply', priority=REPLY)
+        release.set()
+        notice.result(timeout=1)
+        reply.result(timeout=1)
+        self.assertEqual(['reply', 'notice'], order)
+
+    def test_repeated_notices_are_coalesced(self):
+        scheduler = self.make_scheduler(threads=1)
+        sent = []
+        release = self.block_chat(scheduler, 1)
+        first = scheduler.submit(2, sent.append, 'busy', coalesce_key='busy')
+        second = scheduler.submit(2, sent.append, 'busy', coalesce_key='busy')
+        other_chat = scheduler.submit(3, sent.append, 'busy', coalesce_key='busy')
+        release.set()
+        for future in (first, second, other_chat):
+            future.result(timeout=1)
+        self.assertIs(first, second)
+        self.assertEqual(['busy', 'busy'], sent)
+
+    def test_notices_dropped_when_queue_is_full(self):
+        scheduler = self.make_scheduler(threads=1, max_pending=1)
+        sent = []
+        release = self.block_chat(scheduler, 1)
+        scheduler.submit(2, sent.append, 'first')
+        self.assertIsNone(scheduler.submit(3, sent.append, 'dropped').result(timeout=1))
+        scheduler.submit(4, sent.append, 'reply', priority=REPLY)
+        release.set()
+        scheduler.shutdown()
+        self.assertEqual(['reply', 'first'], sent)
+
+    def test_errors_reach_the_caller(self):
+        scheduler = self.make_scheduler()
+
+        def fail():
+            raise RuntimeError('Too Many Requests')
+
+        with self.assertRaises(RuntimeError):
+            scheduler.submit(1, fail).result(timeout=1)
+        self.assertEqual(1, scheduler.submit(1, lambda: 1).result(timeout=1))
+
+    def test_shutdown_sends_queued_messages(self):
+        scheduler = self.make_scheduler(chat_rate=50)
+        sent = []
+        for n in range(5):
+            scheduler.submit(1, sent.append, n)
+        scheduler.shutdown()
+        self.assertEqual([0, 1, 2, 3, 4], sent)
+        with self.assertRaises(RuntimeError):
+            scheduler.submit(1, sent.append, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
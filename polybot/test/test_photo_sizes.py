@@ -0,0 +1,81 @@
+import os
+import unittest
+from unittest.mock import patch, Mock
+from polybot import metrics
+from polybot.bot import ImageProcessingBot
+from polybot.cache import ResultCache
+from polybot.photo_sizes import PhotoSizePolicy, parse_filter_sides
+from polybot.pipeline import parse_caption
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+PHOTO_SIZES = [
+    {'file_id': 'f90', 'file_unique_id': 'u90', 'width': 90, 'height': 60, 'file_size': 1500},
+    {'file_id': 'f320', 'file_unique_id': 'u320', 'width': 320, 'height': 213, 'file_size': 15000},
+    {'file_id': 'f800', 'file_unique_id': 'u800', 'width': 800, 'height': 533, 'file_size': 70000},
+    {'file_id': 'f1280', 'file_unique_id': 'u1280', 'width': 1280, 'height': 853, 'file_size': 160000},
+]
+
+
+class TestPhotoSizePolicy(unittest.TestCase):
+
+    def choose(self, caption, **kwargs):
+        return PhotoSizePolicy(**kwargs).choose(PHOTO_SIZES, parse_caption(caption))['file_id']
+
+    def test_smallest_adequate_variant_per_filter(self):
+        self.assertEqual('f320', self.choose('segment'))
+        self.assertEqual('f320', self.choose('contour then salt and pepper'))
+        self.assertEqual('f800', self.choose('segment', filter_sides={'segment': 500}))
+
+    def test_any_full_size_step_needs_the_largest(self):
+        self.assertEqual('f1280', self.choose('blur'))
+        self.assertEqual('f1280', self.choose('segment then blur'))
+        self.assertEqual('f1280', self.choose('segment', filter_sides={'segment': 2000}))
+
+    def test_caps(self):
+        self.assertEqual('f800', self.choose('blur', max_pixels=800 * 533))
+        self.assertEqual('f320', self.choose('blur', max_bytes=20000))
+        self.assertEqual('f90', self.choose('blur', max_bytes=100))
+
+    def test_sizes_without_dimensions_fall_back_to_the_last(self):
+        photos = [{'file_id': 'small'}, {'file_id': 'large'}]
+        self.assertEqual('large', PhotoSizePolicy().choose(photos, parse_caption('segment'))['file_id'])
+
+    def test_filter_sides_from_env(self):
+        self.assertEqual({'salt and pepper': 320, 'contour': 640}, parse_filter_sides('salt and pepper=320, contour=640'))
+        with self.assertRaises(RuntimeError):
+            parse_filter_sides('contour')
+        with patch.dict(os.environ, {'POLYBOT_PHOTO_FILTER_SIDES': ''}):
+            self.assertEqual({}, PhotoSizePolicy().filter_sides)
+
+
+class TestBotPhotoSize(unittest.TestCase):
+
+    @patch('telebot.TeleBot')
+    def setUp(self, mock_telebot):
+        bot = ImageProcessingBot(token='bot_token', telegram_chat_url='webhook_url', register_webhook=False)
+        bot.telegram_bot_client = mock_telebot.return_value
+        bot.telegram_bot_client.get_file.return_value = Mock(file_path='photos/x.jpg')
+        with open(img_path, 'rb') as f:
+            bot.telegram_bot_client.download_file.return_value = f.read()
+        bot.storage_mode = 'memory'
+        bot.new_users.add(1)
+        self.bot = bot
+
+    def test_downloads_the_chosen_variant_and_counts_bytes_saved(self):
+        saved = metrics.PHOTO_BYTES_SAVED._value.get()
+        msg = {'message_id': 1, 'from': {'id': 1}, 'chat': {'id': 10}, 'caption': 'Segment', 'photo': PHOTO_SIZES}
+        with patch.object(self.bot, 'apply_filters', return_value=b'filtered') as mock_filters, \
+                patch.object(self.bot, 'send_photo', return_value=Mock()), \
+                patch.object(self.bot.result_cache, 'key', wraps=ResultCache.key) as mock_key:
+            self.bot.handle_message(msg)
+
+        self.bot.telegram_bot_client.get_file.assert_called_once_with('f320')
+        mock_filters.assert_called_once()
+        mock_key.assert_called_once_with('u320', 'segment')
+        downloaded = len(self.bot.telegram_bot_client.download_file.return_value)
+        self.assertEqual(max(0, 160000 - downloaded), metrics.PHOTO_BYTES_SAVED._value.get() - saved)
+
+
+if __name__ == '__main__':
+    unittest.main()
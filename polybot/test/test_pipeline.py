@@ -0,0 +1,98 @@
+import unittest
+import numpy as np
+from polybot.img_proc import Img
+from polybot.pipeline import Step, parse_caption, describe, compile_pipeline, run_pipeline, FusedPointStage, RotateStage
+import os
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+
+def run_sequentially(img, steps):
+    for step in steps:
+        kwargs = {}
+        if step.arg is not None:
+            kwargs = {'blur_level': step.arg} if step.name == 'blur' else {'value': step.arg}
+        getattr(img, step.name.replace('salt and pepper', 'salt_n_pepper'))(**kwargs)
+    return img
+
+
+class TestCaptionGrammar(unittest.TestCase):
+
+    def test_single_filter(self):
+        self.assertEqual([Step('contour', None)], parse_caption('Contour'))
+
+    def test_chained_filters(self):
+        expected = [Step('blur', None), Step('contour', None)]
+        for caption in ('blur then contour', 'Blur, Contour', 'blur -> contour', 'blur | contour', 'blur contour'):
+            with self.subTest(caption=caption):
+                self.assertEqual(expected, parse_caption(caption))
+
+    def test_multi_word_filter_and_arguments(self):
+        steps = parse_caption('blur 8 then salt and pepper + brighten 50')
+        self.assertEqual([Step('blur', 8), Step('salt and pepper', None), Step('brighten', 50)], steps)
+        self.assertEqual('blur(8)|salt and pepper|brighten(50)', describe(steps))
+
+    def test_unknown_filter(self):
+        for caption in ('sharpen', 'blur then sharpen', 'detect then blur', ''):
+            with self.subTest(caption=caption):
+                with self.assertRaises(RuntimeError):
+                    parse_caption(caption)
+
+    def test_argument_ranges(self):
+        self.assertEqual([Step('salt and pepper', 50), Step('blur', 1)], parse_caption('salt and pepper 50 then blur 1'))
+        for caption in ('salt and pepper 60', 'blur 0', 'brighten 300', 'contour then darken 256'):
+            with self.subTest(caption=caption):
+                with self.assertRaises(RuntimeError):
+                    parse_caption(caption)
+
+
+class TestPipelineCompiler(unittest.TestCase):
+
+    def setUp(self):
+        self.img = Img(img_path)
+        self.img.array = self.img.array[:48, :64]
+        self.original = self.img.array.copy()
+
+    def assertSameResult(self, caption):
+        steps = parse_caption(caption)
+        expected = Img(img_path)
+        expected.array = self.original.copy()
+        run_sequentially(expected, steps)
+        run_pipeline(self.img, steps)
+        np.testing.assert_allclose(expected.array, self.img.array, atol=1e-9)
+
+    def test_point_filters_are_fused(self):
+        stages = compile_pipeline(parse_caption('brighten invert darken 10 segment invert'))
+        self.assertEqual(1, len(stages))
+        self.assertIsInstance(stages[0], FusedPointStage)
+
+    def test_rotations_are_merged_and_postponed(self):
+        stages = compile_pipeline(parse_caption('rotate brighten rotate2 blur 4 invert'))
+        self.assertEqual(['FusedPointStage', 'StepStage', 'FusedPointStage', 'RotateStage'],
+                         [type(stage).__name__ for stage in stages])
+        self.assertEqual(3, stages[-1].turns)
+
+    def test_timings_per_stage(self):
+        timings = {}
+        run_pipeline(self.img, parse_caption('rotate brighten invert blur 4 contour'), timings)
+        self.assertEqual({'fused', 'blur', 'contour', 'rotate'}, set(timings))
+        self.assertTrue(all(seconds >= 0 for seconds in timings.values()))
+
+    def test_full_turn_is_dropped(self):
+        self.assertEqual([], compile_pipeline(parse_caption('rotate2 rotate2')))
+
+    def test_rotation_is_not_moved_past_contour(self):
+        stages = compile_pipeline(parse_caption('rotate contour'))
+        self.assertIsInstance(stages[0], RotateStage)
+
+    def test_fused_results_match_sequential_filters(self):
+        for caption in ('brighten invert', 'brighten 200 darken 100 invert', 'invert segment brighten',
+                        'segment invert segment darken', 'darken 50 segment', 'rotate brighten rotate2 blur 4 invert',
+                        'rotate contour rotate', 'blur 3 then contour then invert'):
+            with self.subTest(caption=caption):
+                self.img.array = self.original.copy()
+                self.assertSameResult(caption)
+
+
+if __name__ == '__main__':
+    unittest.main()
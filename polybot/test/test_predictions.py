@@ -0,0 +1,139 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+from polybot.bot import ImageProcessingBot
+from polybot.state import SqliteStateBackend
+from polybot.predictions import PredictionAggregator, Prediction, count_labels, format_predictions, MAX_MESSAGE_LENGTH
+
+
+class TestFormatting(unittest.TestCase):
+
+    def test_labels_are_counted(self):
+        self.assertEqual('3 person, 1 dog', count_labels(['person', 'dog', 'person', 'person']))
+        self.assertEqual('1 cat, 1 dog', count_labels(['cat', 'dog']))
+        self.assertEqual('Nothing detected', count_labels([]))
+
+    def test_single_result(self):
+        self.assertEqual(['Detection result for Image 2: 2 car'], format_predictions([Prediction('p', 2, ['car', 'car'])]))
+        self.assertEqual(['Detection result: Nothing detected'], format_predictions([Prediction('p', None, [])]))
+
+    def test_results_are_ordered_by_image(self):
+        predictions = [Prediction('b', 4, []), Prediction('c', None, ['cat']), Prediction('a', 3, ['dog', 'person', 'dog'])]
+        self.assertEqual(['Detection results:\nImage 3: 2 dog, 1 person\nImage 4: Nothing detected\nImage: 1 cat'],
+                         format_predictions(predictions))
+
+    def test_long_reports_are_split(self):
+        predictions = [Prediction(str(n), n, [f'label{i}' for i in range(20)]) for n in range(100)]
+        texts = format_predictions(predictions)
+        self.assertGreater(len(texts), 1)
+        self.assertTrue(all(len(text) <= MAX_MESSAGE_LENGTH for text in texts))
+        self.assertEqual(100, sum(text.count('Image ') for text in texts))
+
+
+class TestPredictionAggregator(unittest.TestCase):
+
+    def setUp(self):
+        self.delivered = []
+
+    def deliver(self, chat_id, predictions):
+        self.delivered.append((chat_id, sorted(p.prediction_id for p in predictions)))
+
+    def test_results_within_the_window_are_delivered_together(self):
+        aggregator = PredictionAggregator(self.deliver, window=0.1)
+        aggregator.add(10, 'a', 1, ['dog'])
+        aggregator.add(20, 'b', 1, [])
+        aggregator.add(10, 'c', 2, ['cat'])
+        aggregator.add(10, 'a', 1, ['dog'])
+
+        deadline = time.monotonic() + 5
+        while len(self.delivered) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual([(10, ['a', 'c']), (20, ['b'])], self.delivered)
+        aggregator.close()
+
+    def test_close_delivers_pending_results(self):
+        aggregator = PredictionAggregator(self.deliver, window=60)
+        aggregator.add(10, 'a', 1, ['dog'])
+        aggregator.close()
+
+        self.assertEqual([(10, ['a'])], self.delivered)
+        with self.assertRaises(RuntimeError):
+            aggregator.add(10, 'b', 2, [])
+
+    def test_workers_sharing_state_deliver_one_batch(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'state.db')
+        # one backend per worker process, on the same database file
+        first, second = (PredictionAggregator(self.deliver, SqliteStateBackend(path).namespace('pending'), window=0.2)
+                         for _ in range(2))
+        first.add(10, 'a', 1, ['dog'])
+        second.add(10, 'b', 2, ['cat'])
+        second.add(20, 'c', 1, [])
+
+        deadline = time.monotonic() + 5
+        while len(self.delivered) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        first.close()
+        second.close()
+        self.assertEqual([(10, ['a', 'b']), (20, ['c'])], self.delivered)
+
+    def test_batch_of_a_dead_worker_goes_out_with_the_next_result(self):
+        dead = PredictionAggregator(self.deliver, window=0.05)
+        dead.timers.call_later = lambda *args: None
+        dead.add(10, 'a', 1, ['dog'])
+        time.sleep(0.15)
+
+        PredictionAggregator(self.deliver, dead.pending, window=0.05).add(10, 'b', 2, [])
+        self.assertEqual([(10, ['a', 'b'])], self.delivered)
+
+    def test_failed_delivery_does_not_stop_the_aggregator(self):
+        aggregator = PredictionAggregator(lambda *args: 1 / 0, window=60)
+        aggregator.add(10, 'a', 1, [])
+        aggregator.flush()
+        aggregator.deliver = self.deliver
+        aggregator.add(10, 'b', 2, [])
+        aggregator.close()
+
+        self.assertEqual([(10, ['b'])], self.delivered)
+
+
+class TestBotPredictions(unittest.TestCase):
+
+    @patch('telebot.TeleBot')
+    def setUp(self, mock_telebot):
+        bot = ImageProcessingBot(token='bot_token', telegram_chat_url='webhook_url', register_webhook=False)
+        bot.telegram_bot_client = mock_telebot.return_value
+        bot.prediction_number_map['a'] = (10, 1)
+        bot.prediction_number_map['b'] = (10, 2)
+        bot.prediction_traces['a'] = {'traceparent': 'x'}
+        self.bot = bot
+
+    def test_album_results_are_sent_as_one_message(self):
+        self.bot.prediction_results = PredictionAggregator(self.bot.deliver_predictions, window=60)
+        self.bot.receive_prediction('b', 10, ['person', 'dog', 'person'])
+        self.bot.receive_prediction('a', 10, ['person'])
+        self.bot.telegram_bot_client.send_message.assert_not_called()
+        self.bot.prediction_results.close()
+
+        self.bot.telegram_bot_client.send_message.assert_called_once_with(
+            10, 'Detection results:\nImage 1: 1 person\nImage 2: 2 person, 1 dog')
+        self.assertNotIn('a', self.bot.prediction_number_map)
+        self.assertNotIn('b', self.bot.prediction_number_map)
+        self.assertNotIn('a', self.bot.prediction_traces)
+
+    def test_sent_immediately_without_an_aggregator(self):
+        self.bot.receive_prediction('a', 99, ['dog'])
+        self.bot.receive_prediction('unknown', 20, [])
+
+        self.assertEqual([(10, 'Detection result for Image 1: 1 dog'), (20, 'Detection result: Nothing detected')],
+                         [call.args for call in self.bot.telegram_bot_client.send_message.call_args_list])
+        self.assertNotIn('a', self.bot.prediction_number_map)
+        self.assertIn('b', self.bot.prediction_number_map)
+
+
+if __name__ == '__main__':
+    unittest.main()
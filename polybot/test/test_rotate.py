@@ -1,5 +1,9 @@
 import unittest
+from unittest.mock import patch
+import numpy as np
+from polybot import img_proc
 from polybot.img_proc import Img
+from polybot.rotation import rotate_array
 import os
 
 img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
@@ -26,5 +30,60 @@ class TestImgConcat(unittest.TestCase):
         self.assertEqual(expected_img, self.img.data)
 
 
+class TestRotateArray(unittest.TestCase):
+
+    def test_matches_rot90_for_any_shape(self):
+        rng = np.random.default_rng(0)
+        for shape in [(1, 1), (1, 7), (7, 1), (5, 9), (9, 5), (37, 100)]:
+            array = rng.random(shape)
+            for turns in range(-1, 6):
+                for block in (4, 16, 256):
+                    with self.subTest(shape=shape, turns=turns, block=block):
+                        rotated = rotate_array(array, turns, block=block)
+                        np.testing.assert_array_equal(np.rot90(array, k=-turns), rotated)
+                        self.assertTrue(rotated.flags.c_contiguous)
+
+    def test_keeps_dtype(self):
+        array = np.arange(12, dtype=np.uint8).reshape(3, 4)
+        self.assertEqual(np.uint8, rotate_array(array, 1).dtype)
+        self.assertIs(array, rotate_array(array, 4))
+
+
+class TestImgRotate(unittest.TestCase):
+
+    def setUp(self):
+        self.pixels = np.arange(6, dtype=np.float64).reshape(2, 3)
+
+    def test_non_square(self):
+        img = Img.from_array(self.pixels.copy())
+        img.rotate()
+        self.assertEqual([[3, 0], [4, 1], [5, 2]], img.data)
+        img.rotate2()
+        self.assertEqual([[2, 5], [1, 4], [0, 3]], img.data)
+
+    def test_lazy_turns_are_applied_once_when_read(self):
+        img = Img.from_array(self.pixels.copy())
+        with patch.object(img_proc, 'rotate_array', wraps=rotate_array) as mock_rotate:
+            img.rotate(lazy=True)
+            img.rotate(2, lazy=True)
+            mock_rotate.assert_not_called()
+            np.testing.assert_array_equal(np.rot90(self.pixels, k=1), img.array)
+            np.testing.assert_array_equal(np.rot90(self.pixels, k=1), img.array)
+        mock_rotate.assert_called_once()
+
+    def test_lazy_rotation_encodes_like_eager(self):
+        pixels = np.random.default_rng(0).random((30, 50)) * 255
+        lazy, eager = Img.from_array(pixels.copy()), Img.from_array(pixels.copy())
+        lazy.rotate(3, lazy=True)
+        eager.rotate(3)
+        self.assertEqual(eager.encode(format='png'), lazy.encode(format='png'))
+        self.assertEqual((50, 30), lazy.array.shape)
+
+    def test_full_turn_is_a_no_op(self):
+        img = Img.from_array(self.pixels)
+        img.rotate(4)
+        self.assertIs(self.pixels, img.array)
+
+
 if __name__ == '__main__':
     unittest.main()
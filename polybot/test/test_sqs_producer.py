@@ -0,0 +1,146 @@
+import json
+import threading
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+from polybot.bot import ImageProcessingBot
+from polybot.sqs_producer import BatchingSqsProducer, MAX_BATCH_BYTES
+
+
+class FakeSqs:
+    """Local stand-in for the boto3 SQS client recording every batch it receives"""
+
+    def __init__(self, fail_ids_once=(), sender_fault=False, fail_ids_always=()):
+        self.batches = []
+        self.received = []
+        self.fail_ids_once = set(fail_ids_once)
+        self.fail_ids_always = set(fail_ids_always)
+        self.sender_fault = sender_fault
+        self.lock = threading.Lock()
+
+    def send_message_batch(self, QueueUrl, Entries):
+        with self.lock:
+            self.batches.append(len(Entries))
+            successful, failed = [], []
+            for entry in Entries:
+                body = json.loads(entry['MessageBody'])
+                if body['n'] in self.fail_ids_once or body['n'] in self.fail_ids_always:
+                    self.fail_ids_once.discard(body['n'])
+                    failed.append({'Id': entry['Id'], 'SenderFault': self.sender_fault, 'Code': 'InternalError'})
+                else:
+                    self.received.append(body['n'])
+                    successful.append({'Id': entry['Id'], 'MessageId': entry['Id']})
+            return {'Successful': successful, 'Failed': failed}
+
+
+class TestBatchingSqsProducer(unittest.TestCase):
+
+    def send_all(self, producer, count):
+        for n in range(count):
+            producer.send(json.dumps({'n': n}))
+
+    def test_coalesces_into_batches_of_ten(self):
+        sqs = FakeSqs()
+        producer = BatchingSqsProducer(sqs, 'queue-url', linger=10)
+        self.send_all(producer, 25)
+        producer.close()
+
+        self.assertEqual(list(range(25)), sorted(sqs.received))
+        self.assertEqual([10, 10, 5], sqs.batches)
+
+    def test_linger_flushes_partial_batch(self):
+        sqs = FakeSqs()
+        producer = BatchingSqsProducer(sqs, 'queue-url', linger=0.2)
+        self.send_all(producer, 3)
+
+        for _ in range(100):
+            if sqs.received:
+                break
+            time.sleep(0.02)
+        self.assertEqual([0, 1, 2], sqs.received)
+        producer.close()
+
+    def test_batches_respect_byte_limit(self):
+        sqs = FakeSqs()
+        producer = BatchingSqsProducer(sqs, 'queue-url', linger=10)
+        padding = 'x' * (MAX_BATCH_BYTES // 3)
+        for n in range(4):
+            producer.send(json.dumps({'n': n, 'padding': padding}))
+        producer.close()
+
+        self.assertEqual([2, 2], sqs.batches)
+
+    def test_partial_failure_is_retried(self):
+        sqs = FakeSqs(fail_ids_once={3, 7})
+        producer = BatchingSqsProducer(sqs, 'queue-url', linger=10, max_retries=2)
+        self.send_all(producer, 10)
+        producer.close()
+
+        self.assertEqual(list(range(10)), sorted(sqs.received))
+
+    def test_sender_fault_is_not_retried(self):
+        sqs = FakeSqs(fail_ids_once={3}, sender_fault=True)
+        producer = BatchingSqsProducer(sqs, 'queue-url', linger=10)
+        self.send_all(producer, 5)
+        producer.close()
+
+        self.assertEqual([0, 1, 2, 4], sorted(sqs.received))
+        self.assertEqual([5], sqs.batches)
+
+    def test_sender_fault_calls_on_failure(self):
+        failed = []
+        producer = BatchingSqsProducer(FakeSqs(fail_ids_once={1}, sender_fault=True), 'queue-url', linger=10)
+        for n in range(3):
+            producer.send(json.dumps({'n': n}), on_failure=lambda n=n: failed.append(n))
+        producer.close()
+
+        self.assertEqual([1], failed)
+
+    def test_backoff_does_not_hold_up_other_batches(self):
+        sqs = FakeSqs(fail_ids_always={0})
+        failed = threading.Event()
+        producer = BatchingSqsProducer(sqs, 'queue-url', linger=0.01, max_retries=3)
+        producer.send(json.dumps({'n': 0}), on_failure=failed.set)
+        time.sleep(0.02)
+        start = time.perf_counter()
+        producer.send(json.dumps({'n': 1}))
+        for _ in range(100):
+            if sqs.received:
+                break
+            time.sleep(0.005)
+
+        # message 0 is still backing off (0.1 + 0.2 + 0.4s) while message 1 goes straight out
+        self.assertEqual([1], sqs.received)
+        self.assertLess(time.perf_counter() - start, 0.06)
+        self.assertFalse(failed.is_set())
+        self.assertTrue(failed.wait(5))
+        producer.close()
+
+    def test_closed_producer_rejects_messages(self):
+        producer = BatchingSqsProducer(FakeSqs(), 'queue-url')
+        producer.close()
+        with self.assertRaises(RuntimeError):
+            producer.send('{}')
+
+
+class TestDetectEnqueueFailure(unittest.TestCase):
+
+    @patch('telebot.TeleBot')
+    def test_user_is_told_when_sqs_gives_up(self, mock_telebot):
+        bot = ImageProcessingBot(token='bot_token', telegram_chat_url='webhook_url', register_webhook=False)
+        bot.telegram_bot_client = mock_telebot.return_value
+        bot.fetch_photo = MagicMock(return_value=b'photo')
+        bot.upload_to_s3 = MagicMock(return_value='image.jpg')
+        bot.sqs_producer = BatchingSqsProducer(MagicMock(), 'queue-url', linger=10)
+        bot.sqs_producer.sqs_client.send_message_batch.side_effect = lambda QueueUrl, Entries: {
+            'Failed': [{'Id': entry['Id'], 'SenderFault': True} for entry in Entries]}
+
+        bot.detect_photo({'message_id': 1, 'chat': {'id': 10}, 'photo': [{'file_id': 'f'}]})
+        bot.sqs_producer.close()
+
+        self.assertEqual((10, 'Failed to upload image 1 to cloud, please try again.'),
+                         bot.telegram_bot_client.send_message.call_args.args)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import importlib
+import os
+import unittest
+from unittest.mock import patch, MagicMock
+from polybot import aws, gunicorn_conf
+from polybot.bot import Bot, ImageProcessingBot
+
+
+class TestWebhookRegistration(unittest.TestCase):
+
+    @patch('telebot.TeleBot')
+    def setUp(self, mock_telebot):
+        self.bot = Bot(token='bot_token', telegram_chat_url='https://example.com', register_webhook=False)
+        self.client = self.bot.telegram_bot_client
+
+    def test_registers_missing_webhook(self):
+        self.client.get_webhook_info.return_value.url = ''
+        self.assertTrue(self.bot.register_webhook())
+        self.client.set_webhook.assert_called_once_with(url='https://example.com/bot_token/', timeout=60)
+        self.client.remove_webhook.assert_not_called()
+
+    def test_skips_matching_webhook(self):
+        self.client.get_webhook_info.return_value.url = 'https://example.com/bot_token/'
+        self.assertTrue(self.bot.register_webhook())
+        self.client.set_webhook.assert_not_called()
+
+    def test_disabled_registration_makes_no_api_calls(self):
+        self.client.get_webhook_info.assert_not_called()
+        self.client.get_me.assert_not_called()
+
+
+class TestLazyClients(unittest.TestCase):
+
+    def setUp(self):
+        aws._clients.clear()
+        self.addCleanup(aws._clients.clear)
+
+    @patch('polybot.aws.boto3.client')
+    @patch('telebot.TeleBot')
+    def test_clients_are_created_on_first_use_and_shared(self, mock_telebot, mock_boto_client):
+        mock_boto_client.side_effect = lambda service, region_name: MagicMock(name=service)
+        first = ImageProcessingBot(token='bot_token', telegram_chat_url='webhook_url', register_webhook=False)
+        second = ImageProcessingBot(token='bot_token', telegram_chat_url='webhook_url', register_webhook=False)
+        mock_boto_client.assert_not_called()
+
+        first.s3_client.upload_file('a.jpg', 'bucket', 'a.jpg')
+        second.s3_client.upload_file('b.jpg', 'bucket', 'b.jpg')
+        mock_boto_client.assert_called_once_with('s3', region_name='eu-west-2')
+        self.assertIs(aws.shared_client('s3'), aws.shared_client('s3'))
+
+
+class TestGunicornWorkers(unittest.TestCase):
+
+    def workers(self, env):
+        with patch.dict(os.environ, env, clear=True):
+            return importlib.reload(gunicorn_conf).workers
+
+    def test_memory_state_runs_one_worker(self):
+        self.addCleanup(importlib.reload, gunicorn_conf)
+        self.assertEqual(1, self.workers({}))
+        self.assertEqual(2, self.workers({'POLYBOT_STATE_BACKEND': 'sqlite:////tmp/state.db'}))
+
+    def test_several_workers_need_shared_state(self):
+        gunicorn_conf.check_state_backend(1, 'memory')
+        gunicorn_conf.check_state_backend(4, 'redis://localhost:6379/0')
+        with self.assertRaises(RuntimeError):
+            gunicorn_conf.check_state_backend(2, 'memory')
+
+
+if __name__ == '__main__':
+    unittest.main()
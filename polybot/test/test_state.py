@@ -0,0 +1,204 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch, MagicMock
+from polybot.bot import ImageProcessingBot
+from polybot.state import (TTLDict, compact_photo_message, create_backend,
+                           SqliteStateBackend, RedisStateBackend)
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTTLDict(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.store = TTLDict('test', max_size=3, ttl=10, clock=self.clock)
+
+    def test_entries_expire(self):
+        self.store['a'] = 1
+        self.clock.now = 9
+        self.assertEqual(1, self.store['a'])
+
+        self.clock.now = 10
+        self.assertNotIn('a', self.store)
+        self.assertEqual(0, len(self.store))
+
+    def test_write_refreshes_ttl(self):
+        self.store['a'] = 1
+        self.clock.now = 8
+        self.store['a'] += 1
+        self.clock.now = 15
+        self.assertEqual(2, self.store['a'])
+
+    def test_max_size_evicts_oldest_write(self):
+        for key in 'abcd':
+            self.store[key] = key
+        self.assertEqual(['b', 'c', 'd'], list(self.store))
+
+    def test_dict_api(self):
+        self.store['a'] = (1, 2)
+        chat_id, image_number = self.store['a']
+        self.assertEqual((1, 2), (chat_id, image_number))
+        self.assertEqual((1, 2), self.store.pop('a'))
+        self.assertIsNone(self.store.get('a'))
+
+
+class TestCompactPhotoMessage(unittest.TestCase):
+
+    def test_keeps_photo_sizes_and_chat(self):
+        msg = {'message_id': 1, 'from': {'id': 2}, 'chat': {'id': 3, 'type': 'group'}, 'caption': 'concat',
+               'photo': [{'file_id': 'small'}, {'file_id': 'large'}]}
+        self.assertEqual({'message_id': 1, 'chat': {'id': 3}, 'photo': [{'file_id': 'small'}, {'file_id': 'large'}]},
+                         compact_photo_message(msg))
+
+
+class StateBackendTests:
+    """Behaviour every state backend must share; mixed into one TestCase per backend"""
+
+    def make_backend(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.backend = self.make_backend()
+        self.store = self.backend.namespace('test', ttl=60, max_size=100)
+
+    def test_mapping_api(self):
+        self.store[42] = [1, 2]
+        self.assertIn(42, self.store)
+        self.assertIn('42', self.store)
+        self.assertEqual([1, 2], list(self.store['42']))
+        self.assertEqual(['42'], list(self.store))
+        self.assertEqual([1, 2], list(self.store.pop(42)))
+        self.assertIsNone(self.store.get(42))
+        with self.assertRaises(KeyError):
+            del self.store[42]
+
+    def test_incr_is_atomic(self):
+        threads = [threading.Thread(target=lambda: [self.store.incr('counter') for _ in range(50)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(200, self.store['counter'])
+
+    def test_append_returns_length(self):
+        self.assertEqual(1, self.store.append('album', {'n': 1}))
+        self.assertEqual(2, self.store.append('album', {'n': 2}))
+        self.assertEqual([{'n': 1}, {'n': 2}], self.store['album'])
+
+    def test_compare_and_set(self):
+        self.assertTrue(self.store.set_if_absent('key', 'a'))
+        self.assertFalse(self.store.set_if_absent('key', 'b'))
+        self.assertFalse(self.store.compare_and_set('key', 'b', 'c'))
+        self.assertTrue(self.store.compare_and_set('key', 'a', 'c'))
+        self.assertEqual('c', self.store['key'])
+
+    def test_set_semantics(self):
+        self.assertTrue(self.store.add_if_absent(7))
+        self.assertFalse(self.store.add_if_absent(7))
+        self.assertIn(7, self.store)
+
+
+class TestMemoryStateBackend(StateBackendTests, unittest.TestCase):
+
+    def make_backend(self):
+        return create_backend('memory')
+
+
+class TestSqliteStateBackend(StateBackendTests, unittest.TestCase):
+
+    def make_backend(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        return create_backend(f'sqlite:///{os.path.join(self.tmp_dir, "state.db")}')
+
+    def test_entries_expire(self):
+        clock = FakeClock()
+        backend = SqliteStateBackend(os.path.join(self.tmp_dir, 'expiry.db'), clock=clock)
+        store = backend.namespace('expiring', ttl=10)
+        store['a'] = 1
+        clock.now = 10
+        self.assertNotIn('a', store)
+        self.assertEqual(1, store.incr('a'))
+
+    def test_shared_between_backends(self):
+        other = SqliteStateBackend(self.backend.path).namespace('test', ttl=60)
+        self.store.incr('counter')
+        self.assertEqual(2, other.incr('counter'))
+
+
+@unittest.skipUnless(fakeredis, 'fakeredis is not installed')
+class TestRedisStateBackend(StateBackendTests, unittest.TestCase):
+
+    def make_backend(self):
+        return RedisStateBackend(client=fakeredis.FakeRedis())
+
+
+class TestSharedStateAcrossReplicas(unittest.TestCase):
+
+    @patch('telebot.TeleBot')
+    def make_bot(self, mock_telebot):
+        bot = ImageProcessingBot(token='bot_token', telegram_chat_url='webhook_url')
+        bot.telegram_bot_client = mock_telebot.return_value
+        return bot
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        with patch.dict(os.environ, {'POLYBOT_STATE_BACKEND': f'sqlite:///{os.path.join(self.tmp_dir, "state.db")}'}):
+            self.replicas = [self.make_bot(), self.make_bot()]
+
+    def album_msg(self, message_id, caption=None):
+        msg = {'message_id': message_id, 'from': {'id': 1}, 'chat': {'id': 10}, 'media_group_id': 'album',
+               'photo': [{'file_id': f'file{message_id}', 'file_unique_id': f'unique{message_id}'}]}
+        if caption:
+            msg['caption'] = caption
+        return msg
+
+    def test_album_split_across_replicas_is_concatenated_once(self):
+        for replica in self.replicas:
+            replica.schedule_album = MagicMock()
+        self.replicas[0].handle_message(self.album_msg(1, caption='Concat'))
+        self.replicas[1].handle_message(self.album_msg(2))
+        self.replicas[1].schedule_album.assert_called_once_with('album', 2)
+
+        with patch('polybot.bot.Img') as mock_img:
+            for replica in self.replicas:
+                replica.fetch_photo = lambda msg: 'photo.jpg'
+                replica.save_result = lambda img: 'photo_filtered.jpg'
+                replica.send_photo = lambda chat_id, path: None
+
+            # the first photo's check sees a grown album; both replicas race on the last one's
+            self.replicas[0].process_album('album', 1)
+            self.replicas[0].process_album('album', 2)
+            self.replicas[1].process_album('album', 2)
+
+        mock_img.return_value.concat.assert_called_once()
+
+    def test_counter_and_predictions_are_shared(self):
+        first, second = self.replicas
+        self.assertEqual(1, first.image_counter.incr(10))
+        self.assertEqual(2, second.image_counter.incr(10))
+
+        first.prediction_number_map['prediction'] = (10, 2)
+        chat_id, image_number = second.prediction_number_map['prediction']
+        self.assertEqual((10, 2), (chat_id, image_number))
+
+
+if __name__ == '__main__':
+    unittest.main()
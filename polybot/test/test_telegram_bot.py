@@ -1,3 +1,5 @@
+import shutil
+import tempfile
 import unittest
 from unittest.mock import patch, Mock, mock_open, MagicMock
 from polybot.bot import ImageProcessingBot
@@ -53,6 +55,8 @@ class TestBot(unittest.TestCase):
     def setUp(self, mock_telebot):
         bot = ImageProcessingBot(token='bot_token', telegram_chat_url='webhook_url')
         bot.telegram_bot_client = mock_telebot.return_value
+        bot.photos_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, bot.photos_dir, ignore_errors=True)
 
         mock_file = Mock()
         mock_file.file_path = 'photos/beatles.jpeg'
@@ -84,6 +88,16 @@ class TestBot(unittest.TestCase):
             mock_contour.assert_called_once()
             mock_send_photo.assert_called_once()
 
+    def test_invalid_filter_argument_gets_the_usage_reply(self):
+        for caption, error in [('Salt and pepper 60', "'salt and pepper' takes a value from 0 to 50, not 60"),
+                               ('Blur 0', "'blur' takes a value of at least 1, not 0"),
+                               ('Sharpen', "Unknown filter 'sharpen'")]:
+            with self.subTest(caption=caption), patch.object(self.bot, 'apply_filters') as mock_filters:
+                self.bot.handle_message(dict(mock_msg, caption=caption))
+                mock_filters.assert_not_called()
+                text = self.bot.telegram_bot_client.send_message.call_args.args[1]
+                self.assertTrue(text.startswith(f"{error}. Please use one of:"), text)
+
     @patch('builtins.open', new_callable=mock_open)
     def test_contour_with_exception(self, mock_open):
         mock_open.side_effect = OSError("Read-only file system")
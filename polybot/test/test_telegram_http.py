@@ -0,0 +1,83 @@
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from polybot import metrics
+from polybot.telegram_http import create_session, endpoint_name
+
+
+class FlakyTelegramApi(BaseHTTPRequestHandler):
+    """Answers with the queued (status, body) pairs, then with ``ok`` once the queue is empty"""
+    responses = []
+    calls = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.calls.append(self.path)
+        status, body = self.responses.pop(0) if self.responses else (200, {'ok': True, 'result': True})
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST
+
+    def log_message(self, *args):
+        pass
+
+
+class TestTelegramSession(unittest.TestCase):
+
+    def setUp(self):
+        FlakyTelegramApi.responses = []
+        FlakyTelegramApi.calls = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FlakyTelegramApi)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/bot123:secret/sendMessage'
+        self.session = create_session(pool_size=2, retries=2, backoff=0, max_wait=1)
+
+    def retries(self, status):
+        return metrics.TELEGRAM_RETRIES.labels(endpoint='sendMessage', status=status)._value.get()
+
+    def test_rate_limit_is_retried(self):
+        FlakyTelegramApi.responses = [(429, {'ok': False, 'error_code': 429, 'parameters': {'retry_after': 0}})]
+        before = self.retries(429)
+
+        response = self.session.post(self.url, params={'chat_id': 1, 'text': 'hi'})
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, len(FlakyTelegramApi.calls))
+        self.assertEqual(before + 1, self.retries(429))
+
+    def test_gives_up_after_retries(self):
+        FlakyTelegramApi.responses = [(502, {'ok': False})] * 5
+        response = self.session.post(self.url)
+
+        self.assertEqual(502, response.status_code)
+        self.assertEqual(3, len(FlakyTelegramApi.calls))
+
+    def test_client_errors_are_not_retried(self):
+        FlakyTelegramApi.responses = [(400, {'ok': False, 'error_code': 400})]
+        self.assertEqual(400, self.session.post(self.url).status_code)
+        self.assertEqual(1, len(FlakyTelegramApi.calls))
+
+    def test_latency_is_recorded_per_endpoint(self):
+        histogram = metrics.TELEGRAM_REQUEST_SECONDS.labels(endpoint='sendMessage')
+        before = histogram._sum.get()
+        self.session.post(self.url)
+        self.assertGreater(histogram._sum.get(), before)
+
+
+class TestEndpointName(unittest.TestCase):
+
+    def test_names_never_contain_the_token(self):
+        self.assertEqual('sendPhoto', endpoint_name('https://api.telegram.org/bot123:secret/sendPhoto?chat_id=1'))
+        self.assertEqual('downloadFile', endpoint_name('https://api.telegram.org/file/bot123:secret/photos/file_1.jpg'))
+
+
+if __name__ == '__main__':
+    unittest.main()
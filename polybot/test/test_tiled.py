@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import tracemalloc
+import unittest
+from unittest.mock import patch, MagicMock
+import numpy as np
+from polybot import tiled
+from polybot.bot import ImageProcessingBot
+from polybot.img_proc import Img
+from polybot.pipeline import parse_caption, run_pipeline
+from polybot.codec import decode_gray, encode_gray
+from polybot.tiled import filter_tiled, run_tiled, should_tile
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+
+class TestRunTiled(unittest.TestCase):
+
+    def setUp(self):
+        self.gray = decode_gray(img_path, dtype=np.uint8)
+        # about 8 rows per strip, so every filter crosses many strip boundaries
+        self.budget = self.gray.shape[1] * 32 * 8
+
+    def test_matches_whole_image_pipeline(self):
+        captions = ['brighten invert', 'blur 5', 'contour', 'blur 3 then contour then rotate',
+                    'rotate then contour', 'segment rotate2 blur', 'darken 10, blur 4, invert']
+        for caption in captions:
+            with self.subTest(caption=caption):
+                expected = Img.from_array(self.gray.astype(np.float64))
+                run_pipeline(expected, parse_caption(caption))
+                tiled = run_tiled(self.gray, parse_caption(caption), budget=self.budget)
+                np.testing.assert_allclose(expected.array, tiled, atol=1e-3)
+
+    def test_blur_larger_than_image_is_rejected(self):
+        with self.assertRaises(RuntimeError):
+            run_tiled(self.gray, parse_caption(f'blur {self.gray.shape[0] + 1}'), budget=self.budget)
+
+    def test_timings_per_stage(self):
+        timings = {}
+        run_tiled(self.gray, parse_caption('blur 3 contour rotate'), budget=self.budget, timings=timings)
+        self.assertEqual({'blur', 'contour', 'rotate'}, set(timings))
+
+    def test_peak_memory_stays_near_budget(self):
+        gray = np.random.default_rng(0).integers(0, 256, (1000, 1000), dtype=np.uint8)
+        budget = 2 ** 20
+        tracemalloc.start()
+        try:
+            run_tiled(gray, parse_caption('blur 8 then contour'), budget=budget)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        # the float32 result (4MB) plus about one strip; the whole-image float64 path needs over 24MB
+        self.assertLess(peak, gray.size * 4 + 4 * budget)
+
+
+class TestTiledIO(unittest.TestCase):
+
+    def test_bytes_in_bytes_out(self):
+        with open(img_path, 'rb') as f:
+            encoded, stats = filter_tiled(f.read(), 'rotate then blur 4', budget=10000)
+        result = decode_gray(encoded)
+        gray = decode_gray(img_path, dtype=np.uint8)
+        self.assertEqual((gray.shape[1] - 3, gray.shape[0] - 3), result.shape)
+        self.assertEqual(gray.size, stats['pixels'])
+
+    def test_writes_filtered_file_next_to_source(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = shutil.copy(img_path, tmp_dir)
+        new_path, _ = filter_tiled(path, 'invert')
+        self.assertTrue(new_path.endswith('beatles_filtered.jpeg'))
+        self.assertEqual(decode_gray(path).shape, decode_gray(new_path).shape)
+
+    def test_threshold(self):
+        with patch.dict(os.environ, {'POLYBOT_TILE_PIXELS': '100'}):
+            self.assertTrue(should_tile(img_path))
+        with patch.dict(os.environ, {'POLYBOT_TILE_PIXELS': str(10 ** 9)}):
+            self.assertFalse(should_tile(img_path))
+
+
+class TestTiledDocument(unittest.TestCase):
+
+    @patch('telebot.TeleBot')
+    def test_full_resolution_document_is_tiled(self, mock_telebot):
+        bot = ImageProcessingBot(token='bot_token', telegram_chat_url='webhook_url', register_webhook=False)
+        bot.telegram_bot_client = mock_telebot.return_value
+        bot.storage_mode = 'memory'
+        bot.new_users.add(1)
+        bot.upload_to_s3 = MagicMock(return_value='archived.jpg')
+        # 3200 x 2600 = 8.3MP, over the default threshold and larger than any Telegram photo size
+        gradient = np.add.outer(np.arange(2600.0), np.arange(3200.0)) % 256
+        bot.telegram_bot_client.download_file.return_value = encode_gray(gradient)
+        msg = {'message_id': 1, 'from': {'id': 1}, 'chat': {'id': 10}, 'caption': 'Rotate',
+               'document': {'file_id': 'doc', 'file_unique_id': 'udoc', 'file_name': 'scan.jpg',
+                            'mime_type': 'image/jpeg', 'file_size': 900000}}
+
+        with patch('polybot.workers.filter_tiled', wraps=tiled.filter_tiled) as mock_tiled, \
+                patch.object(bot, 'send_photo') as mock_send:
+            bot.handle_message(msg)
+
+        bot.telegram_bot_client.get_file.assert_called_once_with('doc')
+        mock_tiled.assert_called_once()
+        chat_id, result = mock_send.call_args.args
+        self.assertEqual((3200, 2600), decode_gray(result).shape)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import json
+import unittest
+from unittest.mock import patch, MagicMock
+from polybot import tracing
+from polybot.bot import ImageProcessingBot
+
+try:
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+except ImportError:
+    InMemorySpanExporter = None
+
+
+class TestTracingDisabled(unittest.TestCase):
+
+    def test_helpers_are_no_ops(self):
+        with patch.object(tracing, 'tracer', None):
+            with tracing.span('anything'):
+                pass
+            self.assertEqual({}, tracing.inject())
+            self.assertIsNone(tracing.extract({'traceparent': 'x'}))
+            fn = lambda: 1
+            self.assertIs(fn, tracing.bind(fn))
+
+
+@unittest.skipUnless(InMemorySpanExporter, 'opentelemetry-sdk is not installed')
+class TestDetectTrace(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.exporter = InMemorySpanExporter()
+        cls.provider = tracing.configure_tracing(exporter=cls.exporter, sample_ratio=1.0)
+
+    @classmethod
+    def tearDownClass(cls):
+        tracing.tracer = None
+
+    @patch('telebot.TeleBot')
+    def setUp(self, mock_telebot):
+        self.exporter.clear()
+        bot = ImageProcessingBot(token='bot_token', telegram_chat_url='webhook_url', register_webhook=False)
+        bot.telegram_bot_client = mock_telebot.return_value
+        bot.telegram_bot_client.download_file.return_value = b'jpeg bytes'
+        bot.storage_mode = 'memory'
+        bot.s3_bucket_name = 'bucket'
+        bot.s3_client = MagicMock()
+        bot.sqs_client = MagicMock()
+        self.bot = bot
+
+    def finished_spans(self):
+        self.provider.force_flush()
+        return {span.name: span for span in self.exporter.get_finished_spans()}
+
+    def test_stages_share_the_message_trace(self):
+        self.bot.handle_message({'message_id': 1, 'from': {'id': 1}, 'chat': {'id': 10}, 'caption': 'Detect',
+                                 'photo': [{'file_id': 'file', 'file_unique_id': 'unique'}]})
+
+        spans = self.finished_spans()
+        for name in ('polybot.download', 'polybot.upload', 'polybot.enqueue'):
+            self.assertEqual(spans['handle_message'].context.trace_id, spans[name].context.trace_id)
+            self.assertEqual(spans['handle_message'].context.span_id, spans[name].parent.span_id)
+
+        body = json.loads(self.bot.sqs_client.send_message.call_args.kwargs['MessageBody'])
+        self.assertIn('traceparent', body['trace_context'])
+        self.assertEqual(body['trace_context'], self.bot.prediction_traces[body['prediction_id']])
+
+    def test_callback_continues_the_trace(self):
+        with tracing.span('send_to_sqs'):
+            carrier = tracing.inject()
+        with tracing.span('receive_prediction', parent=tracing.extract(carrier)):
+            pass
+
+        spans = self.finished_spans()
+        self.assertEqual(spans['send_to_sqs'].context.trace_id, spans['receive_prediction'].context.trace_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
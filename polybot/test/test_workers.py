@@ -0,0 +1,265 @@
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch, Mock, MagicMock
+from polybot.bot import ImageProcessingBot
+from polybot.img_proc import Img
+from polybot import metrics
+from polybot.workers import BackgroundTasks, DelayedCalls, FilterPool, MessageDispatcher, run_with_retries, filter_image_with_stats
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+
+def hang_on_hang(path, caption, seed=None):
+    if caption == 'hang':
+        time.sleep(60)
+    return filter_image_with_stats(path, caption, seed)
+
+
+def worker_processes(pool):
+    return [worker.process for worker in list(pool.idle.queue) if worker is not None]
+
+
+def eventually(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestMessageDispatcher(unittest.TestCase):
+
+    def test_runs_handler_in_background(self):
+        done = threading.Event()
+        dispatcher = MessageDispatcher(lambda msg: done.set(), max_threads=1, max_pending=1)
+
+        self.assertTrue(dispatcher.submit({'text': 'hi'}))
+        self.assertTrue(done.wait(timeout=5))
+        dispatcher.shutdown()
+
+    def test_rejects_when_saturated(self):
+        release = threading.Event()
+        dispatcher = MessageDispatcher(lambda msg: release.wait(timeout=5), max_threads=1, max_pending=2)
+
+        self.assertTrue(dispatcher.submit({}))
+        self.assertTrue(dispatcher.submit({}))
+        self.assertFalse(dispatcher.submit({}))
+
+        release.set()
+        self.assertTrue(eventually(lambda: dispatcher.submit({})))
+        dispatcher.shutdown()
+
+    def test_handler_exception_frees_slot(self):
+        def handler(msg):
+            raise ValueError('boom')
+
+        dispatcher = MessageDispatcher(handler, max_threads=1, max_pending=1)
+        self.assertTrue(dispatcher.submit({}))
+        self.assertTrue(eventually(lambda: dispatcher.submit({})))
+        dispatcher.shutdown()
+
+
+class TestFilterPool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = shutil.copy(img_path, self.tmp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_apply_filters_in_worker_process(self):
+        pool = FilterPool(max_workers=1)
+        try:
+            new_path = pool.apply(self.path, 'rotate then segment')
+        finally:
+            pool.shutdown()
+
+        self.assertTrue(os.path.exists(new_path))
+        self.assertTrue(new_path.endswith('_filtered.jpeg'))
+        original = Img(self.path)
+        self.assertEqual(len(Img(new_path).data), len(original.data[0]))
+
+    def test_worker_filter_timings_are_recorded(self):
+        histogram = metrics.FILTER_SECONDS.labels(filter='segment')
+        before = histogram._sum.get()
+        pool = FilterPool(max_workers=1)
+        try:
+            pool.apply(self.path, 'segment')
+        finally:
+            pool.shutdown()
+        self.assertGreater(histogram._sum.get(), before)
+
+    def test_killed_worker_is_replaced(self):
+        restarts = metrics.FILTER_POOL_RESTARTS.labels(reason='crashed')
+        before = restarts._value.get()
+        pool = FilterPool(max_workers=1)
+        try:
+            pool.warm_up()
+            for process in worker_processes(pool):
+                os.kill(process.pid, signal.SIGKILL)
+            self.assertTrue(os.path.exists(pool.apply(self.path, 'segment')))
+            self.assertTrue(os.path.exists(pool.apply(self.path, 'contour')))
+        finally:
+            pool.shutdown()
+        self.assertEqual(before + 1, restarts._value.get())
+
+    def test_filter_errors_keep_the_worker(self):
+        pool = FilterPool(max_workers=1)
+        try:
+            pool.warm_up()
+            process = worker_processes(pool)[0]
+            with self.assertRaises(RuntimeError):
+                pool.apply(self.path, 'sharpen')
+            self.assertEqual([process], worker_processes(pool))
+        finally:
+            pool.shutdown()
+
+    def test_hung_worker_is_killed(self):
+        pool = FilterPool(max_workers=1, timeout=0.5)
+        try:
+            pool.warm_up()
+            hung = worker_processes(pool)
+            with patch('polybot.workers.filter_image_with_stats', hang_on_hang):
+                with self.assertRaises(TimeoutError):
+                    pool.apply(self.path, 'hang')
+            self.assertTrue(os.path.exists(pool.apply(self.path, 'segment')))
+            self.assertFalse(hung[0].is_alive())
+        finally:
+            pool.shutdown()
+
+    def test_hung_job_does_not_fail_other_callers(self):
+        # with one worker the fast jobs wait longer than the timeout behind the hung one, with two
+        # they run beside it; either way none of them fails when the hung worker is killed
+        for max_workers in (1, 2):
+            with self.subTest(max_workers=max_workers):
+                outcomes = self.apply_concurrently(FilterPool(max_workers=max_workers, timeout=1),
+                                                   ['hang'] + ['rotate then segment'] * 5)
+                self.assertIsInstance(outcomes[0], TimeoutError)
+                for outcome in outcomes[1:]:
+                    self.assertTrue(os.path.exists(outcome), outcome)
+
+    def apply_concurrently(self, pool, captions):
+        outcomes = [None] * len(captions)
+
+        def apply(n):
+            try:
+                outcomes[n] = pool.apply(self.path, captions[n])
+            except Exception as e:
+                outcomes[n] = e
+
+        try:
+            pool.warm_up()
+            with patch('polybot.workers.filter_image_with_stats', hang_on_hang):
+                threads = [threading.Thread(target=apply, args=(n,)) for n in range(len(captions))]
+                for thread in threads:
+                    thread.start()
+                    time.sleep(0.01)
+                for thread in threads:
+                    thread.join(30)
+        finally:
+            pool.shutdown()
+        return outcomes
+
+
+class TestStageMetrics(unittest.TestCase):
+
+    def test_errors_are_counted_and_raised(self):
+        errors = metrics.STAGE_ERRORS.labels(stage='test')
+        before = errors._value.get()
+        with self.assertRaises(RuntimeError):
+            with metrics.stage('test'):
+                raise RuntimeError('boom')
+        with metrics.stage('test'):
+            pass
+        self.assertEqual(before + 1, errors._value.get())
+
+
+class TestDelayedCalls(unittest.TestCase):
+
+    def test_calls_run_in_due_order_on_one_thread(self):
+        calls = []
+        done = threading.Event()
+        delayed = DelayedCalls()
+        delayed.call_later(0.1, lambda: (calls.append(('late', threading.current_thread().name)), done.set()))
+        for n in range(20):
+            delayed.call_later(0.01, lambda n=n: calls.append((n, threading.current_thread().name)))
+        delayed.call_later(0.05, lambda: 1 / 0)
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual(list(range(20)) + ['late'], [name for name, _ in calls])
+        self.assertEqual({'polybot-delayed'}, {thread for _, thread in calls})
+
+
+class TestBackgroundTasks(unittest.TestCase):
+
+    def test_retries_until_success(self):
+        task = Mock(side_effect=[None, RuntimeError('throttled'), 'uploaded.jpg'])
+        self.assertEqual('uploaded.jpg', run_with_retries(task, ('a.jpg',), retries=2, backoff=0))
+        self.assertEqual(3, task.call_count)
+
+    def test_failure_callback_after_last_retry(self):
+        on_failure = Mock()
+        self.assertIsNone(run_with_retries(Mock(return_value=None), (), retries=1, backoff=0, on_failure=on_failure))
+        on_failure.assert_called_once()
+
+    def test_runs_in_background(self):
+        tasks = BackgroundTasks(max_threads=1, backoff=0)
+        future = tasks.submit(Mock(return_value=True, __name__='task'), retries=1)
+        self.assertTrue(future.result(timeout=5))
+        tasks.shutdown()
+
+
+class TestSideEffectFanOut(unittest.TestCase):
+
+    @patch('telebot.TeleBot')
+    def setUp(self, mock_telebot):
+        bot = ImageProcessingBot(token='bot_token', telegram_chat_url='webhook_url')
+        bot.telegram_bot_client = mock_telebot.return_value
+        bot.new_users.add(1)
+        self.bot = bot
+        self.msg = {'message_id': 1, 'from': {'id': 1}, 'chat': {'id': 10},
+                    'photo': [{'file_id': 'file', 'file_unique_id': 'unique'}]}
+
+    def test_reply_is_sent_before_s3_upload(self):
+        calls = []
+        with patch.object(self.bot, 'fetch_photo', return_value=img_path), \
+                patch.object(self.bot, 'apply_filters', return_value=img_path), \
+                patch.object(self.bot, 'send_photo', side_effect=lambda *args: calls.append('send_photo')), \
+                patch.object(self.bot, 'upload_to_s3', side_effect=lambda *args: calls.append('upload_to_s3')):
+            self.bot.handle_message(dict(self.msg, caption='Invert'))
+
+        self.assertEqual(['send_photo', 'upload_to_s3'], calls)
+
+    def test_s3_failure_does_not_fail_the_reply(self):
+        self.bot.telegram_bot_client.send_message = MagicMock()
+        with patch.object(self.bot, 'fetch_photo', return_value=img_path), \
+                patch.object(self.bot, 'apply_filters', return_value=img_path), \
+                patch.object(self.bot, 'send_photo') as mock_send_photo, \
+                patch.object(self.bot, 'upload_to_s3', return_value=None):
+            self.bot.handle_message(dict(self.msg, caption='Invert'))
+
+        mock_send_photo.assert_called_once()
+        self.bot.telegram_bot_client.send_message.assert_not_called()
+
+    def test_detect_notifies_user_then_uploads_and_enqueues(self):
+        self.bot.background_tasks = BackgroundTasks(max_threads=1, backoff=0)
+        with patch.object(self.bot, 'fetch_photo', return_value=img_path), \
+                patch.object(self.bot, 'upload_to_s3', side_effect=[None, 'beatles.jpeg']), \
+                patch.object(self.bot, 'send_to_sqs') as mock_send_to_sqs:
+            self.bot.handle_message(dict(self.msg, caption='Detect'))
+            self.bot.background_tasks.shutdown()
+
+        self.assertIn('Image 1 received', self.bot.telegram_bot_client.send_message.call_args[0][1])
+        mock_send_to_sqs.assert_called_once()
+        self.assertEqual('beatles.jpeg', mock_send_to_sqs.call_args[0][2])
+
+
+if __name__ == '__main__':
+    unittest.main()
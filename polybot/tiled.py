@@ -0,0 +1,114 @@
+"""
+Strip-wise filtering for images too large to process as a whole.
+
+``Img`` holds the whole image as float64 and every filter allocates more full-size float64
+arrays, so a 20MP scan needs gigabytes. Here the image is decoded once to 8-bit grayscale
+and the compiled pipeline runs on horizontal strips sized to a
+memory budget. Each strip carries a halo of the extra rows below it that neighbourhood filters
+(blur) read. Results go into one preallocated float32 buffer, which is normalised to 8 bits
+strip by strip for encoding (``codec.to_uint8``).
+
+Rotations are the only stages that are not row-local; they split the pipeline into segments
+and rotate the intermediate buffer in between (compile_pipeline already postpones them to the
+end wherever the result allows).
+"""
+import inspect
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+from polybot.codec import decode_gray, encode_gray, open_image, save_gray
+from polybot.img_proc import Img
+from polybot.pipeline import RotateStage, StepStage, compile_pipeline, parse_caption
+from polybot.rotation import rotate_array
+
+# float64 working copies a strip needs per pixel: the strip itself plus a blur's summed-area table and output
+BYTES_PER_PIXEL = 32
+DEFAULT_BLUR_LEVEL = inspect.signature(Img.blur).parameters['blur_level'].default
+
+
+def tile_budget():
+    return int(os.environ.get('POLYBOT_TILE_MEMORY', 64 * 2 ** 20))
+
+
+def should_tile(source):
+    """True if the image at ``source`` (path or encoded bytes) has more pixels than $POLYBOT_TILE_PIXELS"""
+    threshold = int(os.environ.get('POLYBOT_TILE_PIXELS', 8_000_000))
+    with open_image(source) as image:
+        width, height = image.size
+    return width * height > threshold
+
+
+def halo(stage):
+    """Rows below each output row the stage also reads, or None for a stage that is not row-local"""
+    if isinstance(stage, RotateStage):
+        return None
+    if isinstance(stage, StepStage) and stage.step.name == 'blur':
+        return (stage.step.arg if stage.step.arg is not None else DEFAULT_BLUR_LEVEL) - 1
+    return 0
+
+
+def _run_segment(source, stages, budget, timings):
+    """Run row-local ``stages`` over ``source`` strip by strip into a new float32 array"""
+    extra_rows = sum(halo(stage) for stage in stages)
+    out_height = source.shape[0] - extra_rows
+    if out_height < 1:
+        raise RuntimeError("blur_level must be between 1 and the image size")
+    rows = max(1, budget // (source.shape[1] * BYTES_PER_PIXEL) - extra_rows)
+
+    out = None
+    for start in range(0, out_height, rows):
+        stop = min(out_height, start + rows)
+        strip = Img.from_array(source[start:stop + extra_rows].astype(np.float64))
+        for stage in stages:
+            begin = time.perf_counter()
+            stage(strip)
+            timings[stage.name] = timings.get(stage.name, 0.0) + time.perf_counter() - begin
+        if out is None:
+            out = np.empty((out_height, strip.array.shape[1]), dtype=np.float32)
+        out[start:stop] = strip.array
+    return out
+
+
+def run_tiled(gray, steps, budget=None, timings=None, seed=None):
+    """
+    Apply ``steps`` to the 2D ``gray`` array with strip working memory kept near ``budget`` bytes
+    ($POLYBOT_TILE_MEMORY, default 64MB). Returns a float32 array. Random filters draw from one
+    generator seeded with ``seed`` strip after strip, so a seeded result is reproducible for a
+    given budget.
+    """
+    budget = budget or tile_budget()
+    timings = {} if timings is None else timings
+    result = gray
+    segment = []
+    for stage in compile_pipeline(steps, seed) + [None]:
+        if stage is not None and halo(stage) is not None:
+            segment.append(stage)
+            continue
+        if segment:
+            result = _run_segment(result, segment, budget, timings)
+            segment = []
+        if stage is not None:
+            begin = time.perf_counter()
+            result = rotate_array(result, stage.turns)
+            timings[stage.name] = timings.get(stage.name, 0.0) + time.perf_counter() - begin
+    return result
+
+
+def filter_tiled(source, caption, budget=None, seed=None):
+    """
+    Strip-wise counterpart of ``workers.filter_image_with_stats``: returns the encoded JPEG bytes
+    when ``source`` is bytes, else the path of ``<name>_filtered<suffix>`` next to it, plus stats.
+    """
+    gray = decode_gray(source, dtype=np.uint8)
+    stats = {'pixels': gray.shape[0] * gray.shape[1], 'filters': {}}
+    result = run_tiled(gray, parse_caption(caption), budget, stats['filters'], seed)
+    if isinstance(source, (bytes, bytearray)):
+        return encode_gray(result), stats
+
+    path = Path(source)
+    new_path = path.with_name(path.stem + '_filtered' + path.suffix)
+    save_gray(result, new_path)
+    return str(new_path), stats
@@ -0,0 +1,85 @@
+import functools
+import os
+from contextlib import nullcontext
+
+from loguru import logger
+
+try:
+    from opentelemetry import context, propagate, trace
+except ImportError:  # tracing is optional; every helper below is a no-op without it
+    context = propagate = trace = None
+
+# set by configure_tracing(); spans are only created once tracing is configured
+tracer = None
+
+
+def configure_tracing(exporter=None, sample_ratio=None, service_name='polybot'):
+    """
+    Export spans over OTLP/HTTP to $OTEL_EXPORTER_OTLP_ENDPOINT (e.g. http://localhost:4318), or
+    to ``exporter`` if given. A ``sample_ratio`` ($POLYBOT_TRACE_SAMPLE_RATIO, default 0.1) share of
+    new traces is recorded; spans whose parent came from elsewhere (a prediction callback) follow
+    the parent's decision. Returns the TracerProvider, or None when tracing stays off.
+    """
+    global tracer
+    if trace is None or (exporter is None and not os.environ.get('OTEL_EXPORTER_OTLP_ENDPOINT')):
+        return None
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+        if exporter is None:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            exporter = OTLPSpanExporter()
+    except ImportError as e:
+        logger.warning(f"Tracing disabled, OpenTelemetry SDK not installed: {e}")
+        return None
+
+    if sample_ratio is None:
+        sample_ratio = float(os.environ.get('POLYBOT_TRACE_SAMPLE_RATIO', 0.1))
+    provider = TracerProvider(resource=Resource.create({'service.name': service_name}),
+                              sampler=ParentBased(TraceIdRatioBased(sample_ratio)))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    tracer = provider.get_tracer('polybot')
+    logger.info(f"Tracing enabled, sampling {sample_ratio:.0%} of traces")
+    return provider
+
+
+def span(name, parent=None, **attributes):
+    """Context manager running the block in a span (a child of ``parent`` context if given)"""
+    if tracer is None:
+        return nullcontext()
+    return tracer.start_as_current_span(name, context=parent, attributes=attributes)
+
+
+def inject():
+    """The current trace context as a dict of W3C headers (``traceparent``), empty when not tracing"""
+    carrier = {}
+    if tracer is not None:
+        propagate.inject(carrier)
+    return carrier
+
+
+def extract(carrier):
+    """Context to pass as ``span(parent=...)`` from a dict filled by ``inject()``"""
+    if tracer is None or not carrier:
+        return None
+    return propagate.extract(carrier)
+
+
+def bind(fn):
+    """Wrap ``fn`` to run in the caller's trace context, for handing work to another thread"""
+    if tracer is None:
+        return fn
+    ctx = context.get_current()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = context.attach(ctx)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            context.detach(token)
+
+    return wrapper
@@ -0,0 +1,290 @@
+import heapq
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from loguru import logger
+
+from polybot import metrics, tracing
+from polybot.img_proc import Img
+from polybot.pipeline import parse_caption, run_pipeline
+from polybot.tiled import filter_tiled, should_tile
+
+
+def filter_image_with_stats(path, caption, seed=None):
+    """
+    Load ``path``, apply the caption's filters and save the result next to it, returning the
+    new path. If ``path`` is the encoded image bytes, the encoded result bytes are returned.
+    Random filters are seeded with ``seed`` when given.
+
+    Also returns the input's pixel count and the seconds spent per filter, so timings measured
+    inside a pool worker can be recorded by the parent process. Images over
+    $POLYBOT_TILE_PIXELS are filtered strip by strip within a bounded memory budget.
+    """
+    if should_tile(path):
+        return filter_tiled(path, caption, seed=seed)
+
+    img = Img(path)
+    stats = {'pixels': img.array.shape[0] * img.array.shape[1], 'filters': {}}
+    run_pipeline(img, parse_caption(caption), stats['filters'], seed)
+    if img.path is None:
+        return img.encode(), stats
+    return str(img.save_img()), stats
+
+
+def record_filter_stats(stats):
+    metrics.IMAGE_PIXELS.observe(stats['pixels'])
+    for name, seconds in stats['filters'].items():
+        metrics.FILTER_SECONDS.labels(filter=name).observe(seconds)
+
+
+def _serve(conn):
+    """Body of a filter worker process: run each ``(fn, args)`` received on ``conn`` and send back the outcome"""
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        fn, args = job
+        try:
+            outcome = (True, fn(*args))
+        except Exception as e:
+            outcome = (False, e)
+        try:
+            conn.send(outcome)
+        except Exception as e:
+            # the filter's exception may not pickle
+            conn.send((False, RuntimeError(str(e))))
+
+
+class _FilterProcess:
+    """One forked worker process with its own pipe, running one job at a time"""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child_conn,), name='polybot-filter', daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def run(self, fn, args, timeout):
+        """``fn(*args)`` in the worker; TimeoutError if it runs past ``timeout`` seconds"""
+        try:
+            self.conn.send((fn, args))
+            finished = self.conn.poll(timeout)
+            if finished:
+                ok, value = self.conn.recv()
+        except (EOFError, OSError) as e:
+            raise BrokenProcessPool(f"Filter worker {self.process.pid} died") from e
+        if not finished:
+            raise TimeoutError(f"Filter did not finish within {timeout}s")
+        if not ok:
+            raise value
+        return value
+
+    def stop(self, kill=False):
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+        self.process.join()
+        self.conn.close()
+
+
+class FilterPool:
+    """
+    Process pool for the CPU-bound filter step, so filters run outside the GIL of the
+    process serving webhooks. Each caller borrows an idle worker process for its job, so the
+    ``timeout`` only counts time the job actually runs. A worker that died (e.g. OOM-killed)
+    is replaced and the job retried once; a job running past ``timeout`` fails and only its
+    worker is killed and replaced, while other callers' jobs carry on.
+    """
+
+    def __init__(self, max_workers=None, timeout=None):
+        self.max_workers = max_workers or int(os.environ.get('POLYBOT_FILTER_WORKERS', os.cpu_count() or 1))
+        self.timeout = timeout or float(os.environ.get('POLYBOT_FILTER_TIMEOUT', 60))
+        # fork so workers do not re-import app.py (and re-register the bot) on startup
+        self.context = multiprocessing.get_context('fork')
+        # idle workers; None is a free slot whose process is forked on first use
+        self.idle = queue.Queue()
+        for _ in range(self.max_workers):
+            self.idle.put(None)
+
+    def warm_up(self):
+        """Fork all workers now, before the web server starts its threads"""
+        workers = [self.idle.get() for _ in range(self.max_workers)]
+        for worker in workers:
+            self.idle.put(worker or _FilterProcess(self.context))
+
+    def _replace(self, worker, reason):
+        metrics.FILTER_POOL_RESTARTS.labels(reason=reason).inc()
+        logger.warning(f"Replacing {reason} filter worker {worker.process.pid}")
+        worker.stop(kill=True)
+
+    def apply(self, path, caption, seed=None):
+        start = time.perf_counter()
+        try:
+            for attempt in range(2):
+                worker = self.idle.get() or _FilterProcess(self.context)
+                try:
+                    result, stats = worker.run(filter_image_with_stats, (path, caption, seed), self.timeout)
+                except BrokenProcessPool:
+                    self._replace(worker, 'crashed')
+                    worker = None
+                    if attempt:
+                        raise
+                    continue
+                except TimeoutError:
+                    self._replace(worker, 'hung')
+                    worker = None
+                    raise
+                finally:
+                    self.idle.put(worker)
+                record_filter_stats(stats)
+                return result
+        finally:
+            metrics.FILTER_POOL_SECONDS.observe(time.perf_counter() - start)
+
+    def shutdown(self):
+        """Wait for running jobs, then stop every worker"""
+        for _ in range(self.max_workers):
+            worker = self.idle.get()
+            if worker is not None:
+                worker.stop()
+
+
+class MessageDispatcher:
+    """
+    Runs ``handler(msg)`` on a bounded thread pool so the webhook can acknowledge Telegram
+    immediately. At most ``max_pending`` jobs may be queued or running; ``submit`` returns
+    False beyond that so the caller can tell the user to retry.
+    """
+
+    def __init__(self, handler, max_threads=None, max_pending=None):
+        self.handler = handler
+        self.max_threads = max_threads or int(os.environ.get('POLYBOT_DISPATCH_THREADS', 8))
+        self.max_pending = max_pending or int(os.environ.get('POLYBOT_MAX_PENDING_JOBS', 32))
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix='polybot-job')
+
+    def submit(self, msg):
+        return self.submit_call(self.handler, msg)
+
+    def submit_call(self, fn, *args):
+        """Queue ``fn(*args)`` as a job like a message; False if the queue is full"""
+        if not self.slots.acquire(blocking=False):
+            metrics.JOBS_REJECTED.inc()
+            logger.warning(f"Job queue full ({self.max_pending} pending), rejecting job")
+            return False
+
+        metrics.JOBS_SUBMITTED.inc()
+        metrics.JOBS_PENDING.inc()
+        try:
+            self.executor.submit(self._run, fn, args, time.perf_counter())
+        except RuntimeError:
+            self._release()
+            raise
+        return True
+
+    def _run(self, fn, args, submitted_at):
+        start = time.perf_counter()
+        metrics.JOB_QUEUE_SECONDS.observe(start - submitted_at)
+        try:
+            fn(*args)
+        except Exception as e:
+            metrics.JOBS_FAILED.inc()
+            logger.exception(f"Background job failed: {e}")
+        finally:
+            duration = time.perf_counter() - start
+            metrics.JOB_SECONDS.observe(duration)
+            logger.info(f"Job finished in {duration:.3f}s")
+            self._release()
+
+    def _release(self):
+        metrics.JOBS_PENDING.dec()
+        self.slots.release()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+class DelayedCalls:
+    """
+    Runs ``fn(*args)`` ``delay`` seconds after ``call_later``, every call on one thread (started
+    on first use), so pending delays cost no thread each. Calls should be quick: anything heavy
+    belongs on a bounded pool such as MessageDispatcher.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.seq = itertools.count()
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def call_later(self, delay, fn, *args):
+        with self.condition:
+            heapq.heappush(self.heap, (time.monotonic() + delay, next(self.seq), fn, args))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='polybot-delayed', daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.heap or self.heap[0][0] > time.monotonic():
+                    self.condition.wait(self.heap[0][0] - time.monotonic() if self.heap else None)
+                _, _, fn, args = heapq.heappop(self.heap)
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.exception(f"Delayed call failed: {e}")
+
+
+class BackgroundTasks:
+    """
+    Thread pool for side effects the user's reply does not depend on (S3 archive uploads,
+    SQS enqueues). A task counts as failed if it raises or returns a falsy value; it is
+    retried up to ``retries`` times with exponential backoff, then ``on_failure`` is called.
+    """
+
+    def __init__(self, max_threads=None, backoff=None):
+        self.max_threads = max_threads or int(os.environ.get('POLYBOT_BACKGROUND_THREADS', 4))
+        self.backoff = backoff if backoff is not None else float(os.environ.get('POLYBOT_RETRY_BACKOFF', 0.5))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix='polybot-bg')
+
+    def submit(self, fn, *args, retries=0, on_failure=None):
+        # the task stays in the trace of the message that scheduled it
+        return self.executor.submit(tracing.bind(run_with_retries), fn, args, retries, self.backoff, on_failure)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+def run_with_retries(fn, args, retries=0, backoff=0.5, on_failure=None):
+    name = getattr(fn, '__name__', 'task')
+    for attempt in range(retries + 1):
+        if attempt:
+            metrics.BACKGROUND_TASK_RETRIES.labels(task=name).inc()
+            time.sleep(backoff * 2 ** (attempt - 1))
+        try:
+            result = fn(*args)
+            if result:
+                return result
+            logger.warning(f"{name} failed (attempt {attempt + 1}/{retries + 1})")
+        except Exception as e:
+            logger.exception(f"{name} raised on attempt {attempt + 1}/{retries + 1}: {e}")
+
+    metrics.BACKGROUND_TASK_FAILURES.labels(task=name).inc()
+    if on_failure is not None:
+        on_failure()
+    return None